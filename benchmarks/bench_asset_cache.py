@@ -0,0 +1,58 @@
+"""
+Load time of the building/research tables: json sources vs `lokbot.asset_cache`,
+and the import time of `lokbot.enum` before (eager json parsing) and after (lazy tables)
+
+usage: python -m benchmarks.bench_asset_cache
+"""
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from lokbot import project_root
+
+IMPORT_SNIPPETS = {
+    'eager json (before)': 'import lokbot.enum as e; e.load_building_json(); e.load_research_json()',
+    'lazy, untouched': 'import lokbot.enum',
+    'lazy, from cache': 'import lokbot.enum as e; len(e.building_json); len(e.research_json)',
+}
+
+
+def time_subprocess(snippet, repeat=7):
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, '-c', snippet], check=True, cwd=project_root)
+        durations.append(time.perf_counter() - started_at)
+
+    return statistics.median(durations)
+
+
+def main():
+    import lokbot.asset_cache
+    import lokbot.enum
+
+    lokbot.asset_cache.compile_all()
+
+    def load_from_cache():
+        for table in (lokbot.enum.building_json, lokbot.enum.research_json):
+            table._data = None
+            len(table)
+
+    def load_from_json():
+        lokbot.enum.load_building_json()
+        lokbot.enum.load_research_json()
+
+    number = 20
+    from_json = min(timeit.repeat(load_from_json, number=number, repeat=3)) / number
+    from_cache = min(timeit.repeat(load_from_cache, number=number, repeat=3)) / number
+    print(f'tables from json:  {from_json * 1000:.2f} ms')
+    print(f'tables from cache: {from_cache * 1000:.2f} ms  x{from_json / from_cache:.1f}')
+
+    for title, snippet in IMPORT_SNIPPETS.items():
+        print(f'python -c "{snippet}"  ({title}): {time_subprocess(snippet) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare `lokbot.codec.XorCodec` with the legacy per-byte xor of `LokBotApi`
+
+usage: python -m benchmarks.bench_codec
+"""
+import base64
+import gzip
+import json
+import os
+import timeit
+
+from lokbot.codec import XorCodec
+
+XOR_PASSWORD = 'bf9b4cf0f9f99a3a'
+
+PAYLOAD_SIZES = {
+    '1 KB': 1024,
+    '100 KB': 100 * 1024,
+    '2 MB': 2 * 1024 * 1024,
+}
+
+
+def legacy_xor(plain):
+    return bytearray([
+        each_plain ^ ord(XOR_PASSWORD[index % len(XOR_PASSWORD)])
+        for index, each_plain in enumerate(plain)
+    ])
+
+
+def legacy_decode_packs(packs):
+    return json.loads(legacy_xor(base64.b64decode(gzip.decompress(bytearray(packs)))))
+
+
+def make_packs(size):
+    codec = XorCodec(XOR_PASSWORD)
+    objects = []
+    while len(json.dumps({'objects': objects})) < size * 3 // 4:
+        objects.append({
+            '_id': os.urandom(12).hex(),
+            'loc': [61, 1024, 1024],
+            'level': 1,
+            'code': 20100105,
+            'param': {'value': 50000},
+            'state': 1,
+            'expired': '2022-03-11T22:34:23.062Z'
+        })
+
+    return list(gzip.compress(codec.b64xor_enc({'objects': objects}).encode()))
+
+
+def bench(title, legacy_func, new_func, number):
+    legacy = min(timeit.repeat(legacy_func, number=number, repeat=3)) / number
+    new = min(timeit.repeat(new_func, number=number, repeat=3)) / number
+    print(f'{title:<24} legacy: {legacy * 1000:>10.3f} ms  codec: {new * 1000:>8.3f} ms  x{legacy / new:.1f}')
+
+
+def main():
+    codec = XorCodec(XOR_PASSWORD)
+
+    for name, size in PAYLOAD_SIZES.items():
+        number = max(1, 100 * 1024 // size)
+        plain = os.urandom(size)
+        assert bytes(legacy_xor(plain)) == codec.xor(plain)
+
+        bench(f'xor {name}', lambda: legacy_xor(plain), lambda: codec.xor(plain), number)
+
+        packs = make_packs(size)
+        assert legacy_decode_packs(packs) == codec.decode_packs(packs)
+
+        bench(f'decode_packs {name}', lambda: legacy_decode_packs(packs), lambda: codec.decode_packs(packs), number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Decoding of `/field/objects/v4` packets: the former gzip + full parse path
+vs `XorCodec.decode_packs` with and without the target codes
+
+Uses the packets recorded under `data/packets/` (set `record_field_packets` in config.json),
+or synthetic dense zones when there are none. The recordings contain the xor key of the account.
+
+usage: python -m benchmarks.bench_field_decode
+"""
+import base64
+import gzip
+import json
+import os
+import random
+import timeit
+
+from lokbot import project_root
+from lokbot.codec import XorCodec
+from lokbot.enum import OBJECT_CODE_CRYSTAL_MINE, OBJECT_CODE_DRAGON_SOUL_CAVERN
+
+XOR_PASSWORD = 'bf9b4cf0f9f99a3a'
+TARGET_CODES = [OBJECT_CODE_CRYSTAL_MINE, OBJECT_CODE_DRAGON_SOUL_CAVERN]
+
+# everything else a zone is full of: farms, lumber camps, quarries, gold mines, monsters, kingdoms
+OTHER_CODES = [20100101, 20100102, 20100103, 20100104, 20200101, 20200102, 20200103, 20300101]
+
+
+def legacy_decode(codec, packs, codes):
+    objects = json.loads(codec.xor(base64.b64decode(gzip.decompress(bytearray(packs))))).get('objects')
+
+    return [each for each in objects if each.get('code') in codes]
+
+
+def make_object(rng, code):
+    each = {
+        '_id': os.urandom(12).hex(),
+        'loc': [61, rng.randint(0, 2047), rng.randint(0, 2047)],
+        'level': rng.randint(1, 5),
+        'code': code,
+        'param': {'value': rng.randint(10000, 500000)},
+        'state': 1,
+        'expired': '2022-03-11T22:34:23.062Z',
+    }
+    if rng.random() < 0.3:
+        each['occupied'] = {'worldId': 61, 'skin': None, 'name': 'someone', 'allianceTag': 'TAG', 'started': 0}
+
+    return each
+
+
+def synthetic_fixtures(count=50, objects_per_packet=1200, target_ratio=0.01):
+    """
+    9 dense zones per packet, a packet in three has no target at all
+    """
+    rng = random.Random(15)
+    codec = XorCodec(XOR_PASSWORD)
+
+    fixtures = []
+    for index in range(count):
+        ratio = 0 if index % 3 == 0 else target_ratio
+        objects = [
+            make_object(rng, rng.choice(TARGET_CODES) if rng.random() < ratio else rng.choice(OTHER_CODES))
+            for _ in range(objects_per_packet)
+        ]
+        packs = list(gzip.compress(codec.b64xor_enc({'objects': objects}).encode()))
+        fixtures.append({'xor_password': XOR_PASSWORD, 'packs': packs, 'target_codes': TARGET_CODES})
+
+    return fixtures
+
+
+def recorded_fixtures():
+    return [json.loads(path.read_text()) for path in sorted(project_root.joinpath('data/packets').glob('*.json'))]
+
+
+def main():
+    fixtures = recorded_fixtures()
+    source = 'recorded'
+    if not fixtures:
+        fixtures = synthetic_fixtures()
+        source = 'synthetic'
+
+    cases = [
+        (XorCodec(each['xor_password']), each['packs'], set(each['target_codes']))
+        for each in fixtures
+    ]
+    for codec, packs, codes in cases:
+        assert legacy_decode(codec, packs, codes) == codec.decode_packs(packs, codes).get('objects')
+
+    size = sum(len(packs) for _, packs, _ in cases) / len(cases)
+    print(f'{len(cases)} {source} packets, {size / 1024:.1f} KB compressed on average')
+
+    timings = {
+        'legacy (gzip + full parse)': lambda: [legacy_decode(*case) for case in cases],
+        'decode_packs, full parse': lambda: [
+            [each for each in codec.decode_packs(packs).get('objects') if each.get('code') in codes]
+            for codec, packs, codes in cases
+        ],
+        'decode_packs, targets only': lambda: [codec.decode_packs(packs, codes) for codec, packs, codes in cases],
+    }
+
+    baseline = None
+    for title, func in timings.items():
+        per_packet = min(timeit.repeat(func, number=3, repeat=3)) / 3 / len(cases)
+        baseline = baseline or per_packet
+        print(f'{title:<28} {per_packet * 1000:8.3f} ms/packet  {1 / per_packet:8.0f} packets/s  x{baseline / per_packet:.1f}')
+
+
+if __name__ == '__main__':
+    main()
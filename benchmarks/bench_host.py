@@ -0,0 +1,91 @@
+"""
+Memory and CPU per account of the in-process host (`lokbot.app.async_host`)
+at 1, 10 and 100 accounts against a local stand-in server
+
+Every count runs in its own process: the jobs and loops of `config.example.json` (without the sockets
+and `socf_thread`, the stand-in has no socket server) with the job intervals shortened to `job_interval`,
+measured over `window` seconds after a warmup.
+
+usage: python -m benchmarks.bench_host [window_in_seconds] [job_interval_in_seconds]
+"""
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.standin_server import StandInServer, make_token
+
+ACCOUNT_COUNTS = (1, 10, 100)
+WARMUP = 15
+
+
+def child(account_count, base_url, window, job_interval):
+    import psutil
+
+    import lokbot.enum
+    lokbot.enum.API_BASE_URL = base_url
+    lokbot.enum.API_LIVE_BASE_URL = base_url
+
+    from lokbot import logger, project_root
+    logger.remove()
+
+    from lokbot.app import async_host
+
+    main_config = json.loads(project_root.joinpath('config.example.json').read_text()).get('main')
+    jobs = [
+        {**job, 'interval': {'start': job_interval / 60, 'end': job_interval / 60}}
+        for job in main_config.get('jobs') if job.get('name') != 'socf_thread'
+    ]
+    tokens = [make_token(f'{i:024x}') for i in range(account_count)]
+    process = psutil.Process()
+
+    async def measure():
+        baseline_rss = process.memory_info().rss
+        host_task = asyncio.ensure_future(
+            async_host(tokens, {}, jobs, main_config.get('threads'), sockets=False, account_log=False)
+        )
+
+        await asyncio.sleep(WARMUP)
+        cpu_times, started_at = process.cpu_times(), time.perf_counter()
+        await asyncio.sleep(window)
+        cpu_times_end, elapsed = process.cpu_times(), time.perf_counter() - started_at
+
+        host_task.cancel()
+
+        return {
+            'accounts': account_count,
+            'baseline_rss': baseline_rss,
+            'rss': process.memory_info().rss,
+            'cpu': (cpu_times_end.user + cpu_times_end.system - cpu_times.user - cpu_times.system) / elapsed,
+        }
+
+    print(json.dumps(asyncio.run(measure())))
+
+
+def main(window=30.0, job_interval=60.0):
+    results = []
+    with StandInServer(latency=0.05) as server:
+        for account_count in ACCOUNT_COUNTS:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_host', '--child',
+                 str(account_count), server.base_url, str(window), str(job_interval)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'window: {window:.0f}s, job interval: {job_interval:.0f}s, stand-in latency: 50 ms')
+    print(f'{"accounts":>8} {"rss MiB":>9} {"MiB/account":>12} {"cpu %":>7} {"cpu %/account":>14}')
+    for result in results:
+        accounts = result['accounts']
+        rss = result['rss'] / 2 ** 20
+        marginal = (result['rss'] - result['baseline_rss']) / 2 ** 20 / accounts
+        cpu = result['cpu'] * 100
+        print(f'{accounts:>8} {rss:>9.1f} {marginal:>12.2f} {cpu:>7.1f} {cpu / accounts:>14.3f}')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(int(sys.argv[2]), sys.argv[3], float(sys.argv[4]), float(sys.argv[5]))
+    else:
+        main(*[float(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,152 @@
+"""
+Speedup allocation: the former greedy passes vs `lokbot.speedup.optimal_speedups`
+over random inventories shaped like real accounts (many small items, few large ones)
+
+usage: python -m benchmarks.bench_speedup [cases]
+"""
+import itertools
+import random
+import statistics
+import sys
+import time
+
+from lokbot.speedup import optimal_speedups
+
+DURATIONS = (60, 300, 600, 1800, 3600, 10800, 28800, 86400)
+
+# typical amounts of a mid game account, per duration
+AMOUNT_RANGES = {
+    60: (0, 300),
+    300: (0, 200),
+    600: (0, 150),
+    1800: (0, 60),
+    3600: (0, 40),
+    10800: (0, 10),
+    28800: (0, 6),
+    86400: (0, 3),
+}
+
+
+# need_seconds, inventory: largest-first greedy stops short on these
+GREEDY_TRAPS = (
+    (9 * 3600, {1: (28800, 1), 2: (10800, 3)}),
+    (2 * 3600, {1: (5400, 1), 2: (3600, 2)}),
+)
+
+
+def legacy_speedups(need_seconds, inventory, recover=False):
+    """
+    the greedy largest-first pass and the ascending pass for `recover` this module replaces
+    """
+    speedups = sorted(
+        ({'code': code, 'second': second, 'amount': amount} for code, (second, amount) in inventory.items()),
+        key=lambda x: x.get('second'), reverse=True
+    )
+    counts = {each.get('code'): 0 for each in speedups}
+
+    remaining_seconds = need_seconds
+    used_seconds = 0
+    for each in speedups:
+        while remaining_seconds >= each.get('second') and counts.get(each.get('code')) < each.get('amount'):
+            remaining_seconds -= each.get('second')
+            counts[each.get('code')] += 1
+            used_seconds += each.get('second')
+
+    if recover:
+        for each in sorted(speedups, key=lambda x: x.get('second')):
+            while remaining_seconds >= 0 and counts.get(each.get('code')) < each.get('amount'):
+                remaining_seconds -= each.get('second')
+                counts[each.get('code')] += 1
+                used_seconds += each.get('second')
+
+    return {'counts': {k: v for k, v in counts.items() if v > 0}, 'used_seconds': used_seconds}
+
+
+def random_inventory(rng, min_duration=0):
+    inventory = {}
+    for code, second in enumerate(DURATIONS):
+        if second < min_duration:
+            continue
+
+        low, high = AMOUNT_RANGES[second]
+        # type-specific and universal items, some durations already used up
+        if rng.random() < 0.6:
+            inventory[code] = (second, rng.randint(low, high) // 2)
+        if rng.random() < 0.4:
+            inventory[100 + code] = (second, rng.randint(low, high) // 4)
+
+    return inventory
+
+
+def random_need(rng):
+    # building/research timers from a few minutes up to a couple of weeks, at second precision
+    return int(rng.choice((600, 3600, 4 * 3600, 86400, 7 * 86400)) * rng.uniform(0.5, 2))
+
+
+def summarize(name, results, durations):
+    # inventories too small for the duration use everything either way
+    waste = [each['waste'] for each in results if each['covered']]
+    calls = [each['calls'] for each in results]
+    items = [each['items'] for each in results]
+    print(
+        f'  {name:8} waste: mean {statistics.mean(waste):7.0f}s p90 {sorted(waste)[len(waste) * 9 // 10]:6.0f}s '
+        f'max {max(waste):6.0f}s | '
+        f'calls: {statistics.mean(calls):4.2f} | items: {statistics.mean(items):7.1f} | '
+        f'time: median {statistics.median(durations) * 1000:6.2f} ms max {max(durations) * 1000:6.2f} ms'
+    )
+
+
+def evaluate(plan, need_seconds, inventory, recover):
+    counts = plan.get('counts', {}) if plan else {}
+    used_seconds = plan.get('used_seconds', 0) if plan else 0
+
+    if recover:
+        # overshoot, or the part left uncovered
+        waste = abs(used_seconds - need_seconds)
+    else:
+        waste = need_seconds - used_seconds if used_seconds <= need_seconds else float('inf')
+
+    return {
+        'waste': waste,
+        'covered': sum(second * amount for second, amount in inventory.values()) > need_seconds,
+        'calls': len(counts),
+        'items': sum(counts.values()),
+    }
+
+
+def main(cases=500):
+    rng = random.Random(7)
+    profiles = {
+        'all durations': [(random_need(rng), random_inventory(rng)) for _ in range(cases)],
+        # the small items go first, older accounts are often left with 1h+ only
+        '1h and longer only': [(random_need(rng), random_inventory(rng, 3600)) for _ in range(cases)],
+    }
+
+    for (profile, cases), recover in itertools.product(profiles.items(), (False, True)):
+        mode = 'recover, cover at least the duration' if recover else 'building/research/train, never exceed'
+        print(f'{profile} ({mode})')
+        for name, solve in (
+                ('greedy', lambda need, inventory: legacy_speedups(need, inventory, recover)),
+                ('optimal', lambda need, inventory: optimal_speedups(
+                    need, inventory, at_least=recover, preferred=[code for code in inventory if code < 100]
+                )),
+        ):
+            results = []
+            durations = []
+            for need_seconds, inventory in cases:
+                started_at = time.perf_counter()
+                plan = solve(need_seconds, inventory)
+                durations.append(time.perf_counter() - started_at)
+                results.append(evaluate(plan, need_seconds, inventory, recover))
+
+            summarize(name, results, durations)
+
+    print('greedy traps (never exceed)')
+    for need_seconds, inventory in GREEDY_TRAPS:
+        greedy = legacy_speedups(need_seconds, inventory).get('used_seconds')
+        optimal = optimal_speedups(need_seconds, inventory).get('used_seconds')
+        print(f'  need {need_seconds}s: greedy uses {greedy}s, optimal uses {optimal}s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
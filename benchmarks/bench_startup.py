@@ -0,0 +1,40 @@
+"""
+Time of `LokFarmer.__init__` against a local stand-in server,
+sequential handshake (startup_concurrency=1) vs the parallel one
+
+usage: python -m benchmarks.bench_startup [latency_in_seconds]
+"""
+import statistics
+import sys
+import time
+
+from benchmarks.standin_server import StandInServer, make_token
+
+
+def measure(startup_concurrency, repeat=5):
+    from lokbot.farmer import LokFarmer
+
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        LokFarmer(make_token(), {}, startup_concurrency=startup_concurrency)
+        durations.append(time.perf_counter() - started_at)
+
+    return statistics.median(durations)
+
+
+def main(latency=0.05):
+    from lokbot import logger
+    logger.remove()
+
+    with StandInServer(latency):
+        sequential = measure(1)
+        parallel = measure(4)
+
+    print(f'latency: {latency * 1000:.0f} ms per request')
+    print(f'sequential handshake: {sequential * 1000:.1f} ms')
+    print(f'parallel handshake:   {parallel * 1000:.1f} ms  x{sequential / parallel:.2f}')
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
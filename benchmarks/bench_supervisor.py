@@ -0,0 +1,136 @@
+"""
+CPU of the parent and lines received for hundreds of fake bot processes,
+`lokbot.supervisor.Supervisor` vs the former non-blocking pipes polled every 100 ms (`discord_bot.monitor_logs`)
+
+Each fake child prints `lines` numbered lines, one every `line_interval` seconds, then idles;
+every 10th child exits with code 1 instead, the supervisor restarts it.
+A line is malformed when it was split or merged on the way, lost when its number never arrived.
+
+usage: python -m benchmarks.bench_supervisor [children] [window_in_seconds]
+"""
+import asyncio
+import fcntl
+import os
+import re
+import subprocess
+import sys
+import time
+
+import psutil
+
+LINES = 50
+LINE_INTERVAL = 0.05
+LINE_PADDING = 200
+LINE_PATTERN = re.compile(rf'^(\d+) (\d+) x{{{LINE_PADDING}}}$')
+
+CHILD_SCRIPT = f'''
+import sys, time
+child_id, crash = int(sys.argv[1]), sys.argv[2] == '1'
+for i in range({LINES}):
+    print(child_id, i, 'x' * {LINE_PADDING}, flush=True)
+    time.sleep({LINE_INTERVAL})
+if crash:
+    sys.exit(1)
+time.sleep(3600)
+'''
+
+
+def child_argv(child_id):
+    return [sys.executable, '-c', CHILD_SCRIPT, str(child_id), '1' if child_id % 10 == 0 else '0']
+
+
+class Tally:
+    def __init__(self):
+        self.received = {}  # child_id: set of line numbers
+        self.malformed = 0
+
+    def add(self, line):
+        match = LINE_PATTERN.match(line)
+        if match is None:
+            self.malformed += 1
+            return
+
+        self.received.setdefault(int(match.group(1)), set()).add(int(match.group(2)))
+
+    def lost(self, child_count):
+        return sum(LINES - len(self.received.get(child_id, ())) for child_id in range(child_count))
+
+
+async def measure(run, child_count, window):
+    process = psutil.Process()
+    tally = Tally()
+
+    cpu_times, started_at = process.cpu_times(), time.perf_counter()
+    extra = await run(child_count, window, tally)
+    cpu_times_end, elapsed = process.cpu_times(), time.perf_counter() - started_at
+
+    return {
+        'cpu': (cpu_times_end.user + cpu_times_end.system - cpu_times.user - cpu_times.system) / elapsed,
+        'lost': tally.lost(child_count),
+        'malformed': tally.malformed,
+        **extra,
+    }
+
+
+async def run_supervisor(child_count, window, tally):
+    import lokbot.supervisor
+    lokbot.supervisor.RESTART_DELAY = (1, 1)
+
+    async def on_line(child, stream, line):
+        tally.add(line)
+
+    supervisor = lokbot.supervisor.Supervisor()
+    for child_id in range(child_count):
+        supervisor.start(child_id, child_argv(child_id), on_line=on_line)
+
+    await asyncio.sleep(window)
+    stats = supervisor.stats()
+    await supervisor.stop_all()
+
+    return {'restarts': stats['restarts'], 'exit_reasons': stats['exit_reasons']}
+
+
+async def run_polling(child_count, window, tally):
+    async def monitor(process):
+        fd = process.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        while process.poll() is None:
+            try:
+                output = process.stdout.readline()
+                if output:
+                    tally.add(output.strip())
+            except (BlockingIOError, IOError):
+                pass
+
+            await asyncio.sleep(0.1)
+
+    processes = [
+        subprocess.Popen(child_argv(child_id), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for child_id in range(child_count)
+    ]
+    tasks = [asyncio.ensure_future(monitor(process)) for process in processes]
+
+    await asyncio.sleep(window)
+    [task.cancel() for task in tasks]
+    for process in processes:
+        process.kill()
+        process.wait()
+
+    return {'restarts': 0, 'exit_reasons': {}}
+
+
+def main(child_count=200, window=20.0):
+    from lokbot import logger
+    logger.remove()
+
+    child_count = int(child_count)
+    print(f'{child_count} children, {LINES} lines each every {LINE_INTERVAL * 1000:.0f} ms, {window:.0f}s window')
+    for name, run in (('polling 100 ms', run_polling), ('supervisor', run_supervisor)):
+        result = asyncio.run(measure(run, child_count, window))
+        print(f'{name:<15} cpu {result["cpu"] * 100:6.1f}%  lost {result["lost"]:6d}  '
+              f'malformed {result["malformed"]:5d}  restarts {result["restarts"]:4d}  {result["exit_reasons"]}')
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
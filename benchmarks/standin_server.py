@@ -0,0 +1,120 @@
+"""
+Local stand-in of the game api for benchmarks
+
+Every request is answered after `latency` seconds with a canned response,
+unknown endpoints get `{"result": true}`.
+"""
+import base64
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+import jwt
+
+XOR_PASSWORD = 'bf9b4cf0f9f99a3a'
+
+
+def make_token(_id='000000000000000000000000'):
+    return jwt.encode({'_id': _id, 'kingdomId': _id, 'worldId': 1}, 'stand-in')
+
+
+def kingdom_enter_response():
+    return {
+        'result': True,
+        'kingdom': {
+            '_id': 'kingdom',
+            'worldId': 1,
+            'allianceId': 'alliance',
+            'level': 15,
+            'loc': [1, 1024, 1024],
+            'fieldObjectId': 'field_object',
+            'resources': [1000000, 1000000, 1000000, 1000000],
+            'vip': {'level': 5},
+            'dragoActionPoint': {'value': 0},
+            'buildings': [
+                {'code': 40100101, 'position': 1, 'level': 15, 'state': 1},
+                {'code': 40100105, 'position': 5, 'level': 15, 'state': 1},
+            ],
+        },
+        'networks': {'kingdoms': [], 'fields': [], 'chats': []},
+    }
+
+
+ROUTES = {
+    'auth/connect': lambda: {
+        'result': True,
+        'token': make_token(),
+        'lstProtect': base64.b64encode(json.dumps([]).encode()).decode(),
+        'regionHash': base64.b64encode(json.dumps(f'region-{XOR_PASSWORD}').encode()).decode(),
+    },
+    'kingdom/enter': kingdom_enter_response,
+    'drago/lair/list': lambda: {'result': True, 'dragos': []},
+    'kingdom/task/all': lambda: {'result': True, 'kingdomTasks': []},
+    'item/list': lambda: {'result': True, 'items': []},
+    'kingdom/arcademy/research/list': lambda: {'result': True, 'researches': []},
+    'quest/list': lambda: {'result': True, 'mainQuests': [], 'sideQuests': []},
+    'quest/list/daily': lambda: {'result': True, 'dailyQuest': {'quests': [], 'rewards': []}},
+    'event/list': lambda: {'result': True, 'events': []},
+    'kingdom/wall/info': lambda: {'result': True, 'wall': {}},
+    'kingdom/hospital/wounded': lambda: {'result': True, 'wounded': []},
+    'kingdom/vip/info': lambda: {'result': True, 'vip': {'isClaimed': True}},
+    'kingdom/caravan/list': lambda: {'result': True, 'caravan': {'items': []}},
+    'item/freechest': lambda: {'result': False, 'err': {'code': 'free_chest_not_yet'}},
+}
+
+
+class StandInServer:
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                api_path = urllib.parse.urlparse(self.path).path.split('/api/').pop()
+
+                with server._lock:
+                    server.request_count += 1
+
+                time.sleep(server.latency)
+                body = json.dumps(ROUTES.get(api_path, lambda: {'result': True})()).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            # the default backlog of 5 drops the connects of many accounts starting at once
+            request_queue_size = 1024
+
+            def handle_error(self, request, client_address):
+                # clients going away mid-request, e.g. a benchmark process exiting
+                pass
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/api/'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+        import lokbot.enum
+        lokbot.enum.API_BASE_URL = self.base_url
+        lokbot.enum.API_LIVE_BASE_URL = self.base_url
+
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
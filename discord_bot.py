@@ -1,13 +1,12 @@
 import discord
 from discord import app_commands
 import os
-import subprocess
+import sys
 import json
-import asyncio
 from dotenv import load_dotenv
+from lokbot.supervisor import Supervisor
 from lokbot.util import decode_jwt
 import logging
-import psutil
 import http.server
 import threading
 
@@ -19,8 +18,8 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Bot processes dictionary to track running instances
-bot_processes = {}
+# Running instances by discord user id, restarted with backoff when they exit
+supervisor = Supervisor()
 
 # Discord bot setup
 intents = discord.Intents.default()
@@ -33,8 +32,8 @@ async def start_bot(interaction: discord.Interaction, token: str):
     user_id = str(interaction.user.id)
 
     # Check if this user already has a bot running
-    if user_id in bot_processes and bot_processes[user_id]["process"].poll(
-    ) is None:
+    child = supervisor.get(user_id)
+    if child is not None and child.alive:
         await interaction.response.send_message(
             "You already have a bot running! Stop it first with `/stop`",
             ephemeral=True)
@@ -84,24 +83,17 @@ async def start_bot(interaction: discord.Interaction, token: str):
                 await interaction.followup.send("Token appears to be invalid (too short). Please check your token and try again.", ephemeral=True)
             return
 
-        process = subprocess.Popen(["python", "-m", "lokbot", token],
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   text=True)
-
-        bot_processes[user_id] = {
-            "process": process,
-            "token": token,
-            "config_path": config_path
-        }
+        status_reporter = StatusReporter(interaction.user)
+        supervisor.start(user_id, [sys.executable, "-m", "lokbot", token],
+                         on_line=status_reporter.on_line,
+                         on_exit=status_reporter.on_exit)
 
         # Send confirmation if interaction is still valid
         if interaction_valid:
             await interaction.followup.send(f"LokBot started successfully! Check your DMs for status updates.",
                                             ephemeral=True)
 
-        # Start log monitoring
-        asyncio.create_task(monitor_logs(interaction.user, process))
+        await status_reporter.send("✅ Your LokBot is starting up...")
 
     except Exception as e:
         logger.error(f"Error starting bot: {str(e)}")
@@ -114,7 +106,7 @@ async def start_bot(interaction: discord.Interaction, token: str):
 async def stop_bot(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
 
-    if user_id not in bot_processes:
+    if supervisor.get(user_id) is None:
         await interaction.response.send_message(
             "You don't have a bot running!", ephemeral=True)
         return
@@ -128,23 +120,14 @@ async def stop_bot(interaction: discord.Interaction):
             # Interaction already timed out or doesn't exist
             interaction_valid = False
 
-        # Terminate the process
-        process = bot_processes[user_id]["process"]
-        if process.poll() is None:  # Process is still running
-            process.terminate()
-            try:
-                process.wait(timeout=5)  # Wait for process to terminate
-            except subprocess.TimeoutExpired:
-                process.kill()  # Force kill if needed
+        # Terminate the process, killed if still running after 5 seconds
+        await supervisor.stop(user_id)
 
         # Send confirmation only if interaction is still valid
         if interaction_valid:
             await interaction.followup.send("LokBot stopped successfully",
                                             ephemeral=True)
 
-        # Clean up
-        del bot_processes[user_id]
-
     except Exception as e:
         logger.error(f"Error stopping bot: {str(e)}")
         if interaction_valid:
@@ -166,15 +149,22 @@ async def status(interaction: discord.Interaction):
             interaction_valid = False
             return
 
-        if user_id in bot_processes:
-            process = bot_processes[user_id]["process"]
-            if process.poll() is None:  # Process is still running
+        child = supervisor.get(user_id)
+        if child is not None:
+            if child.running:
+                stats = child.sample()
+                message = "Your LokBot is currently running"
+                if stats:
+                    message += (f" ({stats['rss'] / 2 ** 20:.0f} MiB, {stats['cpu_percent']:.1f}% CPU,"
+                                f" up {stats['uptime'] / 60:.0f} min, {child.restarts} restarts)")
+                await interaction.followup.send(message, ephemeral=True)
+            elif child.alive:
                 await interaction.followup.send(
-                    "Your LokBot is currently running", ephemeral=True)
+                    "Your LokBot exited and is about to restart", ephemeral=True)
             else:
                 await interaction.followup.send(
                     "Your LokBot process has ended", ephemeral=True)
-                del bot_processes[user_id]
+                await supervisor.stop(user_id)
         else:
             await interaction.followup.send("You don't have a LokBot running",
                                             ephemeral=True)
@@ -185,100 +175,61 @@ async def status(interaction: discord.Interaction):
                                             ephemeral=True)
 
 
-async def monitor_logs(user, process):
-    """Monitor bot status and display only essential status updates"""
-    try:
-        await user.send("✅ Your LokBot is starting up...")
-        
-        auth_error_detected = False
-        startup_complete = False
-        output_buffer = []
-        
-        # Set subprocess pipes to non-blocking mode
-        import fcntl
-        import os
-        
-        # Set stdout to non-blocking
-        stdout_fd = process.stdout.fileno()
-        fl = fcntl.fcntl(stdout_fd, fcntl.F_GETFL)
-        fcntl.fcntl(stdout_fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-        
-        # Set stderr to non-blocking
-        stderr_fd = process.stderr.fileno()
-        fl = fcntl.fcntl(stderr_fd, fcntl.F_GETFL)
-        fcntl.fcntl(stderr_fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-        
-        while True:
-            # Check if process has ended
-            if process.poll() is not None:
-                # Process ended - check if we have an error message
-                if not startup_complete and output_buffer:
-                    error_message = "❌ LokBot failed to start properly. Possible issues:\n"
-                    error_message += "- Invalid or expired token\n"
-                    error_message += "- API connection problems\n"
-                    error_message += "- Server authentication issues\n\n"
-                    error_message += "Check the logs for details and try again with a new token."
-                    await user.send(error_message)
-                break
-
-            # Try to read output without blocking
-            try:
-                output = process.stdout.readline()
-                if output:
-                    stripped_output = output.strip()
-                    logger.info(f"LokBot Output: {stripped_output}")
-                    
-                    # Store recent outputs for error analysis
-                    output_buffer.append(stripped_output)
-                    if len(output_buffer) > 10:  # Keep only the last 10 messages
-                        output_buffer.pop(0)
-                    
-                    # Check for successful startup
-                    if "kingdom/enter" in stripped_output and "result\": true" in stripped_output:
-                        if not startup_complete:
-                            startup_complete = True
-                            await user.send("✅ LokBot has successfully connected to the game server!")
-            except (BlockingIOError, IOError):
-                # No data available right now, continue
-                pass
-
-            # Try to read errors without blocking
-            try:
-                error = process.stderr.readline()
-                if error:
-                    stripped_error = error.strip()
-                    logger.error(f"LokBot Error: {stripped_error}")
-                    
-                    # Detect auth errors
-                    if "NoAuthException" in stripped_error or "auth/connect" in stripped_error:
-                        auth_error_detected = True
-                        # Send auth error message
-                        await user.send("❌ Authentication failed! Your token appears to be invalid or expired. Please get a new token and try again.")
-                        return
-                    
-                    # Only send critical errors to Discord
-                    if "CRITICAL" in stripped_error or "ERROR" in stripped_error or "FATAL" in stripped_error:
-                        try:
-                            error_message = "❌ Critical error detected. Check logs for details."
-                            await user.send(error_message)
-                        except discord.errors.HTTPException as e:
-                            logger.error(f"Failed to send Discord error message: {str(e)}")
-            except (BlockingIOError, IOError):
-                # No data available right now, continue
-                pass
-
-            # Wait a bit before checking again
-            await asyncio.sleep(0.1)
-
-        # Notify when the process has ended
-        await user.send("❌ Your LokBot has stopped running.")
-    except Exception as e:
-        logger.error(f"Error in status monitoring: {str(e)}")
+class StatusReporter:
+    """Turns the output of one LokBot process into essential status updates sent to its user"""
+
+    def __init__(self, user):
+        self.user = user
+        self.startup_complete = False
+
+    async def send(self, message):
         try:
-            # Use a shorter message to avoid potential Discord issues
-            await user.send("❌ Error monitoring LokBot status. Check server logs for details.")
-        except:
-            logger.error("Failed to send error message to user")
+            await self.user.send(message)
+        except discord.errors.HTTPException as e:
+            logger.error(f"Failed to send Discord message: {str(e)}")
+
+    async def on_line(self, child, stream, line):
+        if stream == "stdout":
+            logger.info(f"LokBot Output: {line}")
+
+            # Check for successful startup
+            if not self.startup_complete and "kingdom/enter" in line and "result\": true" in line:
+                self.startup_complete = True
+                await self.send("✅ LokBot has successfully connected to the game server!")
+            return
+
+        logger.error(f"LokBot Error: {line}")
+
+        # Detect auth errors, restarting would not help
+        if "NoAuthException" in line or "auth/connect" in line:
+            child.give_up("no_auth")
+            await self.send("❌ Authentication failed! Your token appears to be invalid or expired. "
+                            "Please get a new token and try again.")
+            return
+
+        # Only send critical errors to Discord
+        if "CRITICAL" in line or "ERROR" in line or "FATAL" in line:
+            await self.send("❌ Critical error detected. Check logs for details.")
+
+    async def on_exit(self, child, reason, restart_delay):
+        if reason == "no_auth":
+            return
+
+        if reason == "stopped":
+            await self.send("❌ Your LokBot has stopped running.")
+            return
+
+        if not self.startup_complete:
+            error_message = "❌ LokBot failed to start properly. Possible issues:\n"
+            error_message += "- Invalid or expired token\n"
+            error_message += "- API connection problems\n"
+            error_message += "- Server authentication issues\n\n"
+            error_message += "Check the logs for details and try again with a new token."
+            await self.send(error_message)
+
+        # the next run reports its startup again
+        self.startup_complete = False
+        await self.send(f"❌ Your LokBot has stopped running ({reason}), restarting in {restart_delay} seconds.")
 
 
 @client.event
@@ -1,10 +1,13 @@
 import asyncio
 import functools
+import json
+import pathlib
 import threading
 import time
 
 import schedule
 
+import lokbot.events
 import lokbot.util
 from lokbot import project_root, logger, config
 from lokbot.async_farmer import AsyncLokFarmer
@@ -23,6 +26,9 @@ def find_alliance(farmer: LokFarmer):
         time.sleep(60 * 5)
 
 
+# seconds before a failed account of the host restarts, doubled up to the second
+HOST_RESTART_DELAY = (30, 600)
+
 thread_map = {}
 
 
@@ -35,15 +41,122 @@ def run_threaded(name, job_func):
     job_thread.start()
 
 
-def async_main(token):
-    async_farmer = AsyncLokFarmer(token)
+async def start_async_farmer(token, captcha_solver_config=None) -> AsyncLokFarmer:
+    """
+    start a farmer with the token saved in `data/` if still valid, with `token` otherwise
+    :param token:
+    :param captcha_solver_config:
+    :return:
+    """
+    _id = lokbot.util.decode_jwt(token).get('_id')
+    token_file = project_root.joinpath(f'data/{_id}.token')
+
+    if token_file.exists():
+        token_from_file = token_file.read_text()
+        logger.info(f'Using token: {token_from_file} from file: {token_file}')
+        try:
+            farmer = AsyncLokFarmer(token_from_file, captcha_solver_config)
+            await farmer.start()
+
+            return farmer
+        except NoAuthException:
+            logger.info('Token is invalid, using token from environment')
+
+    farmer = AsyncLokFarmer(token, captcha_solver_config)
+    await farmer.start()
+
+    return farmer
+
+
+async def async_main(token, captcha_solver_config=None):
+    """
+    `main` on the asyncio runtime, every socket, job and loop of the account is a task of one event loop
+    :param token:
+    :param captcha_solver_config:
+    :return:
+    """
+    farmer = await start_async_farmer(token, captcha_solver_config)
+
+    await farmer.run(config.get('main').get('jobs'), config.get('main').get('threads'))
+
+
+def load_tokens(tokens_file):
+    """
+    :param tokens_file: json list of tokens, or {name: token}
+    :return: list of tokens
+    """
+    tokens = json.loads(pathlib.Path(tokens_file).read_text())
+    if isinstance(tokens, dict):
+        tokens = list(tokens.values())
 
-    asyncio.run(async_farmer.parallel_buy_caravan())
+    return tokens
 
 
-def main(token=None, captcha_solver_config=None):
-    # async_main(token)
-    # exit()
+async def run_account(token, captcha_solver_config=None, jobs=None, threads=None, sockets=True, account_log=True):
+    """
+    one account of the host, restarted with backoff when it fails and stopped when its token is no longer valid
+    Its log records carry `extra['account']` and also go to `data/account_{_id}.log`.
+    :return:
+    """
+    _id = lokbot.util.decode_jwt(token).get('_id')
+    jobs = config.get('main').get('jobs') if jobs is None else jobs
+    threads = config.get('main').get('threads') if threads is None else threads
+
+    sink_id = None
+    if account_log:
+        sink_id = logger.add(
+            project_root.joinpath(f'data/account_{_id}.log'), rotation='1 hour', retention=48,
+            filter=lambda record: record['extra'].get('account') == _id
+        )
+    restart_delay = HOST_RESTART_DELAY[0]
+
+    try:
+        with logger.contextualize(account=_id):
+            while True:
+                try:
+                    farmer = await start_async_farmer(token, captcha_solver_config)
+                    restart_delay = HOST_RESTART_DELAY[0]
+                    await farmer.run(jobs, threads, sockets)
+                except NoAuthException:
+                    logger.error(f'account {_id}: token is no longer valid, stopped')
+                    return
+                except Exception as e:
+                    logger.exception(f'account {_id} failed, restarting in {restart_delay}s: {e}')
+
+                await asyncio.sleep(restart_delay)
+                restart_delay = min(restart_delay * 2, HOST_RESTART_DELAY[1])
+    finally:
+        if sink_id is not None:
+            logger.remove(sink_id)
+
+
+async def async_host(tokens, captcha_solver_config=None, jobs=None, threads=None, sockets=True, account_log=True):
+    """
+    run every account of `tokens` on this event loop, sharing the asset tables, land rasters and the http pool
+    :return:
+    """
+    await asyncio.gather(*[
+        run_account(token, captcha_solver_config, jobs, threads, sockets, account_log) for token in tokens
+    ])
+
+
+def host(tokens_file, captcha_solver_config=None):
+    """
+    host mode, `python -m lokbot --tokens_file=data/tokens.json`
+    :param tokens_file:
+    :param captcha_solver_config:
+    :return:
+    """
+    tokens = load_tokens(tokens_file)
+    logger.info(f'hosting {len(tokens)} accounts from {tokens_file}')
+
+    asyncio.run(async_host(tokens, captcha_solver_config or {}))
+
+
+def main(token=None, captcha_solver_config=None, tokens_file=None):
+    if tokens_file is not None:
+        host(tokens_file, captcha_solver_config)
+        return
 
     if captcha_solver_config is None:
         captcha_solver_config = {}
@@ -56,6 +169,10 @@ def main(token=None, captcha_solver_config=None):
             logger.error("No AUTH_TOKEN found in environment variables. Please add it to Secrets.")
             return
 
+    if config.get('main').get('runtime', 'threads') == 'asyncio':
+        asyncio.run(async_main(token, captcha_solver_config))
+        return
+
     _id = lokbot.util.decode_jwt(token).get('_id')
     token_file = project_root.joinpath(f'data/{_id}.token')
     if token_file.exists():
@@ -72,29 +189,45 @@ def main(token=None, captcha_solver_config=None):
     threading.Thread(target=farmer.sock_thread, daemon=True).start()
     threading.Thread(target=farmer.socc_thread, daemon=True).start()
 
-    farmer.keepalive_request()
+    # keepalive requests are independent of the jobs, do not hold the jobs back
+    threading.Thread(target=farmer.keepalive_request, daemon=True).start()
 
-    for job in config.get('main').get('jobs'):
+    for job in lokbot.events.with_default_triggers(config.get('main').get('jobs')):
         if not job.get('enabled'):
             continue
 
         name = job.get('name')
-
-        schedule.every(
-            job.get('interval').get('start')
-        ).to(
-            job.get('interval').get('end')
-        ).minutes.do(run_threaded, name, functools.partial(getattr(farmer, name), **job.get('kwargs', {})))
+        job_func = farmer.recording_first_action(functools.partial(getattr(farmer, name), **job.get('kwargs', {})))
+
+        if job.get('interval'):
+            schedule.every(
+                job.get('interval').get('start')
+            ).to(
+                job.get('interval').get('end')
+            ).minutes.do(run_threaded, name, job_func)
+
+        # runs right after the kingdom events, see `lokbot.events`
+        triggers = job.get('triggers')
+        if triggers:
+            farmer.on_events(
+                name, triggers, functools.partial(run_threaded, name, job_func),
+                job.get('debounce', lokbot.events.DEFAULT_DEBOUNCE), job.get('min_interval', 0)
+            )
 
     schedule.run_all()
 
     # schedule.every(15).to(20).minutes.do(farmer.keepalive_request)
 
-    for thread in config.get('main').get('threads'):
-        if not thread.get('enabled'):
-            continue
+    threads = [thread for thread in config.get('main').get('threads') if thread.get('enabled')]
+    # a loop can hold its worker for long (speedups, rate limits, retries), keep the others free for the jobs
+    farmer.scheduler.add_workers(len(threads))
 
-        threading.Thread(target=getattr(farmer, thread.get('name')), kwargs=thread.get('kwargs'), daemon=True).start()
+    for thread in threads:
+        # the loops reschedule themselves on the process scheduler
+        farmer.schedule(
+            thread.get('name'), 0, farmer.recording_first_action(getattr(farmer, thread.get('name'))),
+            **(thread.get('kwargs') or {})
+        )
 
     while True:
         schedule.run_pending()
@@ -0,0 +1,168 @@
+"""
+Precompiled cache of the json asset tables
+
+Tables are built from their source json once and stored with `marshal` under `data/`,
+behind a header holding the mtime, size and sha1 of every source file.
+A cache is used only when all of its sources are unchanged and it was written by the same python.
+
+build all caches ahead of time: python -m lokbot.asset_cache
+"""
+import collections.abc
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import threading
+
+from lokbot import project_root
+
+FORMAT_VERSION = 1
+
+# every `LazyTable` created, name: table
+tables = {}
+
+
+def _file_hash(path):
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def _source_stamps(sources):
+    stamps = {}
+    for path in sources:
+        stat = os.stat(path)
+        stamps[str(path.relative_to(project_root))] = (stat.st_mtime_ns, stat.st_size, _file_hash(path))
+
+    return stamps
+
+
+def _is_fresh(header, sources):
+    if header.get('format') != FORMAT_VERSION or header.get('python') != tuple(sys.version_info[:2]):
+        return False
+
+    stamps = header.get('sources', {})
+    if set(stamps) != {str(path.relative_to(project_root)) for path in sources}:
+        return False
+
+    for path in sources:
+        mtime_ns, size, sha1 = stamps[str(path.relative_to(project_root))]
+        stat = os.stat(path)
+
+        if stat.st_size != size:
+            return False
+
+        # touched but maybe not changed (e.g. a fresh checkout), compare contents
+        if stat.st_mtime_ns != mtime_ns and _file_hash(path) != sha1:
+            return False
+
+    return True
+
+
+class LazyTable(collections.abc.Mapping):
+    """
+    Read-only mapping loaded on first access, from the cache when it is fresh,
+    otherwise built by `build` and written back to the cache
+    """
+
+    def __init__(self, name, sources, build):
+        """
+        :param name: cache file is `data/assets_{name}.marshal`
+        :param sources: paths of the json files the table is built from
+        :param build: returns the table from the sources
+        """
+        self.name = name
+        self.sources = sources
+        self.build = build
+        self.cache_path = project_root.joinpath(f'data/assets_{name}.marshal')
+
+        self._lock = threading.Lock()
+        self._data = None
+
+        tables[name] = self
+
+    def _read_cache(self):
+        try:
+            raw = memoryview(self.cache_path.read_bytes())
+            header_length = int.from_bytes(raw[:4], 'little')
+            header = marshal.loads(raw[4:4 + header_length])
+            if not _is_fresh(header, self.sources):
+                return None
+
+            return marshal.loads(raw[4 + header_length:])
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            return None
+
+    def _write_cache(self, data):
+        header = {
+            'format': FORMAT_VERSION,
+            'python': tuple(sys.version_info[:2]),
+            'sources': _source_stamps(self.sources),
+        }
+
+        header = marshal.dumps(header)
+
+        # [header length: 4 bytes][header][table]
+        # a temp file of its own, other processes may write the same cache
+        with tempfile.NamedTemporaryFile(
+                dir=self.cache_path.parent, prefix=self.cache_path.name, suffix='.tmp', delete=False
+        ) as tmp:
+            tmp.write(len(header).to_bytes(4, 'little') + header + marshal.dumps(data))
+        os.replace(tmp.name, self.cache_path)
+
+    def compile(self):
+        """
+        (re)build the table from its sources and write the cache
+        :return:
+        """
+        data = self.build()
+        self._write_cache(data)
+        self._data = data
+
+        return data
+
+    def _load(self):
+        if self._data is not None:
+            return self._data
+
+        with self._lock:
+            if self._data is None:
+                data = self._read_cache()
+                if data is None:
+                    data = self.build()
+                    try:
+                        self._write_cache(data)
+                    except OSError:
+                        # read-only install, keep working from the sources
+                        pass
+
+                self._data = data
+
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+
+def compile_all():
+    for name, table in tables.items():
+        table.compile()
+        print(f'compiled {name}: {len(table)} entries -> {table.cache_path}')
+
+
+if __name__ == '__main__':
+    import lokbot.asset_cache
+    import lokbot.enum  # noqa: F401, registers the tables
+
+    lokbot.asset_cache.compile_all()
@@ -1,27 +1,151 @@
+import asyncio
+import base64
+import http.cookiejar
 import json
+import time
+import typing
 
 import httpx
+import tenacity
 
+import lokbot.codec
 import lokbot.enum
-from lokbot import logger
+import lokbot.util
+from lokbot import project_root, config
+from lokbot.client import raise_for_error_code
+from lokbot.exceptions import *
+from lokbot.ratelimiter import RateLimiterRegistry, limits
+from lokbot.request_log import RequestLog
 
+default_headers = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Origin': 'https://play.leagueofkingdoms.com',
+    'Referer': 'https://play.leagueofkingdoms.com/',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-site',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/114.0',
+}
 
-class AsyncLokBotApi:
-    def __init__(self, access_token):
-        self.opener = httpx.AsyncClient(
-            headers={
-                'User-Agent': 'BestHTTP',
-                'x-access-token': access_token
-            },
+# connections of the shared opener, also the requests in flight at once
+MAX_CONNECTIONS = 100
+
+_shared_opener = None
+_request_slots = None
+
+
+def get_shared_opener() -> httpx.AsyncClient:
+    """
+    One pooled HTTP/2 client for every `AsyncLokBotApi` of the process,
+    the access token is sent per request and cookies are never stored
+    :return:
+    """
+    global _shared_opener
+
+    if _shared_opener is None or _shared_opener.is_closed:
+        _shared_opener = httpx.AsyncClient(
+            headers=default_headers,
             http2=True,
-            base_url=lokbot.enum.API_BASE_URL
+            base_url=lokbot.enum.API_BASE_URL,
+            # remove request cookie since it's not needed and may cause account ban
+            cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=20),
         )
 
+    return _shared_opener
+
+
+def get_request_slots() -> asyncio.Semaphore:
+    """
+    Requests of the process wait here rather than in the pool of the opener,
+    whose cost per connection event grows with the requests queued (many accounts of a host)
+    :return:
+    """
+    global _request_slots
+
+    if _request_slots is None:
+        _request_slots = asyncio.Semaphore(MAX_CONNECTIONS)
+
+    return _request_slots
+
+
+class AsyncLokBotApi:
+    def __init__(self, token, captcha_solver_config=None, request_callback=None, opener=None):
+        self.opener = opener or get_shared_opener()
+        self.token = token
+        self.request_callback = request_callback
+        self._id = lokbot.util.decode_jwt(token).get('_id')
+
+        self.codec = None
+        self.protected_api_list = []
+
+        self.last_requested_at = time.time()
+        self.rate_limiters = RateLimiterRegistry()
+
+        self.request_log = RequestLog(self._id, **config.get('request_log', {}))
+
+        self.captcha_solver = None
+        if captcha_solver_config and 'ttshitu' in captcha_solver_config:
+            from lokbot.captcha_solver import Ttshitu
+            self.captcha_solver = Ttshitu(**captcha_solver_config['ttshitu'])
+
+    @property
+    def xor_password(self):
+        return self.codec.password if self.codec else None
+
+    @xor_password.setter
+    def xor_password(self, password):
+        self.codec = lokbot.codec.XorCodec(password) if password is not None else None
+
+    def b64xor_enc(self, d: dict) -> str:
+        assert self.codec is not None
+
+        return self.codec.b64xor_enc(d)
+
+    def b64xor_dec(self, s: typing.Union[str, bytes]) -> dict:
+        assert self.codec is not None
+
+        return self.codec.b64xor_dec(s)
+
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(2),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=60),
+        # general http error or json decode error
+        retry=tenacity.retry_if_exception_type((httpx.HTTPError, json.JSONDecodeError)),
+        reraise=True
+    )
+    @tenacity.retry(
+        wait=tenacity.wait_fixed(2),
+        retry=tenacity.retry_if_exception_type(DuplicatedException),  # server-side rate limiter(wait 2s)
+    )
+    @tenacity.retry(
+        wait=tenacity.wait_fixed(3600),
+        retry=tenacity.retry_if_exception_type(ExceedLimitPacketException),  # server-side rate limiter(wait 1h)
+    )
+    @limits('post', period=0.1)
     async def post(self, url, json_data=None):
+        return await self.request(url, json_data)
+
+    async def request(self, url, json_data=None):
+        """
+        `post` without client-side rate limiter and retry
+        :param url:
+        :param json_data:
+        :return:
+        """
         if json_data is None:
             json_data = {}
 
-        response = await self.opener.post(url, data={'json': json.dumps(json_data)})
+        post_data = json.dumps(json_data, separators=(',', ':'))
+        api_path = str(url).split('/api/').pop()
+        if api_path in self.protected_api_list:
+            post_data = self.b64xor_enc(json_data)
+
+        async with get_request_slots():
+            response = await self.opener.post(url, data={'json': post_data}, headers={'x-access-token': self.token})
+        self.last_requested_at = time.time()
 
         log_data = {
             'url': url,
@@ -30,20 +154,326 @@ class AsyncLokBotApi:
         }
 
         try:
-            json_response = response.json()
+            if api_path in self.protected_api_list and response.text[0] != '{':
+                json_response = self.b64xor_dec(response.text)
+            else:
+                json_response = response.json()
         except json.JSONDecodeError:
             log_data.update({'res': response.text})
-            logger.error(log_data)
+            self.request_log.error(log_data)
 
-            return None
+            raise
+
+        if json_response.get('isPacked') is True:
+            json_response = lokbot.codec.decode_packed(json_response.get('payload'))
 
         log_data.update({'res': json_response})
-        logger.debug(json.dumps(log_data))
 
-        return json_response
+        self.request_log.record(api_path, log_data)
+
+        if json_response.get('result'):
+            if callable(self.request_callback):
+                self.request_callback(json_response)
+
+            return json_response
+
+        err = json_response.get('err')
+        code = err.get('code')
+
+        if code in ('no_auth', 'not_online'):
+            self.request_log.dump(code)
+
+        if code == 'no_auth':
+            project_root.joinpath(f'data/{self._id}.token').unlink(missing_ok=True)
+            raise NoAuthException()
+
+        if code == 'need_captcha':
+            if not self.captcha_solver:
+                raise NeedCaptchaException()
+
+            await self._solve_captcha()
+
+            raise DuplicatedException()
+
+        raise_for_error_code(code)
+
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(4),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=60)
+    )
+    async def _solve_captcha(self):
+        # the solver is blocking, run it in a worker thread and call back into this loop
+        loop = asyncio.get_running_loop()
+
+        def get_picture_base64_func():
+            response = asyncio.run_coroutine_threadsafe(self.auth_captcha(), loop).result()
+
+            return base64.b64encode(response.content).decode()
+
+        def captcha_confirm_func(_captcha):
+            res = asyncio.run_coroutine_threadsafe(self.auth_captcha_confirm(_captcha), loop).result()
+
+            return res.get('valid')
+
+        if not await asyncio.to_thread(self.captcha_solver.solve, get_picture_base64_func, captcha_confirm_func):
+            raise tenacity.TryAgain()
+
+    async def auth_captcha(self):
+        return await self.opener.get('auth/captcha', headers={'x-access-token': self.token})
+
+    @limits('auth/captcha/confirm', period=2)
+    async def auth_captcha_confirm(self, value):
+        return await self.post('auth/captcha/confirm', {'value': value})
+
+    async def auth_connect(self, json_data=None):
+        try:
+            res = await self.post(f'{lokbot.enum.API_LIVE_BASE_URL}auth/connect', json_data)
+        except OtherException:
+            # {"result":false,"err":{}} when no auth
+            project_root.joinpath(f'data/{self._id}.token').unlink(missing_ok=True)
+            raise NoAuthException()
+
+        self.token = res['token']
+
+        return res
+
+    async def auth_set_device_info(self, device_info):
+        return await self.post('auth/setDeviceInfo', {'deviceInfo': device_info})
+
+    async def alliance_research_list(self):
+        return await self.post('alliance/research/list')
+
+    async def alliance_research_donate_all(self, code):
+        return await self.post('alliance/research/donateAll', {'code': code})
+
+    async def alliance_shop_list(self):
+        return await self.post('alliance/shop/list')
+
+    async def alliance_shop_buy(self, code, amount):
+        return await self.post('alliance/shop/buy', {'code': code, 'amount': amount})
+
+    async def alliance_gift_claim_all(self):
+        return await self.post('alliance/gift/claim/all')
+
+    async def chat_logs(self, chat_channel):
+        return await self.post('chat/logs', {'chatChannel': chat_channel})
+
+    async def quest_main(self):
+        return await self.post('quest/main')
+
+    async def quest_list(self):
+        return await self.post('quest/list')
+
+    async def quest_list_daily(self):
+        return await self.post('quest/list/daily')
+
+    @limits('quest/claim', period=1)
+    async def quest_claim(self, quest):
+        return await self.post('quest/claim', {'questId': quest.get('_id'), 'code': quest.get('code')})
+
+    @limits('quest/claim/daily', period=1)
+    async def quest_claim_daily(self, quest):
+        return await self.post('quest/claim/daily', {'questId': quest.get('_id'), 'code': quest.get('code')})
+
+    @limits('quest/claim/daily/level', period=1)
+    async def quest_claim_daily_level(self, reward):
+        return await self.post('quest/claim/daily/level', {'level': reward.get('level')})
+
+    async def pkg_recommend(self):
+        return await self.post('pkg/recommend')
+
+    async def pkg_list(self):
+        return await self.post('pkg/list')
+
+    async def event_roulette_open(self):
+        return await self.post('event/roulette/open')
+
+    async def event_cvc_open(self):
+        return await self.post('event/cvc/open')
+
+    async def drago_lair_list(self):
+        return await self.post('drago/lair/list')
+
+    async def event_list(self):
+        return await self.post('event/list')
+
+    @limits('event/info', period=2)
+    async def event_info(self, root_event_id):
+        return await self.post('event/info', {'rootEventId': root_event_id})
+
+    @limits('event/claim', period=1)
+    async def event_claim(self, event_id, event_target_id, code):
+        return await self.post('event/claim', {'eventId': event_id, 'eventTargetId': event_target_id, 'code': code})
+
+    async def train_troop(self, troop_code, amount):
+        return await self.post('kingdom/barrack/train', {'troopCode': troop_code, 'amount': amount, 'instant': 0})
+
+    async def kingdom_wall_info(self):
+        return await self.post('kingdom/wall/info')
+
+    async def kingdom_wall_repair(self):
+        return await self.post('kingdom/wall/repair')
+
+    async def kingdom_treasure_list(self):
+        return await self.post('kingdom/treasure/list')
+
+    async def kingdom_enter(self):
+        res = await self.post(f'{lokbot.enum.API_LIVE_BASE_URL}kingdom/enter')
+
+        captcha = res.get('captcha')
+        if captcha and captcha.get('next'):
+            if not self.captcha_solver:
+                raise NeedCaptchaException()
+
+            await self._solve_captcha()
+
+        return res
+
+    async def kingdom_task_all(self):
+        return await self.post('kingdom/task/all')
+
+    @limits('kingdom/task/claim', period=4)
+    async def kingdom_task_claim(self, position):
+        return await self.post('kingdom/task/claim', {'position': position})
+
+    @limits('kingdom/task/speedup', period=2)
+    async def kingdom_task_speedup(self, task_id, code, amount, is_buy=0):
+        res = await self.post(
+            'kingdom/task/speedup', {'taskId': task_id, 'code': code, 'amount': amount, 'isBuy': is_buy}
+        )
+
+        await self.auth_analytics('item/use', f'{code}|{amount}')
+
+        return res
+
+    @limits('kingdom/heal/speedup', period=2)
+    async def kingdom_heal_speedup(self, code, amount, is_buy=0):
+        res = await self.post('kingdom/heal/speedup', {'code': code, 'amount': amount, 'isBuy': is_buy})
+
+        await self.auth_analytics('item/use', f'{code}|{amount}')
+
+        return res
+
+    async def kingdom_tutorial_finish(self, code):
+        return await self.post('kingdom/tutorial/finish', {'code': code})
+
+    async def kingdom_academy_research_list(self):
+        return await self.post('kingdom/arcademy/research/list')
+
+    async def kingdom_hospital_recover(self):
+        return await self.post('kingdom/hospital/recover')
+
+    async def kingdom_hospital_wounded(self):
+        return await self.post('kingdom/hospital/wounded')
+
+    @limits('kingdom/resource/harvest', period=4)
+    async def kingdom_resource_harvest(self, position):
+        return await self.post('kingdom/resource/harvest', {'position': position})
+
+    @limits('kingdom/building/upgrade', period=6)
+    async def kingdom_building_upgrade(self, building, instant=0):
+        return await self.post('kingdom/building/upgrade', {
+            'position': building.get('position'),
+            'level': building.get('level'),
+            'instant': instant
+        })
+
+    @limits('kingdom/building/build', period=6)
+    async def kingdom_building_build(self, building, instant=0):
+        return await self.post('kingdom/building/build', {
+            'position': building.get('position'),
+            'buildingCode': building.get('code'),
+            'instant': instant
+        })
+
+    @limits('kingdom/arcademy/research', period=6)
+    async def kingdom_academy_research(self, research, instant=0):
+        return await self.post('kingdom/arcademy/research', {
+            'researchCode': research.get('code'),
+            'instant': instant
+        })
+
+    async def kingdom_vip_info(self):
+        return await self.post('kingdom/vip/info')
+
+    async def kingdom_vip_claim(self):
+        return await self.post('kingdom/vip/claim')
+
+    async def kingdom_world_change(self, world_id):
+        return await self.post('kingdom/world/change', {'worldId': world_id})
 
     async def kingdom_caravan_list(self):
         return await self.post('kingdom/caravan/list')
 
+    @limits('kingdom/caravan/buy', period=4)
     async def kingdom_caravan_buy(self, caravan_item_id):
         return await self.post('kingdom/caravan/buy', {'caravanItemId': caravan_item_id})
+
+    async def kingdom_profile_troops(self):
+        return await self.post('kingdom/profile/troops')
+
+    async def kingdom_vipshop_buy(self, code, amount):
+        return await self.post('kingdom/vipshop/buy', {'code': code, 'amount': amount})
+
+    async def alliance_help_all(self):
+        return await self.post('alliance/help/all')
+
+    async def alliance_recommend(self):
+        return await self.post('alliance/recommend')
+
+    async def alliance_join(self, alliance_id):
+        return await self.post('alliance/join', {'allianceId': alliance_id})
+
+    async def alliance_battle_list_v2(self):
+        return await self.post('alliance/battle/list/v2')
+
+    async def item_list(self):
+        return await self.post('item/list')
+
+    @limits('item/use', period=2)
+    async def item_use(self, code, amount=1):
+        res = await self.post('item/use', {'code': code, 'amount': amount})
+
+        await self.auth_analytics('item/use', f'{code}|{amount}')
+
+        return res
+
+    async def auth_analytics(self, url, param):
+        return await self.post('auth/analytics', {'url': url, 'param': param})
+
+    @limits('item/freechest', period=4)
+    async def item_free_chest(self, _type=0):
+        return await self.post('item/freechest', {'type': _type})
+
+    @limits('event/roulette/spin', period=2)
+    async def event_roulette_spin(self):
+        return await self.post('event/roulette/spin')
+
+    async def mail_list_check(self):
+        return await self.post('mail/list/check')
+
+    @limits('mail/claim/all', period=2)
+    async def mail_claim_all(self, category=1):
+        return await self.post('mail/claim/all', {'category': category})
+
+    async def field_worldmap_devrank(self):
+        return await self.post('field/worldmap/devrank')
+
+    async def field_march_info(self, data):
+        return await self.post('field/march/info', data)
+
+    @limits('field/march/start', period=4)
+    async def field_march_start(self, data):
+        return await self.post('field/march/start', data)
+
+    async def chat_new(self, chat_channel, chat_type, text, param=None):
+        data = {
+            'chatChannel': chat_channel,
+            'chatType': chat_type,
+            'text': text,
+        }
+
+        if param:
+            data['param'] = param
+
+        return await self.post('chat/new', data)
@@ -1,15 +1,887 @@
 import asyncio
+import base64
+import json
+import random
+import time
 
-import lokbot.async_client
+import arrow
+import socketio
+import tenacity
 
+import lokbot.async_client
+import lokbot.buildings
+import lokbot.dedup
+import lokbot.discord_webhook
 import lokbot.enum
+import lokbot.events
+import lokbot.field_index
+import lokbot.geo
+import lokbot.kingdom
+import lokbot.raster
+import lokbot.research
+import lokbot.speedup
+import lokbot.targeting
+import lokbot.util
+import lokbot.zone_scheduler
+from lokbot import logger, project_root, config, socf_logger, sock_logger, socc_logger
+from lokbot.enum import *
+from lokbot.exceptions import OtherException, FatalApiException, NoAuthException, NeedCaptchaException, \
+    NotOnlineException
+from lokbot.farmer import DEVICE_INFO, DEVRANK_MAX_AGE, ws_headers, LokFarmer, process_field_objects
+
+socket_retry = tenacity.retry(
+    stop=tenacity.stop_after_attempt(4),
+    wait=tenacity.wait_random_exponential(multiplier=1, max=60),
+    # tenacity catches BaseException, a cancelled socket must not reconnect
+    retry=tenacity.retry_if_not_exception_type((FatalApiException, asyncio.CancelledError)),
+    reraise=True
+)
+
+# the account cannot go on, any other failure of a job or loop is logged and retried
+STOPPING_EXCEPTIONS = (NoAuthException, NeedCaptchaException, NotOnlineException)
 
 
 class AsyncLokFarmer:
-    def __init__(self, token, concurrency=50):
-        self.api = lokbot.async_client.AsyncLokBotApi(token)
+    """
+    Farmer running on one asyncio event loop
+
+    The kingdom / chat / field sockets (`socketio.AsyncClient`), the periodic jobs and the queue loops
+    are tasks of the loop instead of threads, an account costs a few coroutines.
+    `run` starts what `config['main']` enables, like `lokbot.app.main` does for `LokFarmer`.
+    """
+
+    calc_time_diff_in_seconds = staticmethod(LokFarmer.calc_time_diff_in_seconds)
+
+    def __init__(self, token, captcha_solver_config=None, concurrency=50, opener=None):
+        self.token = token
+        self.api = lokbot.async_client.AsyncLokBotApi(token, captcha_solver_config, self._request_callback, opener)
+        self._id = self.api._id
         self.concurrency = concurrency
 
+        # `kingdom/enter` and what changed since, see `resync_kingdom`
+        self.state = lokbot.kingdom.KingdomState()
+        self.alliance_id = None
+        self.startup_metrics = {'started_at': time.time()}
+
+        self.buildings = lokbot.buildings.BuildingIndex([])
+        self.research_index = lokbot.research.ResearchIndex()
+        self.has_additional_building_queue = False
+        self.started_at = time.time()
+
+        self.buff_item_use_lock = asyncio.Lock()
+        self.hospital_recover_lock = asyncio.Lock()
+        self.building_queue_available = asyncio.Event()
+        self.research_queue_available = asyncio.Event()
+        self.train_queue_available = asyncio.Event()
+
+        self.socf_world_id = None
+        self.zone_scheduler = None
+        self.field_index = lokbot.field_index.FieldIndex()
+        self.shared_objects = lokbot.dedup.Dedup(f'shared_objects_{self._id}')
+        self.notified_objects = lokbot.dedup.Dedup(f'notified_objects_{self._id}')
+        # published by `sock_task`
+        self.events = lokbot.events.EventBus()
+
+        # fire and forget tasks, referenced until done
+        self._background_tasks = set()
+
+    # read-only views of `state`, change it with its `on_*` methods
+    # [food, lumber, stone, gold]
+    resources = property(lambda self: self.state.resources)
+    kingdom_tasks = property(lambda self: self.state.kingdom_tasks)
+    level = property(lambda self: self.state.level)
+
+    def _request_callback(self, json_response):
+        if self.state.on_response(json_response):
+            logger.info(f'resources updated: {self.state.resources}')
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+        return task
+
+    @staticmethod
+    async def _wait(event):
+        # wait for the queue to be available from `sock_task`
+        await event.wait()
+        event.clear()
+
+    async def start(self):
+        """
+        the handshake `LokFarmer.__init__` does
+        :return:
+        """
+        auth_res = await self.api.auth_connect({"deviceInfo": {"build": "global"}})
+        self.api.protected_api_list = json.loads(base64.b64decode(auth_res.get('lstProtect')).decode())
+        self.api.protected_api_list = [str(api).split('/api/').pop() for api in self.api.protected_api_list]
+        self.api.xor_password = json.loads(base64.b64decode(auth_res.get('regionHash')).decode()).split('-')[1]
+        self.token = auth_res.get('token')
+        project_root.joinpath(f'data/{self._id}.token').write_text(self.token)
+        self.startup_metrics['auth_connect'] = time.time() - self.startup_metrics['started_at']
+
+        kingdom_enter, _, drago_lair_list = await asyncio.gather(
+            self.api.kingdom_enter(),
+            self.api.auth_set_device_info(DEVICE_INFO),
+            self.api.drago_lair_list(),
+        )
+        self.state.on_kingdom_enter(kingdom_enter)
+        self.state.on_drago_lair_list(drago_lair_list)
+        self.alliance_id = self.state.alliance_id
+
+        chat_channels = [f'w{self.state.kingdom.get("worldId")}']
+        if self.alliance_id:
+            chat_channels.append(f'a{self.alliance_id}')
+        await asyncio.gather(*[self.api.chat_logs(chat_channel) for chat_channel in chat_channels])
+
+        self.startup_metrics['handshake'] = time.time() - self.startup_metrics['started_at']
+        logger.info(f'startup handshake finished in {self.startup_metrics["handshake"]:.3f}s')
+
+        kingdom = self.state.kingdom
+        self.buildings.reset(kingdom.get('buildings', []))
+        self.has_additional_building_queue = kingdom.get('vip', {}).get('level') >= 5
+        self.started_at = time.time()
+
+    async def run(self, jobs=(), threads=(), sockets=True):
+        """
+        run until a task fails for good (`STOPPING_EXCEPTIONS`, or a socket out of retries)
+        :param jobs: `config['main']['jobs']`, run every `interval` minutes
+        :param threads: `config['main']['threads']`, loops started once
+        :param sockets: False to leave the kingdom and chat sockets out, e.g. against a stand-in server
+        :return:
+        """
+        if self.state.version == 0:
+            await self.start()
+
+        tasks = [asyncio.ensure_future(self._guard('keepalive_request', self.keepalive_request, {}))]
+        if sockets:
+            tasks += [asyncio.ensure_future(self.sock_task()), asyncio.ensure_future(self.socc_task())]
+
+        for job in lokbot.events.with_default_triggers(jobs):
+            if not job.get('enabled'):
+                continue
+
+            name = job.get('name')
+            func = getattr(self, name, None)
+            if func is None:
+                logger.warning(f'job {name} is not supported by the asyncio runtime, skipped')
+                continue
+
+            run = self._job_runner(name, func, job.get('kwargs', {}))
+
+            interval = job.get('interval')
+            if interval:
+                tasks.append(asyncio.ensure_future(
+                    self._every(name, interval.get('start'), interval.get('end'), run, {})
+                ))
+
+            triggers = job.get('triggers')
+            if triggers:
+                self.on_events(
+                    name, triggers, run, job.get('debounce', lokbot.events.DEFAULT_DEBOUNCE), job.get('min_interval', 0)
+                )
+
+        for thread in threads:
+            if not thread.get('enabled'):
+                continue
+
+            func = getattr(self, thread.get('name'), None)
+            if func is None:
+                logger.warning(f'thread {thread.get("name")} is not supported by the asyncio runtime, skipped')
+                continue
+
+            tasks.append(asyncio.ensure_future(self._guard(thread.get('name'), func, thread.get('kwargs') or {})))
+
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            [task.result() for task in done]
+        finally:
+            [task.cancel() for task in tasks + list(self._background_tasks)]
+
+    async def _guard(self, name, func, kwargs, restart_delay=60):
+        """
+        restart `func` when it fails, a thread of `LokFarmer` would just die
+        """
+        while True:
+            try:
+                return await func(**kwargs)
+            except STOPPING_EXCEPTIONS:
+                raise
+            except Exception as e:
+                logger.exception(f'{name} failed, restarting in {restart_delay}s: {e}')
+
+            await asyncio.sleep(restart_delay)
+
+    @staticmethod
+    def _job_runner(name, func, kwargs):
+        """
+        `func(**kwargs)` skipped while a run of the job is not done, like `lokbot.app.run_threaded`
+        """
+        lock = asyncio.Lock()
+
+        async def run():
+            if lock.locked():
+                logger.debug(f'job {name} is running, skipped')
+                return
+
+            async with lock:
+                return await func(**kwargs)
+
+        return run
+
+    async def _run_triggered(self, name, run):
+        try:
+            await run()
+        except Exception as e:
+            logger.exception(f'job {name} failed: {e}')
+
+    def on_events(self, name, triggers, run, debounce=lokbot.events.DEFAULT_DEBOUNCE, min_interval=0):
+        """
+        run the coroutine function `run` on the loop after the events matching `triggers`,
+        see `lokbot.events.Debouncer`
+        :return:
+        """
+        def submit(delay, func):
+            asyncio.get_running_loop().call_later(delay, lambda: self._spawn(self._run_triggered(name, func)))
+
+        debouncer = lokbot.events.Debouncer(name, run, submit, debounce, min_interval)
+        self.events.on(triggers, debouncer)
+
+        return debouncer
+
+    async def _every(self, name, start, end, func, kwargs):
+        """
+        `schedule.every(start).to(end).minutes` on the loop, overlapping runs are not possible
+        """
+        while True:
+            try:
+                await func(**kwargs)
+            except STOPPING_EXCEPTIONS:
+                raise
+            except Exception as e:
+                logger.exception(f'job {name} failed: {e}')
+
+            await asyncio.sleep(random.uniform(start, end) * 60)
+
+    async def _get_devrank(self):
+        store = lokbot.raster.get_store(self.state.kingdom.get('worldId'))
+
+        devrank = store.get('devrank', DEVRANK_MAX_AGE)
+        if devrank is None:
+            devrank = store.put_devrank((await self.api.field_worldmap_devrank()).get('lands'))
+
+        return devrank
+
+    # region sockets
+
+    def _update_kingdom_enter_building(self, building):
+        self.buildings.update(building)
+        self.state.on_building_update(building)
+
+    async def _on_buff_list(self, data):
+        self.has_additional_building_queue = len([
+            item for item in data if item.get('param', {}).get('itemCode') == ITEM_CODE_GOLDEN_HAMMER
+        ]) > 0
+
+        while self.started_at + 10 > time.time():
+            logger.info(f'started at {arrow.get(self.started_at).humanize()}, wait 10 seconds to activate buff')
+            await asyncio.sleep(4)
+
+        item_list = (await self.api.item_list()).get('items')
+
+        for buff_type, item_code_list in USABLE_BOOST_CODE_MAP.items():
+            already_activated = [item for item in data if item.get('param', {}).get('itemCode') in item_code_list]
+
+            if already_activated:
+                continue
+
+            item_in_inventory = [item for item in item_list if item.get('code') in item_code_list]
+
+            if not item_in_inventory:
+                continue
+
+            if self.buff_item_use_lock.locked():
+                return
+
+            async with self.buff_item_use_lock:
+                code = item_in_inventory[0].get('code')
+                logger.info(f'activating buff: {buff_type}, code: {code}')
+                await self.api.item_use(code)
+
+                if code == ITEM_CODE_GOLDEN_HAMMER:
+                    self.has_additional_building_queue = True
+
+    @socket_retry
+    async def sock_task(self, join_rally_code_list=(OBJECT_CODE_DEATHKAR,)):
+        """
+        websocket connection of the kingdom
+        :return:
+        """
+        url = self.state.networks.get('kingdoms')[0]
+
+        sio = socketio.AsyncClient(reconnection=False, logger=sock_logger, engineio_logger=sock_logger)
+
+        @sio.on('/building/update')
+        async def on_building_update(data):
+            logger.debug(data)
+            self._update_kingdom_enter_building(data)
+            self.events.publish(lokbot.events.BuildingUpdated(data))
+
+        @sio.on('/resource/upgrade')
+        async def on_resource_update(data):
+            logger.debug(data)
+            self.state.on_resource_upgrade(data)
+            self.events.publish(lokbot.events.ResourceUpdated(data))
+
+        @sio.on('/buff/list')
+        async def on_buff_list(data):
+            logger.debug(f'on_buff_list: {data}')
+            self.events.publish(lokbot.events.BuffListUpdated(data))
+            # activating buffs waits, do not hold the other events back
+            self._spawn(self._on_buff_list(data))
+
+        @sio.on('/alliance/rally/new')
+        async def on_alliance_rally_new(data):
+            logger.debug(data)
+            self.events.publish(lokbot.events.AllianceRallyNew(data))
+            code = data.get('code')
+            if code not in join_rally_code_list:
+                logger.info(f'ignore rally: {code}')
+                return
+
+        @sio.on('/task/update')
+        async def on_task_update(data):
+            logger.debug(data)
+            self.state.on_task_update(data)
+            if data.get('status') == STATUS_FINISHED:
+                if data.get('code') in (TASK_CODE_SILVER_HAMMER, TASK_CODE_GOLD_HAMMER):
+                    self.building_queue_available.set()
+
+            if data.get('status') == STATUS_CLAIMED:
+                if data.get('code') == TASK_CODE_ACADEMY:
+                    self.research_index.finish()
+                    self.research_queue_available.set()
+                if data.get('code') == TASK_CODE_CAMP:
+                    self.train_queue_available.set()
+
+            self.events.publish(lokbot.events.TaskUpdated(data))
+
+        await sio.connect(f'{url}?token={self.token}', transports=["websocket"], headers=ws_headers)
+        await sio.emit('/kingdom/enter', {'token': self.token})
+
+        await sio.wait()
+        logger.warning('sock_task disconnected, reconnecting')
+        raise tenacity.TryAgain()
+
+    @socket_retry
+    async def socc_task(self):
+        """
+        websocket connection of the chat
+        :return:
+        """
+        url = self.state.networks.get('chats')[0]
+
+        sio = socketio.AsyncClient(reconnection=False, logger=socc_logger, engineio_logger=socc_logger)
+
+        # no token needed in query string, yet
+        await sio.connect(url, transports=["websocket"], headers=ws_headers)
+        await sio.emit('/chat/enter', {'token': self.token})
+
+        await sio.wait()
+        logger.warning('socc_task disconnected, reconnecting')
+        raise tenacity.TryAgain()
+
+    @socket_retry
+    async def socf_thread(self, radius, targets, share_to=None):
+        """
+        websocket connection of the field, see `LokFarmer.socf_thread`
+        :return:
+        """
+        if self.zone_scheduler is None:
+            world_id = self.state.kingdom.get('worldId')
+            from_loc = self.state.kingdom.get('loc')
+            await self._get_devrank()
+
+            self.zone_scheduler = lokbot.zone_scheduler.ZoneScheduler(
+                world_id, self._id,
+                lokbot.geo.nearest_zones(from_loc[1], from_loc[2], radius),
+                lokbot.raster.get_store(world_id).get('devrank_zone_sum')
+            )
+
+        while self.api.last_requested_at + 16 > time.time():
+            # when we are in the field, we should not be doing anything else
+            logger.info(f'last requested at {arrow.get(self.api.last_requested_at).humanize()}, waiting...')
+            await asyncio.sleep(4)
+
+        self.socf_world_id = self.state.kingdom.get('worldId')
+        url = self.state.networks.get('fields')[0]
+
+        target_matcher = lokbot.targeting.TargetMatcher(
+            targets, share_to, config.get('discord', {}), self.state.kingdom.get('loc')
+        )
+        target_codes = list(target_matcher.codes)
+        entered = asyncio.Event()
+        processed = asyncio.Event()
+
+        sio = socketio.AsyncClient(reconnection=False, logger=socf_logger, engineio_logger=socf_logger)
+
+        @sio.on('/field/objects/v4')
+        async def on_field_objects(data):
+            objects = self.api.codec.decode_packs(data.get('packs'), target_matcher.codes).get('objects')
+
+            for each_obj, decision in process_field_objects(self, objects, target_matcher):
+                text = f'Lv.{decision.level}?fo_{decision.target.code}'
+                for chat_channel in share_to.get('chat_channels'):
+                    await self.api.chat_new(chat_channel, CHAT_TYPE_LOC, text, {'loc': each_obj.get('loc')})
+                    logger.info(f'Shared to chat channel {chat_channel}: {text} ({decision.target.resource_name})')
+
+            processed.set()
+
+        @sio.on('/field/enter/v3')
+        async def on_field_enter(data):
+            data_decoded = self.api.b64xor_dec(data)
+            logger.debug(data_decoded)
+            self.socf_world_id = data_decoded.get('loc')[0]  # in case of cvc event world map
+
+            # knock
+            await sio.emit('/zone/leave/list/v2', {'world': self.socf_world_id, 'zones': '[]'})
+            default_zones = '[0,64,1,65]'
+            await sio.emit(
+                '/zone/enter/list/v4', self.api.b64xor_enc({'world': self.socf_world_id, 'zones': default_zones})
+            )
+            await sio.emit('/zone/leave/list/v2', {'world': self.socf_world_id, 'zones': default_zones})
+
+            entered.set()
+
+        await sio.connect(f'{url}?token={self.token}', transports=["websocket"], headers=ws_headers)
+        await sio.emit('/field/enter/v3', self.api.b64xor_enc({'token': self.token}))
+        await entered.wait()
+
+        step = 9
+        grace = 7  # 9 times enter-leave action will cause ban
+        for zone_ids in self.zone_scheduler.batches(target_codes, grace, step):
+            if not sio.connected:
+                logger.warning('socf_thread disconnected, reconnecting')
+                raise tenacity.TryAgain()
+
+            message = {'world': self.socf_world_id, 'zones': json.dumps(zone_ids, separators=(',', ':'))}
+
+            entered_at = time.time()
+            processed.clear()
+            await sio.emit('/zone/enter/list/v4', self.api.b64xor_enc(message))
+            await processed.wait()
+            await sio.emit('/zone/leave/list/v2', message)
+
+            self.field_index.prune_zones(self.socf_world_id, zone_ids, entered_at)
+            self.zone_scheduler.mark_scanned(zone_ids)
+            self.zone_scheduler.save()
+            self.shared_objects.save()
+            self.notified_objects.save()
+
+        logger.info('a loop is finished')
+        logger.info(f'discord webhooks: {lokbot.discord_webhook.get_dispatcher().stats()}')
+        logger.info(f'rate limiters: {self.api.rate_limiters.stats()}')
+        await sio.disconnect()
+
+    # endregion
+
+    # region speedup
+
+    async def _get_optimal_speedups(self, need_seconds, speedup_type):
+        assert speedup_type in ITEM_CODE_SPEEDUP_MAP, f'invalid speedup type: {speedup_type}'
+
+        current_map = {**ITEM_CODE_SPEEDUP_MAP.get('universal'), **ITEM_CODE_SPEEDUP_MAP.get(speedup_type)}
+
+        items = (await self.api.item_list()).get('items', [])
+        inventory = {
+            item.get('code'): (current_map.get(item.get('code')), item.get('amount'))
+            for item in items if item.get('code') in current_map
+        }
+
+        if not inventory:
+            logger.info(f'no speedup item found for {speedup_type}')
+            return False
+
+        speedups = lokbot.speedup.optimal_speedups(
+            need_seconds, inventory,
+            at_least=speedup_type == 'recover',
+            preferred=ITEM_CODE_SPEEDUP_MAP.get(speedup_type)
+        )
+
+        if not speedups:
+            logger.info(f'cannot find optimal speedups for {speedup_type}')
+            return False
+
+        return speedups
+
+    async def do_speedup(self, expected_ended, task_id, speedup_type):
+        need_seconds = self.calc_time_diff_in_seconds(expected_ended)
+
+        if need_seconds > 60 * 5 or speedup_type == 'recover':
+            # try speedup only when need_seconds > 5 minutes
+            speedups = await self._get_optimal_speedups(need_seconds, speedup_type)
+            if speedups:
+                counts = speedups.get('counts')
+
+                logger.info(f'need_seconds: {need_seconds}, using speedups: {counts}')
+                for code, count in counts.items():
+                    if speedup_type == 'recover':
+                        await self.api.kingdom_heal_speedup(code, count)
+                    else:
+                        await self.api.kingdom_task_speedup(task_id, code, count)
+                    await asyncio.sleep(random.randint(1, 3))
+
+    # endregion
+
+    # region loops
+
+    async def _upgrade_building(self, building, speedup):
+        try:
+            if building.get('level') == 0:
+                res = await self.api.kingdom_building_build(building)
+                building = res.get('newBuilding', building)
+            else:
+                res = await self.api.kingdom_building_upgrade(building)
+                building = res.get('updateBuilding', building)
+        except OtherException as error_code:
+            if str(error_code) == 'full_task':
+                logger.warning('building_farmer: full_task, quit')
+                return 'break'
+
+            logger.info(f'building upgrade failed: {building}')
+            return 'continue'
+
+        building['state'] = BUILDING_STATE_UPGRADING
+        self._update_kingdom_enter_building(building)
+
+        if speedup:
+            await self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'building')
+
+    async def _building_farmer_worker(self, speedup=False):
+        exclude_codes = {BUILDING_CODE_MAP['hall_of_alliance']}
+        if [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_CAMP]:
+            exclude_codes.add(BUILDING_CODE_MAP['barrack'])
+
+        for building in self.buildings.upgradeable(self.resources, exclude_codes):
+            res = await self._upgrade_building(building, speedup)
+
+            if res == 'continue':
+                continue
+            if res == 'break':
+                break
+
+            return True
+
+        return False
+
+    async def building_farmer_thread(self, speedup=False):
+        while True:
+            kingdom_tasks = self.state.on_kingdom_tasks((await self.api.kingdom_task_all()).get('kingdomTasks', []))
+
+            silver_in_use = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_SILVER_HAMMER]
+            gold_in_use = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_GOLD_HAMMER]
+
+            if not silver_in_use or (self.has_additional_building_queue and not gold_in_use):
+                if not await self._building_farmer_worker(speedup):
+                    logger.info(f'no building to upgrade, sleep for 2h')
+                    await asyncio.sleep(7200)
+                    continue
+
+            await self._wait(self.building_queue_available)
+
+    async def academy_farmer_thread(self, to_max_level=False, speedup=False):
+        while True:
+            kingdom_tasks = self.state.on_kingdom_tasks((await self.api.kingdom_task_all()).get('kingdomTasks', []))
+
+            worker_used = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_ACADEMY]
+            if worker_used:
+                if worker_used[0].get('status') != STATUS_CLAIMED:
+                    await self._wait(self.research_queue_available)
+                    continue
+
+                await self.api.kingdom_task_claim(BUILDING_POSITION_MAP['academy'])
+                self.research_index.finish()
+
+            if not self.research_index.synced:
+                self.research_index.sync((await self.api.kingdom_academy_research_list()).get('researches', []))
+
+            academy_level = self.buildings.max_level(BUILDING_CODE_MAP['academy'])
+
+            started = False
+            skipped_categories = set()
+            for research in self.research_index.researchable(academy_level, self.resources, to_max_level):
+                if research.category_name in skipped_categories:
+                    continue
+
+                try:
+                    res = await self.api.kingdom_academy_research({'code': research.code})
+                except OtherException as error_code:
+                    self.research_index.synced = False
+
+                    if str(error_code) == 'not_enough_condition':
+                        logger.warning(f'category {research.category_name} reached max level')
+                        skipped_categories.add(research.category_name)
+                        continue
+
+                    logger.info(f'research failed, try next one, current: {research.name}({research.code})')
+                    continue
+
+                self.research_index.start(research.code)
+
+                if speedup:
+                    await self.do_speedup(
+                        res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'research'
+                    )
+
+                started = True
+                break
+
+            if started:
+                await self._wait(self.research_queue_available)
+                continue
+
+            logger.info('academy_farmer: no research to do, sleep for 2h')
+            self.research_index.synced = False
+            await asyncio.sleep(2 * 3600)
+
+    def _troop_training_capacity(self):
+        troop_training_capacity = 0
+        for building in self.buildings.of_code(BUILDING_CODE_MAP['barrack']):
+            troop_training_capacity += BARRACK_LEVEL_TROOP_TRAINING_RATE_MAP[int(building['level'])]
+
+        return troop_training_capacity
+
+    def _total_troops_capacity_according_to_resources(self, troop_code):
+        amount = None
+        for req_resource, resource in zip(TRAIN_TROOP_RESOURCE_REQUIREMENT[troop_code], self.resources):
+            if req_resource == 0:
+                continue
+
+            if amount is None or resource // req_resource <= amount:
+                amount = resource // req_resource
+
+        return amount if amount is not None else 0
+
+    async def _train_troop_once(self, troop_code, speedup, interval):
+        """
+        :return: seconds to sleep, or None to wait for the train queue
+        """
+        while self.api.last_requested_at + 4 > time.time():
+            # attempt to prevent `insufficient_resources` due to race conditions
+            await asyncio.sleep(4)
+
+        kingdom_tasks = self.state.on_kingdom_tasks((await self.api.kingdom_task_all()).get('kingdomTasks', []))
+        worker_used = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_CAMP]
+
+        if worker_used:
+            if worker_used[0].get('status') == STATUS_CLAIMED:
+                barrack = random.choice(self.buildings.of_code(BUILDING_CODE_MAP['barrack']))
+                await self.api.kingdom_task_claim(barrack['position'])
+                logger.info(f'train_troop: one loop completed, sleep for {interval} seconds')
+                return interval
+
+            if worker_used[0].get('status') == STATUS_PENDING:
+                return None
+
+        amount = min(self._troop_training_capacity(), self._total_troops_capacity_according_to_resources(troop_code))
+        if not amount:
+            logger.info('train_troop: no resource, sleep for 1h')
+            return 3600
+
+        try:
+            res = await self.api.train_troop(troop_code, amount)
+        except OtherException as error_code:
+            logger.info(f'train_troop: {error_code}, sleep for 1h')
+            return 3600
+
+        if speedup:
+            await self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'train')
+
+        return None
+
+    async def train_troop_thread(self, troop_code, speedup=False, interval=3600):
+        while True:
+            delay = await self._train_troop_once(troop_code, speedup, interval)
+            if delay is None:
+                await self._wait(self.train_queue_available)
+            else:
+                await asyncio.sleep(delay)
+
+    async def _quest_monitor_once(self):
+        """
+        :return: whether there is another page of quests
+        """
+        quest_list = await self.api.quest_list()
+
+        # main quest(currently only one)
+        [await self.api.quest_claim(q) for q in quest_list.get('mainQuests') if q.get('status') == STATUS_FINISHED]
+
+        # side quest(max 5)
+        if len([await self.api.quest_claim(q) for q in quest_list.get('sideQuests') if
+                q.get('status') == STATUS_FINISHED]) >= 5:
+            return True
+
+        quest_list_daily = (await self.api.quest_list_daily()).get('dailyQuest')
+
+        # daily quest(max 5)
+        if len([await self.api.quest_claim_daily(q) for q in quest_list_daily.get('quests') if
+                q.get('status') == STATUS_FINISHED]) >= 5:
+            return True
+
+        # daily quest reward
+        [await self.api.quest_claim_daily_level(q) for q in quest_list_daily.get('rewards') if
+         q.get('status') == STATUS_FINISHED]
+
+        # event
+        event_list = await self.api.event_list()
+        event_has_red_dot = [each for each in event_list.get('events') if each.get('reddot') > 0]
+        for event in event_has_red_dot:
+            event_info = await self.api.event_info(event.get('_id'))
+            finished_code = [
+                each.get('code') for each in event_info.get('eventKingdom').get('events')
+                if each.get('status') == STATUS_FINISHED
+            ]
+
+            if not finished_code:
+                continue
+
+            [await self.api.event_claim(
+                event_info.get('event').get('_id'), each.get('_id'), each.get('code')
+            ) for each in event_info.get('event').get('events') if each.get('code') in finished_code]
+
+        return False
+
+    async def quest_monitor_thread(self):
+        while True:
+            if await self._quest_monitor_once():
+                # 若五个均为已完成, 则翻页
+                continue
+
+            logger.info('quest_monitor: done, sleep for 1h')
+            await asyncio.sleep(3600)
+
+    async def free_chest_farmer_thread(self, _type=0):
+        while True:
+            try:
+                res = await self.api.item_free_chest(_type)
+            except OtherException as error_code:
+                if str(error_code) == 'free_chest_not_yet':
+                    logger.info('free_chest_farmer: free_chest_not_yet, sleep for 2h')
+                    await asyncio.sleep(2 * 3600)
+                    continue
+
+                raise
+
+            next_dict = {
+                0: arrow.get(res.get('freeChest', {}).get('silver', {}).get('next')),
+                1: arrow.get(res.get('freeChest', {}).get('gold', {}).get('next')),
+                2: arrow.get(res.get('freeChest', {}).get('platinum', {}).get('next')),
+            }
+            _type = min(next_dict, key=next_dict.get)
+
+            await asyncio.sleep(self.calc_time_diff_in_seconds(next_dict[_type]))
+
+    # endregion
+
+    # region jobs
+
+    async def harvester(self):
+        for code in random.sample(HARVESTABLE_CODE, len(HARVESTABLE_CODE)):
+            buildings = self.buildings.of_code(code)
+            if not buildings:
+                continue
+
+            await self.api.kingdom_resource_harvest(random.choice(buildings).get('position'))
+
+    async def use_resource_in_item_list(self):
+        item_list = (await self.api.item_list()).get('items', [])
+
+        for each_item in [each for each in item_list if each.get('code') in USABLE_ITEM_CODE_LIST]:
+            await self.api.item_use(each_item.get('code'), each_item.get('amount'))
+            await asyncio.sleep(random.randint(1, 3))
+
+    async def vip_chest_claim(self):
+        vip_info = await self.api.kingdom_vip_info()
+
+        if vip_info.get('vip', {}).get('isClaimed'):
+            return
+
+        await self.api.kingdom_vip_claim()
+
+    async def alliance_farmer(self, gift_claim=True, help_all=True, research_donate=True,
+                              shop_auto_buy_item_code_list=None):
+        if not self.alliance_id:
+            return
+
+        async def ignore_other_exception(coro):
+            try:
+                return await coro
+            except OtherException:
+                return None
+
+        if gift_claim:
+            await ignore_other_exception(self.api.alliance_gift_claim_all())
+
+        if help_all:
+            await ignore_other_exception(self.api.alliance_help_all())
+
+        if research_donate:
+            research_list = await ignore_other_exception(self.api.alliance_research_list())
+            if research_list is not None:
+                code = research_list.get('recommendResearch') or 31101003  # 骑兵攻击力 1
+                await ignore_other_exception(self.api.alliance_research_donate_all(code))
+
+        if shop_auto_buy_item_code_list and type(shop_auto_buy_item_code_list) is list:
+            shop_list = await ignore_other_exception(self.api.alliance_shop_list())
+            if shop_list is None:
+                return
+
+            alliance_point = shop_list.get('alliancePoint')
+            for each_shop_item in shop_list.get('allianceShopItems'):
+                code = each_shop_item.get('code')
+                if code not in shop_auto_buy_item_code_list:
+                    continue
+
+                cost = each_shop_item.get('ap_1')
+                amount = min(int(alliance_point / cost), each_shop_item.get('amount'))
+                if amount < 1:
+                    continue
+
+                try:
+                    await self.api.alliance_shop_buy(code, amount)
+                except OtherException as error_code:
+                    logger.warning(f'alliance_shop_buy failed({str(error_code)}): {code}, {amount}')
+                    return
+
+                alliance_point -= cost * amount
+
+    async def caravan_farmer(self):
+        caravan = (await self.api.kingdom_caravan_list()).get('caravan')
+
+        if not caravan:
+            return
+
+        for each_item in caravan.get('items', []):
+            if each_item.get('amount') < 1:
+                continue
+
+            if each_item.get('code') not in BUYABLE_CARAVAN_ITEM_CODE_LIST:
+                continue
+
+            if each_item.get('costItemCode') not in BUYABLE_CARAVAN_ITEM_CODE_LIST:
+                continue
+
+            resource_index = lokbot.util.get_resource_index_by_item_code(each_item.get('costItemCode'))
+
+            if resource_index == -1:
+                continue
+
+            if each_item.get('cost') > self.resources[resource_index]:
+                continue
+
+            await self.api.kingdom_caravan_buy(each_item.get('_id'))
+
     async def parallel_buy_caravan(self):
         caravan_items = (await self.api.kingdom_caravan_list()).get('caravan').get('items')
 
@@ -20,9 +892,92 @@ class AsyncLokFarmer:
             if each_item.get('code') not in lokbot.enum.BUYABLE_CARAVAN_ITEM_CODE_LIST:
                 continue
 
+            # bypass the client-side rate limiter, all requests should arrive at the same time
             jobs = [
-                asyncio.ensure_future(self.api.kingdom_caravan_buy(each_item.get('_id')))
+                asyncio.ensure_future(self.api.request('kingdom/caravan/buy', {'caravanItemId': each_item.get('_id')}))
                 for _ in range(self.concurrency)
             ]
-            await asyncio.gather(*jobs)
+            await asyncio.gather(*jobs, return_exceptions=True)
             return
+
+    async def mail_claim(self):
+        await self.api.mail_claim_all(1)  # report
+        await asyncio.sleep(random.randint(4, 6))
+        await self.api.mail_claim_all(2)  # alliance
+        await asyncio.sleep(random.randint(4, 6))
+        await self.api.mail_claim_all(3)  # system
+
+    async def wall_repair(self):
+        wall_info = await self.api.kingdom_wall_info()
+
+        max_durability = wall_info.get('wall', {}).get('maxDurability')
+        durability = wall_info.get('wall', {}).get('durability')
+        last_repair_date = wall_info.get('wall', {}).get('lastRepairDate')
+
+        if not last_repair_date:
+            return
+
+        if durability >= max_durability:
+            return
+
+        if int((arrow.utcnow() - arrow.get(last_repair_date)).total_seconds()) < 60 * 30:
+            # 30 minute interval
+            return
+
+        await self.api.kingdom_wall_repair()
+
+    async def hospital_recover(self):
+        if self.hospital_recover_lock.locked():
+            logger.info('another hospital_recover is running, skip')
+            return
+
+        async with self.hospital_recover_lock:
+            wounded = (await self.api.kingdom_hospital_wounded()).get('wounded', [])
+
+            estimated_end_time = None
+            for each_batch in wounded:
+                if estimated_end_time is None:
+                    estimated_end_time = arrow.get(each_batch[0].get('startTime'))
+                time_total = sum([each.get('time') for each in each_batch])
+                estimated_end_time = estimated_end_time.shift(seconds=time_total)
+
+            if estimated_end_time and estimated_end_time > arrow.utcnow():
+                await self.do_speedup(estimated_end_time, 'dummy_task_id', 'recover')
+
+            await self.api.kingdom_hospital_recover()
+
+    async def resync_kingdom(self):
+        """
+        apply what changed in `kingdom/enter` since the last sync, e.g. missed socket events
+        :return:
+        """
+        kingdom_enter = await self.api.kingdom_enter()
+
+        changed = self.state.on_kingdom_enter(kingdom_enter)
+        updated = self.buildings.sync(kingdom_enter.get('kingdom', {}).get('buildings', []))
+
+        logger.info(f'kingdom resync: {sorted(changed)} changed, {updated} buildings updated, '
+                    f'version {self.state.version}')
+
+    async def keepalive_request(self):
+        funcs = [
+            self.api.kingdom_wall_info,
+            self.api.quest_main,
+            self.api.item_list,
+            self.api.kingdom_treasure_list,
+            self.api.event_list,
+            self.api.event_cvc_open,
+            self.api.event_roulette_open,
+            self.api.drago_lair_list,
+            self.api.pkg_recommend,
+            self.api.pkg_list,
+        ]
+        random.shuffle(funcs)
+
+        try:
+            for func in funcs:
+                await func()
+        except OtherException:
+            pass
+
+    # endregion
@@ -0,0 +1,178 @@
+import functools
+import threading
+
+from lokbot.enum import BUILDING_CODE_MAP, BUILDING_STATE_NORMAL, BUILD_POSITION_UNLOCK_MAP, RESOURCE_IDX_MAP, \
+    building_json
+
+
+@functools.lru_cache()
+def all_requirements():
+    """
+    static upgrade requirements from `building_json`
+    :return: {code: {target level: (((code, level), ...), (food, lumber, stone, gold))}}
+    """
+    result = {}
+    for code, levels in building_json.items():
+        result[code] = {}
+        for level, each_level in levels.items():
+            prerequisites = tuple(
+                (BUILDING_CODE_MAP.get(requirement.get('type')), int(requirement.get('level')))
+                for requirement in each_level.get('requirements', [])
+            )
+
+            cost = [0] * len(RESOURCE_IDX_MAP)
+            for res_requirement in each_level.get('resources', []):
+                if res_requirement.get('type') not in RESOURCE_IDX_MAP:
+                    # paid with items (e.g. `golden_pillar`), not handled
+                    cost = None
+                    break
+
+                cost[RESOURCE_IDX_MAP[res_requirement.get('type')]] = int(res_requirement.get('value'))
+
+            if cost is not None:
+                result[code][int(level)] = (prerequisites, tuple(cost))
+
+    return result
+
+
+class BuildingIndex:
+    """
+    Buildings of a kingdom keyed by position and by code, with the highest level of every code
+
+    Seeded from `kingdom/enter` and updated from `/building/update` and the build/upgrade responses,
+    safe to share between the socket thread and the farmer threads.
+    """
+
+    def __init__(self, buildings=()):
+        self._lock = threading.RLock()
+        self.by_position = {}
+        self.positions_by_code = {}
+        self.max_levels = {}
+
+        self.reset(buildings)
+
+    def reset(self, buildings):
+        with self._lock:
+            self.by_position = {}
+            self.positions_by_code = {}
+            self.max_levels = {}
+            for building in buildings:
+                self.update(building)
+
+    def update(self, building):
+        """
+        insert or replace the building at `building['position']`
+        :param building:
+        :return: the building it replaced or None
+        """
+        code = building.get('code')
+        position = building.get('position')
+        level = building.get('level', 0)
+
+        with self._lock:
+            previous = self.by_position.get(position)
+            self.by_position[position] = building
+
+            if previous is not None and previous.get('code') != code:
+                self.positions_by_code[previous.get('code')].discard(position)
+                self._refresh_max_level(previous.get('code'))
+
+            self.positions_by_code.setdefault(code, set()).add(position)
+
+            if level >= self.max_levels.get(code, 0):
+                self.max_levels[code] = level
+            elif previous is not None and previous.get('level', 0) == self.max_levels.get(code):
+                # the highest one went down, only happens on resync
+                self._refresh_max_level(code)
+
+        return previous
+
+    def sync(self, buildings):
+        """
+        `update` the buildings that differ from the known ones, for the resync against `kingdom/enter`
+        :param buildings:
+        :return: number of buildings updated
+        """
+        updated = 0
+        with self._lock:
+            for building in buildings:
+                if self.by_position.get(building.get('position')) != building:
+                    self.update(building)
+                    updated += 1
+
+        return updated
+
+    def _refresh_max_level(self, code):
+        levels = [self.by_position[position].get('level', 0) for position in self.positions_by_code.get(code, ())]
+        if levels:
+            self.max_levels[code] = max(levels)
+        else:
+            self.max_levels.pop(code, None)
+
+    def get(self, position):
+        return self.by_position.get(position)
+
+    def of_code(self, code):
+        with self._lock:
+            return [self.by_position[position] for position in self.positions_by_code.get(code, ())]
+
+    def max_level(self, code):
+        return self.max_levels.get(code, 0)
+
+    def all(self):
+        with self._lock:
+            return list(self.by_position.values())
+
+    def _is_upgradeable(self, building, resources, requirements):
+        if building.get('state') != BUILDING_STATE_NORMAL:
+            return False
+
+        requirement = requirements.get(building.get('code'), {}).get(building.get('level', 0) + 1)
+        if requirement is None:
+            return False
+
+        prerequisites, cost = requirement
+        if any(self.max_levels.get(code, 0) < level for code, level in prerequisites):
+            return False
+
+        return all(have >= need for have, need in zip(resources, cost))
+
+    def upgradeable(self, resources, exclude_codes=()):
+        """
+        every slot that can be built or upgraded now, empty unlocked positions first,
+        then existing buildings from the lowest level
+        :param resources: [food, lumber, stone, gold]
+        :param exclude_codes: building codes to leave alone
+        :return: list of building dict, `level` 0 for the ones to build
+        """
+        requirements = all_requirements()
+
+        with self._lock:
+            castle_level = self.max_level(BUILDING_CODE_MAP['castle'])
+
+            result = []
+            for level_requirement, positions in BUILD_POSITION_UNLOCK_MAP.items():
+                if castle_level < level_requirement:
+                    continue
+
+                for position in positions:
+                    if position.get('position') in self.by_position or position.get('code') in exclude_codes:
+                        continue
+
+                    building = {
+                        'code': position.get('code'),
+                        'position': position.get('position'),
+                        'level': 0,
+                        'state': BUILDING_STATE_NORMAL,
+                    }
+                    if self._is_upgradeable(building, resources, requirements):
+                        result.append(building)
+
+            for building in sorted(self.by_position.values(), key=lambda x: x.get('level', 0)):
+                if building.get('code') in exclude_codes:
+                    continue
+
+                if self._is_upgradeable(building, resources, requirements):
+                    result.append(building)
+
+        return result
@@ -0,0 +1,108 @@
+import copy
+import json
+import threading
+import time
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Read-through cache of idempotent api responses
+
+    Identical concurrent calls share one request (single-flight),
+    entries expire after the ttl of their endpoint or when a mutating endpoint invalidates them.
+    Every caller gets its own copy, so responses can still be modified freely.
+    """
+
+    def __init__(self, ttl_map, invalidation_map=None):
+        """
+        :param ttl_map: {api_path: ttl_in_seconds}
+        :param invalidation_map: {mutating_api_path: (api_path, ...)}
+        """
+        self.ttl_map = ttl_map
+        self.invalidation_map = invalidation_map or {}
+
+        self._lock = threading.Lock()
+        self._entries = {}  # key: (expires_at, response)
+        self._in_flight = {}  # key: _InFlight
+        self._generations = {}  # api_path: invalidation counter
+
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, api_path):
+        return api_path in self.ttl_map
+
+    @staticmethod
+    def _make_key(api_path, json_data):
+        return api_path, json.dumps(json_data, sort_keys=True, separators=(',', ':')) if json_data else ''
+
+    def get_or_fetch(self, api_path, json_data, fetch):
+        key = self._make_key(api_path, json_data)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                self.misses += 1
+                in_flight = self._in_flight[key] = _InFlight()
+                generation = self._generations.get(api_path, 0)
+            else:
+                self.hits += 1
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+
+            return copy.deepcopy(in_flight.result)
+
+        try:
+            in_flight.result = fetch()
+        except BaseException as e:
+            # e.g. KeyboardInterrupt too, the followers must not take the missing result for None
+            in_flight.error = e
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            # do not store a response requested before an invalidation
+            if self._generations.get(api_path, 0) == generation:
+                self._entries[key] = (time.monotonic() + self.ttl_map[api_path], in_flight.result)
+        in_flight.done.set()
+
+        return copy.deepcopy(in_flight.result)
+
+    def invalidate(self, *api_paths):
+        if not api_paths:
+            return
+
+        with self._lock:
+            for api_path in api_paths:
+                self._generations[api_path] = self._generations.get(api_path, 0) + 1
+
+            for key in [key for key in self._entries if key[0] in api_paths]:
+                del self._entries[key]
+
+    def invalidate_by(self, mutating_api_path):
+        self.invalidate(*self.invalidation_map.get(mutating_api_path, ()))
+
+    def clear(self):
+        with self._lock:
+            for api_path, _ in list(self._entries) + list(self._in_flight):
+                self._generations[api_path] = self._generations.get(api_path, 0) + 1
+            self._entries.clear()
@@ -1,17 +1,74 @@
 import base64
-import gzip
 import json
 import time
 import typing
 
 import httpx
-import ratelimit
 import tenacity
 
+import lokbot.codec
 import lokbot.enum
 import lokbot.util
+from lokbot.cache import ResponseCache
 from lokbot.exceptions import *
-from lokbot import logger, project_root
+from lokbot import project_root, config
+from lokbot.ratelimiter import RateLimiterRegistry, limits
+from lokbot.request_log import RequestLog
+
+# read-only endpoints served from `ResponseCache`, api_path: ttl in seconds
+RESPONSE_CACHE_TTL_MAP = {
+    'item/list': 30,
+    'kingdom/task/all': 5,
+    'kingdom/arcademy/research/list': 30,
+    'kingdom/wall/info': 10,
+    'kingdom/vip/info': 60,
+    'drago/lair/list': 30,
+}
+
+# mutating endpoints and the cached endpoints they make stale
+RESPONSE_CACHE_INVALIDATION_MAP = {
+    'item/use': ('item/list',),
+    'item/freechest': ('item/list',),
+    'kingdom/task/speedup': ('item/list', 'kingdom/task/all'),
+    'kingdom/heal/speedup': ('item/list',),
+    'kingdom/task/claim': ('kingdom/task/all', 'kingdom/arcademy/research/list'),
+    'kingdom/building/upgrade': ('kingdom/task/all',),
+    'kingdom/building/build': ('kingdom/task/all',),
+    'kingdom/arcademy/research': ('kingdom/task/all', 'kingdom/arcademy/research/list'),
+    'kingdom/barrack/train': ('kingdom/task/all',),
+    'kingdom/wall/repair': ('kingdom/wall/info',),
+    'kingdom/vip/claim': ('kingdom/vip/info', 'item/list'),
+    'kingdom/vipshop/buy': ('item/list',),
+    'kingdom/caravan/buy': ('item/list',),
+    'alliance/shop/buy': ('item/list',),
+    'alliance/gift/claim/all': ('item/list',),
+    'mail/claim/all': ('item/list',),
+    'quest/claim': ('item/list',),
+    'quest/claim/daily': ('item/list',),
+    'quest/claim/daily/level': ('item/list',),
+    'event/claim': ('item/list',),
+    'event/roulette/spin': ('item/list',),
+    'field/march/start': ('drago/lair/list',),
+}
+
+
+def raise_for_error_code(code):
+    """
+    map `err.code` of a failed response to the exception to raise
+    `no_auth` and `need_captcha` are handled by the api clients themselves
+    :param code:
+    :return:
+    """
+    if code == 'duplicated':
+        raise DuplicatedException()
+
+    if code == 'exceed_limit_packet':
+        raise ExceedLimitPacketException()
+
+    if code == 'not_online':
+        raise NotOnlineException()
+
+    raise OtherException(code)
 
 
 class LokBotApi:
@@ -36,29 +93,53 @@ class LokBotApi:
         self.request_callback = request_callback
         self._id = lokbot.util.decode_jwt(token).get('_id')
 
-        self.xor_password = None
+        self.codec = None
         self.protected_api_list = []
 
         self.last_requested_at = time.time()
+        self.rate_limiters = RateLimiterRegistry()
+        self.response_cache = ResponseCache(RESPONSE_CACHE_TTL_MAP, RESPONSE_CACHE_INVALIDATION_MAP)
+
+        self.request_log = RequestLog(self._id, **config.get('request_log', {}))
 
         self.captcha_solver = None
         if 'ttshitu' in captcha_solver_config:
             from lokbot.captcha_solver import Ttshitu
             self.captcha_solver = Ttshitu(**captcha_solver_config['ttshitu'])
 
+    @property
+    def xor_password(self):
+        return self.codec.password if self.codec else None
+
+    @xor_password.setter
+    def xor_password(self, password):
+        self.codec = lokbot.codec.XorCodec(password) if password is not None else None
+
     def xor(self, plain: bytes) -> bytes:
-        assert self.xor_password is not None
+        assert self.codec is not None
 
-        return bytearray([
-            each_plain ^ ord(self.xor_password[index % len(self.xor_password)])
-            for index, each_plain in enumerate(plain)
-        ])
+        return self.codec.xor(plain)
 
     def b64xor_enc(self, d: dict) -> str:
-        return base64.b64encode(self.xor(json.dumps(d, separators=(',', ':')).encode())).decode()
+        assert self.codec is not None
+
+        return self.codec.b64xor_enc(d)
 
     def b64xor_dec(self, s: typing.Union[str, bytes]) -> dict:
-        return json.loads(self.xor(base64.b64decode(s)))
+        assert self.codec is not None
+
+        return self.codec.b64xor_dec(s)
+
+    def post(self, url, json_data=None):
+        api_path = str(url).split('/api/').pop()
+
+        if self.response_cache.is_cacheable(api_path):
+            return self.response_cache.get_or_fetch(api_path, json_data, lambda: self._post(url, json_data))
+
+        res = self._post(url, json_data)
+        self.response_cache.invalidate_by(api_path)
+
+        return res
 
     @tenacity.retry(
         stop=tenacity.stop_after_attempt(2),
@@ -75,12 +156,8 @@ class LokBotApi:
         wait=tenacity.wait_fixed(3600),
         retry=tenacity.retry_if_exception_type(ExceedLimitPacketException),  # server-side rate limiter(wait 1h)
     )
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=0.1)
-    def post(self, url, json_data=None):
+    @limits('post', period=0.1)
+    def _post(self, url, json_data=None):
         if json_data is None:
             json_data = {}
 
@@ -108,16 +185,16 @@ class LokBotApi:
                 json_response = response.json()
         except json.JSONDecodeError:
             log_data.update({'res': response.text})
-            logger.error(log_data)
+            self.request_log.error(log_data)
 
             raise
 
         if json_response.get('isPacked') is True:
-            json_response = json.loads(gzip.decompress(bytearray(json_response.get('payload'))))
+            json_response = lokbot.codec.decode_packed(json_response.get('payload'))
 
         log_data.update({'res': json_response})
 
-        logger.debug(json.dumps(log_data))
+        self.request_log.record(api_path, log_data)
 
         if json_response.get('result'):
             if callable(self.request_callback):
@@ -128,6 +205,9 @@ class LokBotApi:
         err = json_response.get('err')
         code = err.get('code')
 
+        if code in ('no_auth', 'not_online'):
+            self.request_log.dump(code)
+
         if code == 'no_auth':
             project_root.joinpath(f'data/{self._id}.token').unlink(missing_ok=True)
             raise NoAuthException()
@@ -140,16 +220,7 @@ class LokBotApi:
 
             raise DuplicatedException()
 
-        if code == 'duplicated':
-            raise DuplicatedException()
-
-        if code == 'exceed_limit_packet':
-            raise ExceedLimitPacketException()
-
-        if code == 'not_online':
-            raise NotOnlineException()
-
-        raise OtherException(code)
+        raise_for_error_code(code)
 
     @tenacity.retry(
         stop=tenacity.stop_after_attempt(4),
@@ -170,17 +241,13 @@ class LokBotApi:
     def auth_captcha(self):
         return self.opener.get('auth/captcha')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('auth/captcha/confirm', period=2)
     def auth_captcha_confirm(self, value):
         return self.post('auth/captcha/confirm', {'value': value})
 
     def auth_connect(self, json_data=None):
         try:
-            res = self.post('https://lok-api-live.leagueofkingdoms.com/api/auth/connect', json_data)
+            res = self.post(f'{lokbot.enum.API_LIVE_BASE_URL}auth/connect', json_data)
         except OtherException:
             # {"result":false,"err":{}} when no auth
             project_root.joinpath(f'data/{self._id}.token').unlink(missing_ok=True)
@@ -228,11 +295,7 @@ class LokBotApi:
         """
         return self.post('quest/list/daily')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
+    @limits('quest/claim', period=1)
     def quest_claim(self, quest):
         """
         领取任务奖励
@@ -241,11 +304,7 @@ class LokBotApi:
         """
         return self.post('quest/claim', {'questId': quest.get('_id'), 'code': quest.get('code')})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
+    @limits('quest/claim/daily', period=1)
     def quest_claim_daily(self, quest):
         """
         领取日常任务奖励
@@ -254,11 +313,7 @@ class LokBotApi:
         """
         return self.post('quest/claim/daily', {'questId': quest.get('_id'), 'code': quest.get('code')})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
+    @limits('quest/claim/daily/level', period=1)
     def quest_claim_daily_level(self, reward):
         """
         领取日常任务上方进度条奖励
@@ -289,11 +344,7 @@ class LokBotApi:
         """
         return self.post('event/list')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('event/info', period=2)
     def event_info(self, root_event_id):
         """
         获取活动信息
@@ -301,11 +352,7 @@ class LokBotApi:
         """
         return self.post('event/info', {'rootEventId': root_event_id})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
+    @limits('event/claim', period=1)
     def event_claim(self, event_id, event_target_id, code):
         """
         领取活动奖励
@@ -330,7 +377,7 @@ class LokBotApi:
         获取基础信息
         :return:
         """
-        res = self.post('https://lok-api-live.leagueofkingdoms.com/api/kingdom/enter')
+        res = self.post(f'{lokbot.enum.API_LIVE_BASE_URL}kingdom/enter')
 
         captcha = res.get('captcha')
         if captcha and captcha.get('next'):
@@ -348,11 +395,7 @@ class LokBotApi:
         """
         return self.post('kingdom/task/all')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
+    @limits('kingdom/task/claim', period=4)
     def kingdom_task_claim(self, position):
         """
         领取任务奖励
@@ -360,11 +403,7 @@ class LokBotApi:
         """
         return self.post('kingdom/task/claim', {'position': position})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('kingdom/task/speedup', period=2)
     def kingdom_task_speedup(self, task_id, code, amount, is_buy=0):
         """
         加速任务
@@ -376,11 +415,7 @@ class LokBotApi:
 
         return res
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('kingdom/heal/speedup', period=2)
     def kingdom_heal_speedup(self, code, amount, is_buy=0):
         """
         加速治疗
@@ -416,11 +451,7 @@ class LokBotApi:
     def kingdom_hospital_wounded(self):
         return self.post('kingdom/hospital/wounded')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
+    @limits('kingdom/resource/harvest', period=4)
     def kingdom_resource_harvest(self, position):
         """
         收获资源
@@ -429,11 +460,7 @@ class LokBotApi:
         """
         return self.post('kingdom/resource/harvest', {'position': position})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),  # client-side rate limiter
-    )
-    @ratelimit.limits(calls=1, period=6)
+    @limits('kingdom/building/upgrade', period=6)
     def kingdom_building_upgrade(self, building, instant=0):
         """
         建筑升级
@@ -447,11 +474,7 @@ class LokBotApi:
             'instant': instant
         })
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=6)
+    @limits('kingdom/building/build', period=6)
     def kingdom_building_build(self, building, instant=0):
         """
         建筑建造
@@ -465,11 +488,7 @@ class LokBotApi:
             'instant': instant
         })
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=6)
+    @limits('kingdom/arcademy/research', period=6)
     def kingdom_academy_research(self, research, instant=0):
         """
         学院研究升级
@@ -508,11 +527,7 @@ class LokBotApi:
     def kingdom_caravan_list(self):
         return self.post('kingdom/caravan/list')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
+    @limits('kingdom/caravan/buy', period=4)
     def kingdom_caravan_buy(self, caravan_item_id):
         return self.post('kingdom/caravan/buy', {'caravanItemId': caravan_item_id})
 
@@ -557,11 +572,7 @@ class LokBotApi:
         """
         return self.post('item/list')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('item/use', period=2)
     def item_use(self, code, amount=1):
         """
         使用道具
@@ -584,11 +595,7 @@ class LokBotApi:
         """
         return self.post('auth/analytics', {'url': url, 'param': param})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
+    @limits('item/freechest', period=4)
     def item_free_chest(self, _type=0):
         """
         领取免费宝箱
@@ -597,11 +604,7 @@ class LokBotApi:
         """
         return self.post('item/freechest', {'type': _type})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('event/roulette/spin', period=2)
     def event_roulette_spin(self):
         """
         转轮抽奖
@@ -613,11 +616,7 @@ class LokBotApi:
     def mail_list_check(self):
         return self.post('mail/list/check')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
+    @limits('mail/claim/all', period=2)
     def mail_claim_all(self, category=1):
         return self.post('mail/claim/all', {'category': category})
 
@@ -633,11 +632,7 @@ class LokBotApi:
     def field_march_info(self, data):
         return self.post('field/march/info', data)
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
+    @limits('field/march/start', period=4)
     def field_march_start(self, data):
         return self.post('field/march/start', data)
 
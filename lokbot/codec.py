@@ -0,0 +1,156 @@
+import base64
+import binascii
+import gzip
+import json
+import re
+import typing
+import zlib
+
+# zlib window bits of a gzip stream
+GZIP_WBITS = 31
+
+OBJECTS_START = b'"objects":['
+OBJECT_SEPARATOR = b',{"_id":'
+CODE_KEY = b'"code":'
+# a `code` key not written as `CODE_KEY` immediately followed by the value
+LOOSE_CODE_KEY = re.compile(rb'"code"(?:\s+:|:\s)')
+
+_decoder = json.JSONDecoder()
+
+
+class XorCodec:
+    """
+    Wire codec of the protected api and the field socket
+
+    The key stream (the xor password repeated) is built once and grown on demand,
+    xor is done on whole integers instead of byte by byte.
+    """
+
+    def __init__(self, password: str):
+        self.password = password
+        self._key = password.encode('latin-1')
+        self._key_stream = self._key
+
+    def _get_key_stream(self, length: int) -> bytes:
+        if len(self._key_stream) < length:
+            repeat = -(-max(length, 2 * len(self._key_stream)) // len(self._key))
+            self._key_stream = self._key * repeat
+
+        return self._key_stream[:length]
+
+    def xor(self, plain: typing.Union[bytes, bytearray]) -> bytes:
+        length = len(plain)
+        if not length:
+            return b''
+
+        key_stream = self._get_key_stream(length)
+
+        return (int.from_bytes(plain, 'little') ^ int.from_bytes(key_stream, 'little')).to_bytes(length, 'little')
+
+    def b64xor_enc(self, d: dict) -> str:
+        return base64.b64encode(self.xor(json.dumps(d, separators=(',', ':')).encode())).decode()
+
+    def b64xor_dec(self, s: typing.Union[str, bytes]) -> dict:
+        return json.loads(self.xor(base64.b64decode(s)))
+
+    def decode_packs(self, packs: typing.Union[list, bytes, bytearray], codes=None) -> dict:
+        """
+        gzip + base64 + xor encoded `packs` of `/field/objects/v4`
+        :param packs:
+        :param codes: object codes wanted, the other objects are dropped before being decoded
+                      and only `objects` is kept
+        :return:
+        """
+        plain = self.xor(binascii.a2b_base64(gunzip(packs)))
+
+        if codes is None:
+            return json.loads(plain)
+
+        return {'objects': filter_objects(plain, codes)}
+
+
+def as_bytes(data: typing.Union[list, bytes, bytearray]) -> typing.Union[bytes, bytearray]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+
+    # a lot faster than `bytes()` from a list of ints
+    return bytearray(data)
+
+
+def gunzip(data: typing.Union[list, bytes, bytearray]) -> bytes:
+    data = as_bytes(data)
+
+    try:
+        return zlib.decompress(data, GZIP_WBITS)
+    except zlib.error:
+        # more than one gzip member
+        return gzip.decompress(data)
+
+
+def _parse_and_filter(plain: bytes, codes) -> list:
+    return [each for each in json.loads(plain).get('objects', []) if each.get('code') in codes]
+
+
+def filter_objects(plain: bytes, codes) -> list:
+    """
+    objects of a decoded `/field/objects/v4` payload whose `code` is in `codes`
+
+    Compact payloads not mentioning any of the codes are not parsed at all, otherwise only the pieces
+    of the `objects` array (split on `,{"_id":`) around a mention of a code are parsed.
+    Anything unexpected, e.g. whitespace after the keys, falls back to parsing the whole payload.
+    :param plain: json bytes
+    :param codes:
+    :return:
+    """
+    positions = set()
+    for code in codes:
+        token = CODE_KEY + b'%d' % code
+        position = plain.find(token)
+        while position >= 0:
+            positions.add(position)
+            position = plain.find(token, position + len(token))
+
+    if not positions:
+        # no mention of a code is only conclusive when the keys are written the way they are searched
+        return _parse_and_filter(plain, codes) if LOOSE_CODE_KEY.search(plain) else []
+
+    array_start = plain.find(OBJECTS_START)
+    if array_start < 0 or array_start > min(positions):
+        return _parse_and_filter(plain, codes)
+    array_start += len(OBJECTS_START)
+
+    # start of every piece mentioning a code, the separator is kept out of the piece
+    starts = set()
+    for position in positions:
+        separator = plain.rfind(OBJECT_SEPARATOR, array_start, position)
+        starts.add(array_start if separator < 0 else separator + 1)
+
+    result = []
+    for start in sorted(starts):
+        end = plain.find(OBJECT_SEPARATOR, start)
+        is_last = end < 0
+        text = plain[start:] if is_last else plain[start:end]
+
+        try:
+            each, each_end = _decoder.raw_decode(text.decode())
+        except ValueError:
+            # split inside of an object, e.g. a nested `_id`
+            return _parse_and_filter(plain, codes)
+
+        rest = text[each_end:]
+        if not isinstance(each, dict) or (not rest.lstrip().startswith(b']') if is_last else rest):
+            return _parse_and_filter(plain, codes)
+
+        if each.get('code') in codes:
+            result.append(each)
+
+    return result
+
+
+def decode_packed(payload: typing.Union[list, bytes, bytearray]) -> dict:
+    """
+    gzip encoded `payload` of `isPacked` responses
+    :param payload:
+    :return:
+    """
+    return json.loads(gunzip(payload))
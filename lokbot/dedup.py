@@ -0,0 +1,134 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import lokbot.field_index
+from lokbot import project_root
+
+# objects without `expired` are remembered this long
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 100000
+
+
+def object_key(loc, code, level, flag=0):
+    """
+    (world, x, y, code, level, flag) as one int
+    :param loc: [world_id, x, y]
+    :param code: object code, below 2 ** 25
+    :param level: below 64
+    :param flag: 0 or 1, e.g. occupied
+    :return:
+    """
+    return (lokbot.field_index.pack_loc(*loc) << 32) | (code << 7) | (level << 1) | flag
+
+
+class Dedup:
+    """
+    Remembers what was already done for a field object until the object expires
+
+    Keys are packed ints (`object_key`) mapped to their expiry time, the least recently seen ones
+    are evicted past `max_entries`. A snapshot is kept in `data/dedup_{name}.json` across restarts.
+    """
+
+    def __init__(self, name, max_entries=DEFAULT_MAX_ENTRIES, default_ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.snapshot_path = project_root.joinpath(f'data/dedup_{name}.json')
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key: expires_at, least recently seen first
+        self.counters = collections.Counter()
+
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        if not self.snapshot_path.exists():
+            return
+
+        try:
+            entries = json.loads(self.snapshot_path.read_text())
+        except (ValueError, OSError):
+            return
+
+        now = time.time()
+        for key, expires_at in entries:
+            if expires_at > now:
+                self._entries[key] = expires_at
+
+    def seen(self, key, expires_at=None, now=None):
+        """
+        whether `key` was seen and has not expired, remember it otherwise
+        :param key:
+        :param expires_at: timestamp, `default_ttl` from now when None
+        :param now:
+        :return:
+        """
+        now = now or time.time()
+
+        with self._lock:
+            known_expires_at = self._entries.get(key)
+            if known_expires_at is not None and known_expires_at > now:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return True
+
+            if known_expires_at is not None:
+                self.counters['expired'] += 1
+
+            self._entries[key] = expires_at or now + self.default_ttl
+            self._entries.move_to_end(key)
+            self.counters['misses'] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evicted'] += 1
+
+        return False
+
+    def seen_object(self, each_obj, flag=0, now=None):
+        """
+        `seen` of a decoded object of `/field/objects/v4`, expiring with the object
+        :param each_obj:
+        :param flag:
+        :param now:
+        :return:
+        """
+        key = object_key(each_obj.get('loc'), each_obj.get('code'), each_obj.get('level'), flag)
+
+        return self.seen(key, lokbot.field_index.parse_timestamp(each_obj.get('expired')), now)
+
+    def purge(self, now=None):
+        """
+        drop the expired keys
+        :param now:
+        :return: number of keys dropped
+        """
+        now = now or time.time()
+
+        with self._lock:
+            expired = [key for key, expires_at in self._entries.items() if expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+
+        return len(expired)
+
+    def save(self):
+        self.purge()
+
+        with self._lock:
+            content = json.dumps(list(self._entries.items()), separators=(',', ':'))
+
+        tmp_path = self.snapshot_path.with_suffix('.tmp')
+        tmp_path.write_text(content)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+
+        return {'size': len(self._entries), **counters}
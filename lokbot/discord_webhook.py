@@ -1,73 +1,324 @@
-
+import collections
 import json
+import threading
+import time
+
 import httpx
 from loguru import logger
 
+# Discord limits per message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+
+# retries of a batch on network errors and 5xx
+MAX_ATTEMPTS = 3
+
+
+def object_log_embed(obj_type, code, level, location, status, occupied_info=""):
+    color = 0x00FF00 if status == "Available" else 0xFF0000  # Green for available, Red for occupied
+
+    embed = {
+        "title": f"Found {obj_type}",
+        "color": color,
+        "fields": [
+            {"name": "Code", "value": str(code), "inline": True},
+            {"name": "Level", "value": str(level), "inline": True},
+            {"name": "Location", "value": str(location), "inline": True},
+            {"name": "Status", "value": status, "inline": True}
+        ]
+    }
+
+    if occupied_info:
+        embed["description"] = f"**Occupied Information:**\n{occupied_info}"
+
+    return embed
+
+
+def all_resources_embed(obj_type, code, level, location, status, occupied_info=""):
+    color = 0x3498DB  # Blue color for all resources
+
+    embed = {
+        "title": f"Resource Found: {obj_type}",
+        "color": color,
+        "fields": [
+            {"name": "Code", "value": str(code), "inline": True},
+            {"name": "Level", "value": str(level), "inline": True},
+            {"name": "Location", "value": str(location), "inline": True},
+            {"name": "Status", "value": status, "inline": True}
+        ]
+    }
+
+    if occupied_info:
+        embed["description"] = f"**Occupied Information:**\n{occupied_info}"
+
+    return embed
+
+
 class DiscordWebhook:
     def __init__(self, webhook_url):
         self.webhook_url = webhook_url
-        self.client = httpx.Client()
-    
+        self._client = None
+
+    @property
+    def client(self):
+        # pooled client of the dispatcher, taken on the first message
+        if self._client is None:
+            self._client = get_dispatcher().client(self.webhook_url)
+
+        return self._client
+
     def send_message(self, content, embed=None):
         """
-        Send a message to Discord webhook
+        Send a message to Discord webhook, synchronously
         """
         payload = {"content": content}
-        
+
         if embed:
             payload["embeds"] = [embed]
-            
+
         response = self.client.post(
             self.webhook_url,
             json=payload
         )
-        
+
         if response.status_code != 204:
             logger.error(f"Failed to send Discord webhook: {response.status_code} {response.text}")
             return False
-            
+
         return True
-    
+
     def send_object_log(self, obj_type, code, level, location, status, occupied_info=""):
         """
         Send formatted object log to Discord
         """
-        color = 0x00FF00 if status == "Available" else 0xFF0000  # Green for available, Red for occupied
-        
-        embed = {
-            "title": f"Found {obj_type}",
-            "color": color,
-            "fields": [
-                {"name": "Code", "value": str(code), "inline": True},
-                {"name": "Level", "value": str(level), "inline": True},
-                {"name": "Location", "value": str(location), "inline": True},
-                {"name": "Status", "value": status, "inline": True}
-            ]
-        }
-        
-        if occupied_info:
-            embed["description"] = f"**Occupied Information:**\n{occupied_info}"
-            
-        return self.send_message("", embed)
-    
+        return self.send_message("", object_log_embed(obj_type, code, level, location, status, occupied_info))
+
     def send_all_resources(self, obj_type, code, level, location, status, occupied_info=""):
         """
         Send all resources to a separate webhook regardless of type or level
         """
-        color = 0x3498DB  # Blue color for all resources
-        
-        embed = {
-            "title": f"Resource Found: {obj_type}",
-            "color": color,
-            "fields": [
-                {"name": "Code", "value": str(code), "inline": True},
-                {"name": "Level", "value": str(level), "inline": True},
-                {"name": "Location", "value": str(location), "inline": True},
-                {"name": "Status", "value": status, "inline": True}
-            ]
-        }
-        
-        if occupied_info:
-            embed["description"] = f"**Occupied Information:**\n{occupied_info}"
-            
-        return self.send_message("", embed)
+        return self.send_message("", all_resources_embed(obj_type, code, level, location, status, occupied_info))
+
+
+class _Channel:
+    """
+    Queue and worker thread of one webhook url, the thread starts with the first queued embed
+    """
+
+    def __init__(self, dispatcher, url, client):
+        self.dispatcher = dispatcher
+        self.url = url
+        self.client = client
+        self.queue = collections.deque()  # (embed, attempts)
+        self.condition = threading.Condition()
+        self.blocked_until = 0
+        self.sending = False
+
+        self.thread = None
+
+    def put(self, embed):
+        with self.condition:
+            self.queue.append((embed, 0))
+            self.condition.notify_all()
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='discord_webhook', daemon=True)
+                self.thread.start()
+
+    def _take_batch(self):
+        batch = []
+        chars = 0
+        while self.queue and len(batch) < MAX_EMBEDS_PER_MESSAGE:
+            embed, attempts = self.queue[0]
+            size = len(json.dumps(embed))
+            if batch and chars + size > MAX_EMBED_CHARS_PER_MESSAGE:
+                break
+
+            batch.append(self.queue.popleft())
+            chars += size
+
+        return batch
+
+    def _requeue(self, batch):
+        with self.condition:
+            self.queue.extendleft(reversed(batch))
+
+    def _block_from_headers(self, response):
+        """
+        wait for the bucket to refill once it is empty
+        """
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset_after = float(response.headers.get('X-RateLimit-Reset-After', 1))
+            self.blocked_until = max(self.blocked_until, time.monotonic() + reset_after)
+
+    def _send(self, batch):
+        try:
+            response = self.client.post(self.url, json={'embeds': [embed for embed, _ in batch]})
+        except httpx.HTTPError as e:
+            logger.warning(f'discord webhook request failed: {e}')
+            return self._retry(batch)
+
+        self._block_from_headers(response)
+
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get('retry_after'))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = float(response.headers.get('Retry-After', 1))
+
+            logger.warning(f'discord webhook rate limited, retry after {retry_after}s')
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.dispatcher.count('rate_limited')
+            self._requeue(batch)
+            return
+
+        if response.status_code >= 500:
+            return self._retry(batch)
+
+        if response.status_code == 400 and len(batch) > 1:
+            # one bad embed rejects the whole message, find it by sending them one by one
+            logger.warning(f'discord webhook rejected a batch of {len(batch)}, sending them one by one')
+            for i, each in enumerate(batch):
+                if self.blocked_until > time.monotonic():
+                    # rate limited or retrying, the rest waits in the queue
+                    self._requeue(batch[i:])
+                    return
+
+                self._send([each])
+            return
+
+        if response.status_code >= 400:
+            logger.error(f'Failed to send Discord webhook: {response.status_code} {response.text}')
+            self.dispatcher.count('failed', len(batch))
+            return
+
+        self.dispatcher.count('sent_messages')
+        self.dispatcher.count('sent_embeds', len(batch))
+
+    def _retry(self, batch):
+        batch = [(embed, attempts + 1) for embed, attempts in batch]
+        retryable = [each for each in batch if each[1] < MAX_ATTEMPTS]
+
+        self.dispatcher.count('failed', len(batch) - len(retryable))
+        self.blocked_until = max(self.blocked_until, time.monotonic() + 2 ** batch[0][1])
+        self._requeue(retryable)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.sending = False
+                    self.condition.notify_all()
+                    self.condition.wait()
+
+                wait = self.blocked_until - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+
+                self.sending = True
+                batch = self._take_batch()
+
+            self._send(batch)
+
+
+class WebhookDispatcher:
+    """
+    Sends embeds to Discord webhooks from background threads
+
+    One pooled client and one worker per webhook url, queued embeds are packed up to 10 per message.
+    429 responses and empty rate limit buckets pause the url for the time Discord asks for.
+    `submit` never blocks: when `max_queue_size` embeds are waiting the new ones are dropped.
+    """
+
+    def __init__(self, max_queue_size=1000, timeout=10):
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._channels = {}
+        self.counters = collections.Counter()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def client(self, url):
+        return self._channel(url).client
+
+    def _channel(self, url):
+        with self._lock:
+            channel = self._channels.get(url)
+            if channel is None:
+                client = httpx.Client(timeout=self.timeout)
+                channel = self._channels[url] = _Channel(self, url, client)
+
+            return channel
+
+    def queue_depth(self):
+        with self._lock:
+            channels = list(self._channels.values())
+
+        return sum(len(channel.queue) for channel in channels)
+
+    def submit(self, url, embed):
+        """
+        :param url: webhook url
+        :param embed:
+        :return: False when dropped
+        """
+        if self.queue_depth() >= self.max_queue_size:
+            self.count('dropped')
+            return False
+
+        self._channel(url).put(embed)
+
+        self.count('queued')
+
+        return True
+
+    def flush(self, timeout=None):
+        """
+        wait until every queued embed is sent or given up
+        :param timeout:
+        :return: True when everything is out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            channels = list(self._channels.values())
+
+        for channel in channels:
+            with channel.condition:
+                while channel.queue or channel.sending:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+
+                    channel.condition.wait(remaining)
+
+        return True
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+
+        return {'queue_depth': self.queue_depth(), **counters}
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> WebhookDispatcher:
+    """
+    one dispatcher for the whole process
+    :return:
+    """
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher()
+
+        return _dispatcher
@@ -1,8 +1,11 @@
 import json
 
+import lokbot.asset_cache
 from lokbot import project_root
 
 API_BASE_URL = 'https://api-lok-live.leagueofkingdoms.com/api/'
+# `auth/connect` and `kingdom/enter` are served by this one
+API_LIVE_BASE_URL = 'https://lok-api-live.leagueofkingdoms.com/api/'
 
 # 刚进游戏
 TUTORIAL_CODE_INTRO = 'Intro'
@@ -843,11 +846,19 @@ MARCH_TYPE_SUPPORT = 7
 MARCH_TYPE_RALLY = 8
 
 
+def building_json_path(building_type):
+    return project_root.joinpath(f'lokbot/assets/buildings/{building_type}.json')
+
+
+def research_json_path(research_category):
+    return project_root.joinpath(f'lokbot/assets/research/{research_category}.json')
+
+
 def load_building_json():
     result = {}
 
     for building_type, building_code in BUILDING_CODE_MAP.items():
-        current_building_json = json.load(open(project_root.joinpath(f'lokbot/assets/buildings/{building_type}.json')))
+        current_building_json = json.load(open(building_json_path(building_type)))
         result[building_code] = current_building_json
 
     return result
@@ -857,17 +868,20 @@ def load_research_json():
     result = {}
 
     for research_category, research in RESEARCH_CODE_MAP.items():
-        current_research_json = json.load(
-            open(project_root.joinpath(f'lokbot/assets/research/{research_category}.json'))
-        )
+        current_research_json = json.load(open(research_json_path(research_category)))
         for research_name, research_code in research.items():
             result[research_code] = current_research_json[research_name]
 
     return result
 
 
-building_json = load_building_json()
-research_json = load_research_json()
+# loaded on first access, from `data/assets_*.marshal` when the json files are unchanged
+building_json = lokbot.asset_cache.LazyTable(
+    'building', [building_json_path(each) for each in BUILDING_CODE_MAP], load_building_json
+)
+research_json = lokbot.asset_cache.LazyTable(
+    'research', [research_json_path(each) for each in RESEARCH_CODE_MAP], load_research_json
+)
 # https://play.leagueofkingdoms.com/json/table-live_136.nod
 # troop_json = json.load(open(project_root.joinpath('lokbot/assets/troop.json')))
 # field_monster_json = json.load(open(project_root.joinpath('lokbot/assets/field_monster.json')))
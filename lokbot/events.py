@@ -0,0 +1,235 @@
+import collections
+import threading
+import time
+
+from lokbot import logger
+from lokbot.enum import *
+
+# seconds between the first event and the job run, later events within are coalesced into that run
+DEFAULT_DEBOUNCE = 10
+
+
+class Event:
+    """
+    Kingdom event published by the socket handlers, `name` is the one used by the `triggers` of the config
+    """
+    __slots__ = ()
+    name = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)})'
+
+
+class BuildingUpdated(Event):
+    __slots__ = ('building', 'code', 'position', 'level', 'wounded')
+    name = 'building_update'
+
+    def __init__(self, building):
+        self.building = building
+        self.code = building.get('code')
+        self.position = building.get('position')
+        self.level = building.get('level')
+        # hospital only
+        self.wounded = bool((building.get('param') or {}).get('wounded'))
+
+
+class ResourceUpdated(Event):
+    __slots__ = ('index', 'value')
+    name = 'resource_update'
+
+    def __init__(self, data):
+        self.index = data.get('resourceIdx')
+        self.value = data.get('value')
+
+
+class TaskUpdated(Event):
+    __slots__ = ('task', 'code', 'status')
+    name = 'task_update'
+
+    def __init__(self, task):
+        self.task = task
+        self.code = task.get('code')
+        self.status = task.get('status')
+
+
+class BuffListUpdated(Event):
+    __slots__ = ('buffs', 'item_codes')
+    name = 'buff_list'
+
+    def __init__(self, buffs):
+        self.buffs = buffs
+        self.item_codes = frozenset(buff.get('param', {}).get('itemCode') for buff in buffs)
+
+
+class AllianceRallyNew(Event):
+    __slots__ = ('rally', 'code')
+    name = 'alliance_rally_new'
+
+    def __init__(self, rally):
+        self.rally = rally
+        self.code = rally.get('code')
+
+
+EVENT_TYPES = {
+    event_type.name: event_type
+    for event_type in (BuildingUpdated, ResourceUpdated, TaskUpdated, BuffListUpdated, AllianceRallyNew)
+}
+
+# triggers of the jobs without `triggers` in the config, kept even when the job is disabled or missing:
+# the kingdom socket always recovered the wounded troops of the hospital
+DEFAULT_TRIGGERS = {
+    'hospital_recover': [{'event': 'building_update', 'code': BUILDING_CODE_MAP['hospital'], 'wounded': True}],
+}
+
+
+def with_default_triggers(jobs):
+    """
+    `config['main']['jobs']` plus `DEFAULT_TRIGGERS`: a disabled or missing job runs on its default triggers only
+    :param jobs:
+    :return: the jobs to run, new dicts for the changed ones
+    """
+    result = []
+    for job in jobs:
+        default_triggers = DEFAULT_TRIGGERS.get(job.get('name'))
+        if default_triggers is None:
+            result.append(job)
+        elif job.get('enabled'):
+            result.append({'triggers': default_triggers, **job})
+        else:
+            result.append({'name': job.get('name'), 'enabled': True, 'kwargs': job.get('kwargs', {}),
+                           'triggers': default_triggers})
+
+    names = {job.get('name') for job in jobs}
+    result += [
+        {'name': name, 'enabled': True, 'triggers': triggers}
+        for name, triggers in DEFAULT_TRIGGERS.items() if name not in names
+    ]
+
+    return result
+
+
+class EventFilter:
+    """
+    Compiled trigger of the config: {"event": name, attribute: value or [values], ...}
+    e.g. {"event": "building_update", "code": 40100106, "wounded": true}
+    """
+    __slots__ = ('name', 'conditions')
+
+    def __init__(self, trigger):
+        self.name = trigger['event']
+        assert self.name in EVENT_TYPES, f'unknown event {self.name}'
+
+        self.conditions = []
+        for attribute, value in trigger.items():
+            if attribute == 'event':
+                continue
+
+            assert attribute in EVENT_TYPES[self.name].__slots__, f'{self.name} has no attribute {attribute}'
+            values = frozenset(value) if isinstance(value, list) else frozenset([value])
+            self.conditions.append((attribute, values))
+
+    def matches(self, event):
+        return all(getattr(event, attribute) in values for attribute, values in self.conditions)
+
+
+class EventBus:
+    """
+    Events of one account, handlers run in the thread of the publisher and must not block
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = collections.defaultdict(list)  # name: [handler, ...]
+        self.counters = collections.Counter()
+
+    def subscribe(self, name, handler):
+        """
+        :param name: `Event.name`
+        :param handler: called with the event
+        :return:
+        """
+        assert name in EVENT_TYPES, f'unknown event {name}'
+
+        with self._lock:
+            self._handlers[name].append(handler)
+
+    def unsubscribe(self, name, handler):
+        with self._lock:
+            if handler in self._handlers[name]:
+                self._handlers[name].remove(handler)
+
+    def publish(self, event):
+        with self._lock:
+            handlers = list(self._handlers[event.name])
+            self.counters[event.name] += 1
+
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                logger.exception(f'handler of {event} failed: {e}')
+
+    def on(self, triggers, handler):
+        """
+        subscribe `handler` to the events matching any of `triggers`
+        :param triggers: config triggers, see `EventFilter`
+        :param handler:
+        :return:
+        """
+        filters_by_name = collections.defaultdict(list)
+        for trigger in triggers:
+            event_filter = EventFilter(trigger)
+            filters_by_name[event_filter.name].append(event_filter)
+
+        for name, filters in filters_by_name.items():
+            def matching_handler(event, filters=filters):
+                if any(event_filter.matches(event) for event_filter in filters):
+                    handler(event)
+
+            self.subscribe(name, matching_handler)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+class Debouncer:
+    """
+    Turns a burst of events into one run of a job
+
+    The run is submitted `debounce` seconds after the first event, the events until it starts are coalesced into it,
+    and runs are at least `min_interval` seconds apart.
+    `submit(delay, func)` schedules `func`, e.g. on the process scheduler or the event loop.
+    """
+
+    def __init__(self, name, run, submit, debounce=DEFAULT_DEBOUNCE, min_interval=0):
+        self.name = name
+        self.run = run
+        self.submit = submit
+        self.debounce = debounce
+        self.min_interval = min_interval
+
+        self._lock = threading.Lock()
+        self._pending = False
+        self._last_run_at = 0
+        self.counters = collections.Counter()
+
+    def __call__(self, event):
+        with self._lock:
+            if self._pending:
+                self.counters['coalesced'] += 1
+                return
+
+            self._pending = True
+            delay = max(self.debounce, self._last_run_at + self.min_interval - time.time())
+
+        logger.debug(f'{event} triggers {self.name} in {delay:.0f}s')
+        self.submit(delay, self._run)
+
+    def _run(self):
+        with self._lock:
+            self._pending = False
+            self._last_run_at = time.time()
+            self.counters['runs'] += 1
+
+        return self.run()
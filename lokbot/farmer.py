@@ -1,7 +1,5 @@
 import base64
-import functools
-import gzip
-import logging
+import concurrent.futures
 import math
 import random
 import threading
@@ -12,12 +10,40 @@ import numpy
 import socketio
 import tenacity
 
+import lokbot.buildings
+import lokbot.dedup
+import lokbot.discord_webhook
+import lokbot.events
+import lokbot.field_index
+import lokbot.geo
+import lokbot.kingdom
+import lokbot.raster
+import lokbot.research
+import lokbot.scheduler
+import lokbot.sighting_store
+import lokbot.speedup
+import lokbot.targeting
 import lokbot.util
+import lokbot.zone_scheduler
 from lokbot import logger, socf_logger, sock_logger, socc_logger, config
 from lokbot.client import LokBotApi
 from lokbot.enum import *
 from lokbot.exceptions import OtherException, FatalApiException
 
+# land levels change as kingdoms develop, refresh them once a day
+DEVRANK_MAX_AGE = 24 * 3600
+
+DEVICE_INFO = {
+    "build": "global",
+    "OS": "Windows 10",
+    "country": "USA",
+    "language": "English",
+    "bundle": "",
+    "version": "1.1694.152.229",
+    "platform": "web",
+    "pushId": ""
+}
+
 ws_headers = {
     'Accept': '*/*',
     'Accept-Encoding': 'gzip, deflate, br',
@@ -29,50 +55,76 @@ ws_headers = {
 }
 
 
-# Ref: https://stackoverflow.com/a/16858283/6266737
-def blockshaped(arr, nrows, ncols):
+def process_field_objects(farmer, objects, target_matcher):
     """
-    Return an array of shape (n, nrows, ncols) where
-    n * nrows * ncols = arr.size
-
-    If arr is a 2D array, the returned array should look like n subblocks with
-    each subblock preserving the "physical" layout of arr.
+    index, count, store, log and notify the objects of a `/field/objects/v4` packet
+    :param farmer: `LokFarmer` or `AsyncLokFarmer`
+    :param objects: decoded objects
+    :param target_matcher: `lokbot.targeting.TargetMatcher`
+    :return: [(each_obj, decision), ...] to share to chat
     """
-    h, w = arr.shape
-    assert h % nrows == 0, f"{h} rows is not evenly divisible by {nrows}"
-    assert w % ncols == 0, f"{w} cols is not evenly divisible by {ncols}"
-    return (arr.reshape(h // nrows, nrows, -1, ncols)
-            .swapaxes(1, 2)
-            .reshape(-1, nrows, ncols))
-
-
-# Ref: https://stackoverflow.com/a/432175/6266737
-# noinspection PyBroadException
-def ndindex(ndarray, item):
-    if len(ndarray.shape) == 1:
-        try:
-            return [ndarray.tolist().index(item)]
-        except:
-            pass
-    else:
-        for i, subarray in enumerate(ndarray):
-            try:
-                return [i] + ndindex(subarray, item)
-            except:
-                pass
+    farmer.field_index.update(objects)
+    sighting_store = lokbot.sighting_store.get_store()
+    webhook_dispatcher = lokbot.discord_webhook.get_dispatcher()
+
+    logger.debug(f'Processing {len(objects)} objects')
+    to_share = []
+    for each_obj in objects:
+        decision = target_matcher.match(each_obj)
+        if decision is None:
+            # not the one we are looking for
+            continue
+
+        code = each_obj.get('code')
+        level = each_obj.get('level')
+        loc = each_obj.get('loc')
+        target = decision.target
+
+        farmer.zone_scheduler.record_hit(lokbot.geo.zone_id_by_coords(loc[1], loc[2]), code)
+
+        if target.obj_type is None:
+            continue
+
+        # Format status information
+        status = "Available"
+        occupied_info = ""
+
+        if each_obj.get('occupied'):
+            status = "Occupied"
+            occupied = each_obj.get('occupied')
+            occupied_info = f"""
+    Occupied by: {occupied.get('name', 'Unknown')}
+    Alliance: {occupied.get('allianceTag', 'None')}
+    From World: {occupied.get('worldId', 'Unknown')}
+    Started: {occupied.get('started', 'Unknown')}
+    Ended: {occupied.get('ended', 'Unknown')}"""
+
+        # kept for later queries, see `SightingStore.within`
+        sighting_store.add(each_obj)
+
+        # Send to Discord, queued so the socket thread never waits on it
+        # once per object and occupation status
+        if decision.routes and \
+                not farmer.notified_objects.seen_object(each_obj, int(bool(each_obj.get('occupied')))):
+            for route in decision.routes:
+                embed = getattr(lokbot.discord_webhook, f'{route.embed}_embed')
+                title = route.title.format(obj_type=target.obj_type, level=level, resource_name=target.resource_name)
+                webhook_dispatcher.submit(route.webhook_url, embed(title, code, level, loc, status, occupied_info.strip()))
+
+        logger.info(f"Found {target.obj_type} - Code: {code}, Level: {level}, Location: {loc}, Status: {status}")
 
+        if decision.share and not farmer.shared_objects.seen_object(each_obj):
+            to_share.append((each_obj, decision))
 
-# Ref: https://stackoverflow.com/a/22550933/6266737
-def neighbors(a, radius, row_number, column_number):
-    return [[a[i][j] if 0 <= i < len(a) and 0 <= j < len(a[0]) else 0
-             for j in range(column_number - 1 - radius, column_number + radius)]
-            for i in range(row_number - 1 - radius, row_number + radius)]
+    return to_share
 
 
 class LokFarmer:
-    def __init__(self, token, captcha_solver_config):
-        self.kingdom_enter = None
+    def __init__(self, token, captcha_solver_config, startup_concurrency=4):
+        # `kingdom/enter` and what changed since, see `resync_kingdom`
+        self.state = lokbot.kingdom.KingdomState()
         self.token = token
+        self.startup_metrics = {'started_at': time.time()}
         self.api = LokBotApi(token, captcha_solver_config, self._request_callback)
 
         auth_res = self.api.auth_connect({"deviceInfo": {"build": "global"}})
@@ -84,46 +136,93 @@ class LokFarmer:
         self.token = auth_res.get('token')
         self._id = lokbot.util.decode_jwt(token).get('_id')
         project_root.joinpath(f'data/{self._id}.token').write_text(self.token)
+        self.startup_metrics['auth_connect'] = time.time() - self.startup_metrics['started_at']
+
+        # everything below only needs the token and the xor key, `chat_logs` also needs `kingdom_enter`
+        with concurrent.futures.ThreadPoolExecutor(startup_concurrency, thread_name_prefix='startup') as executor:
+            kingdom_enter_future = executor.submit(self.api.kingdom_enter)
+            futures = [
+                executor.submit(self.api.auth_set_device_info, DEVICE_INFO),
+                executor.submit(self.api.drago_lair_list),
+            ]
 
-        self.kingdom_enter = self.api.kingdom_enter()
-        self.alliance_id = self.kingdom_enter.get('kingdom', {}).get('allianceId')
-
-        self.api.auth_set_device_info({
-            "build": "global",
-            "OS": "Windows 10",
-            "country": "USA",
-            "language": "English",
-            "bundle": "",
-            "version": "1.1694.152.229",
-            "platform": "web",
-            "pushId": ""
-        })
+            kingdom_enter = kingdom_enter_future.result()
+            self.state.on_kingdom_enter(kingdom_enter)
+            self.alliance_id = self.state.alliance_id
+
+            futures.append(executor.submit(self.api.chat_logs, f'w{self.state.kingdom.get("worldId")}'))
+            if self.alliance_id:
+                futures.append(executor.submit(self.api.chat_logs, f'a{self.alliance_id}'))
 
-        self.api.chat_logs(f'w{self.kingdom_enter.get("kingdom").get("worldId")}')
-        if self.alliance_id:
-            self.api.chat_logs(f'a{self.alliance_id}')
+            drago_lair_list = futures[1].result()
+            [future.result() for future in futures]
 
-        # [food, lumber, stone, gold]
-        self.resources = self.kingdom_enter.get('kingdom').get('resources')
+        self.startup_metrics['handshake'] = time.time() - self.startup_metrics['started_at']
+        logger.info(f'startup handshake finished in {self.startup_metrics["handshake"]:.3f}s')
+
+        self.buildings = lokbot.buildings.BuildingIndex(self.state.kingdom.get('buildings', []))
         self.buff_item_use_lock = threading.Lock()
         self.hospital_recover_lock = threading.Lock()
-        self.has_additional_building_queue = self.kingdom_enter.get('kingdom').get('vip', {}).get('level') >= 5
-        self.troop_queue = []
-        self.march_limit = 2
-        self.march_size = 10000
-        self.level = self.kingdom_enter.get('kingdom').get('level')
+        self.has_additional_building_queue = self.state.kingdom.get('vip', {}).get('level') >= 5
         self.socf_entered = False
         self.socf_world_id = None
+        # raw `/field/objects/v4` packets left to record for this process, across the `socf_thread` runs
+        self.packets_to_record = config.get('record_field_packets', 0)
         self.field_object_processed = False
         self.started_at = time.time()
-        self.building_queue_available = threading.Event()
-        self.research_queue_available = threading.Event()
-        self.train_queue_available = threading.Event()
-        self.kingdom_tasks = []
-        self.zones = []
-        self.available_dragos = self._get_available_dragos()
-        self.drago_action_point = self.kingdom_enter.get('kingdom').get('dragoActionPoint', {}).get('value', 0)
-        self.shared_objects = set()
+        self.scheduler = lokbot.scheduler.get_scheduler()
+        self.building_queue_available = lokbot.scheduler.Trigger(self.scheduler)
+        self.research_queue_available = lokbot.scheduler.Trigger(self.scheduler)
+        self.research_index = lokbot.research.ResearchIndex()
+        self.train_queue_available = lokbot.scheduler.Trigger(self.scheduler)
+        self.zone_scheduler = None
+        self.field_index = lokbot.field_index.FieldIndex()
+        self.state.on_drago_lair_list(drago_lair_list)
+        self.shared_objects = lokbot.dedup.Dedup(f'shared_objects_{self._id}')
+        self.notified_objects = lokbot.dedup.Dedup(f'notified_objects_{self._id}')
+        # published by `sock_thread`
+        self.events = lokbot.events.EventBus()
+
+    # read-only views of `state`, change it with its `on_*` methods
+    # [food, lumber, stone, gold]
+    resources = property(lambda self: self.state.resources)
+    kingdom_tasks = property(lambda self: self.state.kingdom_tasks)
+    troop_queue = property(lambda self: self.state.troop_queue)
+    march_limit = property(lambda self: self.state.march_limit)
+    march_size = property(lambda self: self.state.march_size)
+    available_dragos = property(lambda self: self.state.available_dragos)
+    drago_action_point = property(lambda self: self.state.drago_action_point)
+    level = property(lambda self: self.state.level)
+
+    def job_key(self, name):
+        return f'{self._id}:{name}'
+
+    def schedule(self, name, delay, func, *args, **kwargs):
+        """
+        run `func` on the process scheduler in `delay` seconds, one pending run per account and `name`
+        :param name:
+        :param delay:
+        :param func:
+        :return:
+        """
+        return self.scheduler.submit(self.job_key(name), func, *args, delay=delay, **kwargs)
+
+    def on_events(self, name, triggers, run, debounce=lokbot.events.DEFAULT_DEBOUNCE, min_interval=0):
+        """
+        run `run` on the process scheduler after the events matching `triggers`, see `lokbot.events.Debouncer`
+        :param name: job name
+        :param triggers: `triggers` of the job config
+        :param run:
+        :param debounce: seconds
+        :param min_interval: seconds
+        :return:
+        """
+        debouncer = lokbot.events.Debouncer(
+            name, run, lambda delay, func: self.schedule(f'event_{name}', delay, func), debounce, min_interval
+        )
+        self.events.on(triggers, debouncer)
+
+        return debouncer
 
     @staticmethod
     def calc_time_diff_in_seconds(expected_ended):
@@ -135,161 +234,62 @@ class LokFarmer:
 
         return diff_in_seconds + random.randint(5, 10)
 
-    def _is_building_upgradeable(self, building, buildings):
-        if building.get('state') != BUILDING_STATE_NORMAL:
-            return False
-
-        if building.get('code') == BUILDING_CODE_MAP['barrack']:
-            for t in self.kingdom_tasks:
-                if t.get('code') == TASK_CODE_CAMP:
-                    return False
-
-        # 暂时忽略联盟中心
-        if building.get('code') == BUILDING_CODE_MAP['hall_of_alliance']:
-            return False
-
-        building_level = building.get('level')
-        current_building_json = building_json.get(building.get('code'))
-
-        if not current_building_json:
-            return False
-
-        next_level_building_json = current_building_json.get(str(building_level + 1))
-        for requirement in next_level_building_json.get('requirements'):
-            req_level = requirement.get('level')
-            req_type = requirement.get('type')
-            req_code = BUILDING_CODE_MAP.get(req_type)
-
-            if not [b for b in buildings if b.get('code') == req_code and b.get('level') >= req_level]:
-                return False
-
-        for res_requirement in next_level_building_json.get('resources'):
-            req_value = res_requirement.get('value')
-            req_type = res_requirement.get('type')
-
-            if self.resources[RESOURCE_IDX_MAP[req_type]] < req_value:
-                return False
-
-        return True
-
-    def _is_researchable(self, academy_level, category_name, research_name, exist_researches, to_max_level=False):
-        research_category = RESEARCH_CODE_MAP.get(category_name)
-        research_code = research_category.get(research_name)
-
-        exist_research = [each for each in exist_researches if each.get('code') == research_code]
-        current_research_json = research_json.get(research_code)
-
-        # already finished
-        if exist_research and exist_research[0].get('level') >= int(current_research_json[-1].get('level')):
-            return False
-
-        # minimum required level only
-        if not to_max_level and \
-                exist_research and \
-                exist_research[0].get('level') >= RESEARCH_MINIMUM_LEVEL_MAP.get(category_name).get(research_name, 0):
-            return False
-
-        next_level_research_json = current_research_json[0]
-        if exist_research:
-            next_level_research_json = current_research_json[exist_research[0].get('level')]
-
-        for requirement in next_level_research_json.get('requirements'):
-            req_level = int(requirement.get('level'))
-            req_type = requirement.get('type')
-
-            # 判断学院等级
-            if req_type == 'academy' and req_level > academy_level:
-                return False
-
-            # 判断前置研究是否完成
-            if req_type != 'academy' and not [each for each in exist_researches if
-                                              each.get('code') == research_category.get(req_type)
-                                              and each.get('level') >= req_level]:
-                return False
-
-        for res_requirement in next_level_research_json.get('resources'):
-            req_value = int(res_requirement.get('value'))
-            req_type = res_requirement.get('type')
+    def _update_kingdom_enter_building(self, building):
+        self.buildings.update(building)
+        self.state.on_building_update(building)
 
-            if self.resources[RESOURCE_IDX_MAP[req_type]] < req_value:
-                return False
+    def record_first_action(self):
+        elapsed = time.time() - self.startup_metrics['started_at']
+        if self.startup_metrics.setdefault('time_to_first_action', elapsed) is not elapsed:
+            return
 
-        return True
+        logger.info(f'time to first action: {elapsed:.3f}s')
 
-    def _update_kingdom_enter_building(self, building):
-        if building.get('code') == BUILDING_CODE_MAP['hospital']:
-            if building.get('param', {}).get('wounded', []):
-                logger.info('hospital has wounded troops, try to recover')
-                self.hospital_recover()
+    def recording_first_action(self, func):
+        """
+        :param func: a job or loop
+        :return: `func` recording the time to first action once a call returned
+        """
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            self.record_first_action()
 
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
+            return result
 
-        self.kingdom_enter['kingdom']['buildings'] = [
-                                                         b for b in buildings if
-                                                         b.get('position') != building.get('position')
-                                                     ] + [building]
+        return wrapper
 
     def _request_callback(self, json_response):
-        resources = json_response.get('resources')
-
-        if resources and len(resources) == 4:
-            logger.info(f'resources updated: {resources}')
-            self.resources = resources
+        if self.state.on_response(json_response):
+            logger.info(f'resources updated: {self.state.resources}')
 
     def _get_optimal_speedups(self, need_seconds, speedup_type):
-        current_map = ITEM_CODE_SPEEDUP_MAP.get(speedup_type)
-        current_map.update(ITEM_CODE_SPEEDUP_MAP.get('universal'))
+        assert speedup_type in ITEM_CODE_SPEEDUP_MAP, f'invalid speedup type: {speedup_type}'
 
-        assert current_map, f'invalid speedup type: {speedup_type}'
+        current_map = {**ITEM_CODE_SPEEDUP_MAP.get('universal'), **ITEM_CODE_SPEEDUP_MAP.get(speedup_type)}
 
+        # served from `response_cache`, dropped once a speedup item is used
         items = self.api.item_list().get('items', [])
-        items = [item for item in items if item.get('code') in current_map.keys()]
+        inventory = {
+            item.get('code'): (current_map.get(item.get('code')), item.get('amount'))
+            for item in items if item.get('code') in current_map
+        }
 
-        if not items:
+        if not inventory:
             logger.info(f'no speedup item found for {speedup_type}')
             return False
 
-        # build `{code, amount, second}` map
-        speedups = []
-        for item in items:
-            speedups.append({
-                'code': item.get('code'),
-                'amount': item.get('amount'),
-                'second': current_map.get(item.get('code'))
-            })
-
-        # sort by speedup second desc
-        speedups = sorted(speedups, key=lambda x: x.get('second'), reverse=True)
-
-        counts = {each.get('code'): 0 for each in speedups}
-
-        remaining_seconds = need_seconds
-        used_seconds = 0
-        for each in speedups:
-            while remaining_seconds >= each.get('second') and counts.get(each.get('code')) < each.get('amount'):
-                remaining_seconds -= each.get('second')
-                counts[each.get('code')] += 1
-                used_seconds += each.get('second')
-
-        if speedup_type == 'recover':
-            # greedy mode
-            speedups_asc = sorted(speedups, key=lambda x: x.get('second'))
-            for each in speedups_asc:
-                while remaining_seconds >= 0 and counts.get(each.get('code')) < each.get('amount'):
-                    remaining_seconds -= each.get('second')
-                    counts[each.get('code')] += 1
-                    used_seconds += each.get('second')
+        speedups = lokbot.speedup.optimal_speedups(
+            need_seconds, inventory,
+            # healing only ends once fully covered, the other tasks end by themselves
+            at_least=speedup_type == 'recover',
+            preferred=ITEM_CODE_SPEEDUP_MAP.get(speedup_type)
+        )
 
-        counts = {k: v for k, v in counts.items() if v > 0}
-
-        if not counts:
+        if not speedups:
             logger.info(f'cannot find optimal speedups for {speedup_type}')
             return False
 
-        return {
-            'counts': counts,
-            'used_seconds': used_seconds
-        }
+        return speedups
 
     def do_speedup(self, expected_ended, task_id, speedup_type):
         need_seconds = self.calc_time_diff_in_seconds(expected_ended)
@@ -310,10 +310,7 @@ class LokFarmer:
                         self.api.kingdom_task_speedup(task_id, code, count)
                     time.sleep(random.randint(1, 3))
 
-    def _upgrade_building(self, building, buildings, speedup):
-        if not self._is_building_upgradeable(building, buildings):
-            return 'continue'
-
+    def _upgrade_building(self, building, speedup):
         try:
             if building.get('level') == 0:
                 res = self.api.kingdom_building_build(building)
@@ -394,103 +391,44 @@ class LokFarmer:
 
             alliance_point -= cost * amount
 
-    @functools.lru_cache()
-    def _get_land_with_level(self):
-        rank = self.api.field_worldmap_devrank().get('lands')
-
-        land_with_level = [[], [], [], [], [], [], [], [], [], []]
-        for index, level in enumerate(rank):
-            # land id start from 100000
-            land_with_level[int(level)].append(100000 + index)
-
-        return land_with_level
-
-    @staticmethod
-    @functools.lru_cache()
-    def _get_land_array():
-        return numpy.arange(100000, 165536).reshape(256, 256)
-
-    @functools.lru_cache()
-    def _get_land_array_4_by_4(self):
-        return blockshaped(self._get_land_array(), 4, 4)
+    def _get_devrank(self):
+        """
+        land levels of the world, 256 * 256 indexed by [y // 8, x // 8]
+        :return:
+        """
+        store = lokbot.raster.get_store(self.state.kingdom.get('worldId'))
 
-    @staticmethod
-    @functools.lru_cache()
-    def _get_zone_array():
-        return numpy.arange(0, 4096).reshape(64, 64)
+        return store.get_or_fetch_devrank(
+            lambda: self.api.field_worldmap_devrank().get('lands'), max_age=DEVRANK_MAX_AGE
+        )
 
-    @functools.lru_cache()
     def _get_nearest_land(self, x, y, radius=32):
-        land_array = self._get_land_array()
-        # current_land_id = land_array[y // 8, x // 8]
-        nearby_land_ids = neighbors(land_array, radius, y // 8 + 1, x // 8 + 1)
-        nearby_land_ids = [item for sublist in nearby_land_ids for item in sublist if item != 0]
-        land_with_level = self._get_land_with_level()
-
-        lands = []
-        for index, each_level in enumerate(reversed(land_with_level)):
-            level = 10 - index
-
-            # if level < 3:
-            #     continue
-
-            lands += [(each_land_id, level) for each_land_id in each_level if each_land_id in nearby_land_ids]
-
-        return lands
+        return lokbot.geo.nearest_lands(self._get_devrank(), x, y, radius)
 
     def _get_top_leveled_land(self, limit=1024):
-        land_with_level = self._get_land_with_level()
-
-        lands = []
-        for index, each_level in enumerate(reversed(land_with_level)):
-            level = 10 - index
-
-            if level < 2:
-                continue
-
-            if len(each_level) > limit:
-                return lands + each_level[:limit]
+        return lokbot.geo.top_lands(self._get_devrank(), 2, limit)
 
-            lands += [(each, level) for each in each_level]
-            limit -= len(each_level)
-
-        return lands
-
-    @functools.lru_cache()
-    def _get_zone_id_by_land_id(self, land_id):
-        land_array = self._get_land_array_4_by_4()
-
-        return ndindex(land_array, land_id)[0]
-
-    @functools.lru_cache()
     def _get_nearest_zone(self, x, y, radius=16):
-        lands = self._get_nearest_land(x, y, radius)
-        zones = []
-        for land_id, _ in lands:
-            zone_id = self._get_zone_id_by_land_id(land_id)
-            if zone_id not in zones:
-                zones.append(zone_id)
-
-        return zones
-
-    def _get_nearest_zone_ng(self, x, y, radius=8):
-        current_zone_id = lokbot.util.get_zone_id_by_coords(x, y)
-
-        idx = ndindex(self._get_zone_array(), current_zone_id)
-
-        nearby_zone_ids = neighbors(self._get_zone_array(), radius, idx[0] + 1, idx[1] + 1)
-        nearby_zone_ids = [item.item() for sublist in nearby_zone_ids for item in sublist if item != 0]
+        """
+        zones of the known lands around (x, y), from the highest leveled land
+        :param x:
+        :param y:
+        :param radius: in lands
+        :return:
+        """
+        land_ids = numpy.array([land_id for land_id, _ in self._get_nearest_land(x, y, radius)], dtype=numpy.int64)
+        zone_ids = lokbot.geo.zone_id_by_land_id(land_ids)
+        _, first = numpy.unique(zone_ids, return_index=True)
 
-        return nearby_zone_ids
+        return zone_ids[numpy.sort(first)].tolist()
 
     def _update_march_limit(self):
         troops = self.api.kingdom_profile_troops().get('troops')
-        self.troop_queue = troops.get('field')
-        self.march_limit = troops.get('info').get('marchLimit')
-        self.march_size = troops.get('info').get('marchSize')
+        self.state.on_troops(troops)
 
     def _is_march_limit_exceeded(self):
-        if len(self.troop_queue) >= self.march_limit:
+        snapshot = self.state.snapshot()
+        if len(snapshot.troop_queue) >= snapshot.march_limit:
             return True
 
         return False
@@ -501,7 +439,7 @@ class LokFarmer:
 
     def _start_march(self, to_loc, march_troops, march_type=MARCH_TYPE_GATHER, drago_id=None):
         data = {
-            'fromId': self.kingdom_enter.get('kingdom').get('fieldObjectId'),
+            'fromId': self.state.kingdom.get('fieldObjectId'),
             'marchType': march_type,
             'toLoc': to_loc,
             'marchTroops': march_troops
@@ -514,11 +452,11 @@ class LokFarmer:
 
         new_task = res.get('newTask')
         new_task['endTime'] = new_task['expectedEnded']
-        self.troop_queue.append(new_task)
+        self.state.on_march_start(new_task)
 
     def _prepare_march_troops(self, each_obj, march_type=MARCH_TYPE_GATHER):
         march_info = self.api.field_march_info({
-            'fromId': self.kingdom_enter.get('kingdom').get('fieldObjectId'),
+            'fromId': self.state.kingdom.get('fieldObjectId'),
             'toLoc': each_obj.get('loc')
         })
 
@@ -595,12 +533,13 @@ class LokFarmer:
 
         return march_troops
 
-    def _get_available_dragos(self):
-        drago_lair_list = self.api.drago_lair_list()
-        dragos = drago_lair_list.get('dragos')
-        available_dragos = [each for each in dragos if each['lair']['status'] == DRAGO_LAIR_STATUS_STANDBY]
+    def _get_available_dragos(self, drago_lair_list=None):
+        if drago_lair_list is None:
+            drago_lair_list = self.api.drago_lair_list()
+
+        self.state.on_drago_lair_list(drago_lair_list)
 
-        return available_dragos
+        return self.state.available_dragos
 
     def _on_field_objects_gather(self, each_obj):
         if each_obj.get('occupied'):
@@ -643,23 +582,27 @@ class LokFarmer:
         websocket connection of the kingdom
         :return:
         """
-        url = self.kingdom_enter.get('networks').get('kingdoms')[0]
+        url = self.state.networks.get('kingdoms')[0]
 
         sio = socketio.Client(reconnection=False, logger=sock_logger, engineio_logger=sock_logger)
 
         @sio.on('/building/update')
         def on_building_update(data):
             logger.debug(data)
+            self.api.response_cache.invalidate('kingdom/task/all')
             self._update_kingdom_enter_building(data)
+            self.events.publish(lokbot.events.BuildingUpdated(data))
 
         @sio.on('/resource/upgrade')
         def on_resource_update(data):
             logger.debug(data)
-            self.resources[data.get('resourceIdx')] = data.get('value')
+            self.state.on_resource_upgrade(data)
+            self.events.publish(lokbot.events.ResourceUpdated(data))
 
         @sio.on('/buff/list')
         def on_buff_list(data):
             logger.debug(f'on_buff_list: {data}')
+            self.events.publish(lokbot.events.BuffListUpdated(data))
 
             self.has_additional_building_queue = len([
                 item for item in data if item.get('param', {}).get('itemCode') == ITEM_CODE_GOLDEN_HAMMER
@@ -696,6 +639,7 @@ class LokFarmer:
         @sio.on('/alliance/rally/new')
         def on_alliance_rally_new(data):
             logger.debug(data)
+            self.events.publish(lokbot.events.AllianceRallyNew(data))
             code = data.get('code')
             if code not in join_rally_code_list:
                 logger.info(f'ignore rally: {code}')
@@ -706,16 +650,21 @@ class LokFarmer:
         @sio.on('/task/update')
         def on_task_update(data):
             logger.debug(data)
+            self.api.response_cache.invalidate('kingdom/task/all')
+            self.state.on_task_update(data)
             if data.get('status') == STATUS_FINISHED:
                 if data.get('code') in (TASK_CODE_SILVER_HAMMER, TASK_CODE_GOLD_HAMMER):
                     self.building_queue_available.set()
 
             if data.get('status') == STATUS_CLAIMED:
                 if data.get('code') == TASK_CODE_ACADEMY:
+                    self.research_index.finish()
                     self.research_queue_available.set()
                 if data.get('code') == TASK_CODE_CAMP:
                     self.train_queue_available.set()
 
+            self.events.publish(lokbot.events.TaskUpdated(data))
+
         sio.connect(f'{url}?token={self.token}', transports=["websocket"], headers=ws_headers)
         sio.emit('/kingdom/enter', {'token': self.token})
 
@@ -735,200 +684,55 @@ class LokFarmer:
         Only scans for objects and logs them without starting marches
         :return:
         """
+        if self.zone_scheduler is None:
+            world_id = self.state.kingdom.get('worldId')
+            from_loc = self.state.kingdom.get('loc')
+            self._get_devrank()
+
+            logger.info('getting nearest zone')
+            self.zone_scheduler = lokbot.zone_scheduler.ZoneScheduler(
+                world_id, self._id,
+                lokbot.geo.nearest_zones(from_loc[1], from_loc[2], radius),
+                lokbot.raster.get_store(world_id).get('devrank_zone_sum')
+            )
+
         while self.api.last_requested_at + 16 > time.time():
             # if last request is less than 16 seconds ago, wait
             # when we are in the field, we should not be doing anything else
             logger.info(f'last requested at {arrow.get(self.api.last_requested_at).humanize()}, waiting...')
             time.sleep(4)
 
-        # Create a timestamp for the session date (just the date, not time)
-        session_date = arrow.now().format('YYYY-MM-DD')
-
-        # Create main objects logger - use one file per day
-        objects_logger = logging.getLogger(f'{__name__}.objects')
-        # Clear any existing handlers to avoid duplicate logging
-        if objects_logger.hasHandlers():
-            objects_logger.handlers.clear()
-        objects_logger.setLevel(logging.INFO)
-
-        # Create a file handler for the main objects log
-        objects_formatter = logging.Formatter('%(asctime)s - %(message)s')
-        objects_file_handler = logging.FileHandler(project_root.joinpath(f'data/objects_{session_date}.log'), mode='a')
-        objects_file_handler.setFormatter(objects_formatter)
-        objects_logger.addHandler(objects_file_handler)
-
-        # Create separate loggers for each object code - one file per day
-        code_loggers = {}
-        for target in targets:
-            code = target['code']
-            code_name = "Crystal_Mine" if code == 20100105 else "Dragon_Soul_Cavern" if code == 20100106 else f"Code_{code}"
-            code_logger = logging.getLogger(f'{__name__}.{code_name}')
-            # Clear any existing handlers to avoid duplicate logging
-            if code_logger.hasHandlers():
-                code_logger.handlers.clear()
-            code_logger.setLevel(logging.INFO)
-
-            code_file_handler = logging.FileHandler(project_root.joinpath(f'data/{code_name}_{session_date}.log'), mode='a')
-            code_file_handler.setFormatter(objects_formatter)
-            code_logger.addHandler(code_file_handler)
-
-            code_loggers[code] = code_logger
-
-        current_time = arrow.now().format('HH:mm:ss')
-        objects_logger.info(f"Starting new object scanning session at {current_time}")
-
         self.socf_entered = False
-        self.socf_world_id = self.kingdom_enter.get('kingdom').get('worldId')
-        url = self.kingdom_enter.get('networks').get('fields')[0]
-        from_loc = self.kingdom_enter.get('kingdom').get('loc')
+        self.socf_world_id = self.state.kingdom.get('worldId')
+        url = self.state.networks.get('fields')[0]
+        if self.packets_to_record > 0:
+            project_root.joinpath('data/packets').mkdir(exist_ok=True)
 
-        if not self.zones:
-            logger.info('getting nearest zone')
-            self.zones = self._get_nearest_zone_ng(from_loc[1], from_loc[2], radius)
+        target_matcher = lokbot.targeting.TargetMatcher(
+            targets, share_to, config.get('discord', {}), self.state.kingdom.get('loc')
+        )
+        target_codes = list(target_matcher.codes)
 
         sio = socketio.Client(reconnection=False, logger=socf_logger, engineio_logger=socf_logger)
 
         @sio.on('/field/objects/v4')
         def on_field_objects(data):
-            packs = data.get('packs')
-            gzip_decompress = gzip.decompress(bytearray(packs))
-            data_decoded = self.api.b64xor_dec(gzip_decompress)
-            objects = data_decoded.get('objects')
-            target_code_set = set([target['code'] for target in targets])
-
-            logger.debug(f'Processing {len(objects)} objects')
-            for each_obj in objects:
-                code = each_obj.get('code')
-                level = each_obj.get('level')
-                loc = each_obj.get('loc')
-
-                level_whitelist = [target['level'] for target in targets if target['code'] == code]
-                if not level_whitelist:
-                    # not the one we are looking for
-                    continue
-
-                level_whitelist = level_whitelist[0]
-                if level_whitelist and level not in level_whitelist:
-                    logger.info(f'level not in whitelist, ignore: {each_obj}')
-                    continue
-
-                # Log found objects that match our criteria
-                if code in set(OBJECT_MINE_CODE_LIST).intersection(target_code_set) or \
-                   code in set(OBJECT_MONSTER_CODE_LIST).intersection(target_code_set):
-                    obj_type = "Resource" if code in OBJECT_MINE_CODE_LIST else "Monster"
-
-                    # Format status information
-                    status = "Available"
-                    occupied_info = ""
-
-                    if each_obj.get('occupied'):
-                        status = "Occupied"
-                        occupied = each_obj.get('occupied')
-                        occupied_info = f"""
-    Occupied by: {occupied.get('name', 'Unknown')}
-    Alliance: {occupied.get('allianceTag', 'None')}
-    From World: {occupied.get('worldId', 'Unknown')}
-    Started: {occupied.get('started', 'Unknown')}
-    Ended: {occupied.get('ended', 'Unknown')}"""
-
-                    # Log in the requested format
-                    log_message = f"""Found {obj_type}:
-Code - {code}
-Level - {level}
-Location - {loc}
-Status - {status}{occupied_info}"""
-
-                    # Log to main objects file
-                    objects_logger.info(log_message)
-
-                    # Send to Discord if enabled
-                    if config.get('discord', {}).get('enabled', False) and config.get('discord', {}).get('webhook_url'):
-                        try:
-                            from lokbot.discord_webhook import DiscordWebhook
-
-                            # Get resource name based on code
-                            resource_name = "Unknown"
-                            if code == 20100105:
-                                resource_name = "Crystal Mine"
-                            elif code == 20100106:
-                                resource_name = "Dragon Soul Cavern"
-                            else:
-                                resource_name = f"Resource {code}"
-
-                            # Special handling for level 1 Crystal Mines
-                            if code == 20100105 and level == 1 and config.get('discord', {}).get('crystal_mine_level1_webhook_url'):
-                                level1_webhook = DiscordWebhook(config.get('discord', {}).get('crystal_mine_level1_webhook_url'))
-                                level1_webhook.send_object_log(
-                                    f"{obj_type} (Level 1 {resource_name})", 
-                                    code, 
-                                    level, 
-                                    loc, 
-                                    status, 
-                                    occupied_info.strip() if occupied_info else ""
-                                )
-
-                            # For level 2+ resources, send to dedicated webhook if configured
-                            if level >= 2 and config.get('discord', {}).get('level2plus_webhook_url'):
-                                level2plus_webhook = DiscordWebhook(config.get('discord', {}).get('level2plus_webhook_url'))
-                                level2plus_webhook.send_object_log(
-                                    f"{obj_type} (Level {level} {resource_name})", 
-                                    code, 
-                                    level, 
-                                    loc, 
-                                    status, 
-                                    occupied_info.strip() if occupied_info else ""
-                                )
-                                
-                            # Also send to main webhook for all resources except level 1 crystal mines
-                            if level >= 2 or code != 20100105:
-                                webhook = DiscordWebhook(config.get('discord', {}).get('webhook_url'))
-                                webhook.send_object_log(
-                                    f"{obj_type} ({resource_name})", 
-                                    code, 
-                                    level, 
-                                    loc, 
-                                    status, 
-                                    occupied_info.strip() if occupied_info else ""
-                                )
-                                
-                            # Send ALL resources to custom webhook regardless of type or level
-                            if config.get('discord', {}).get('custom_webhook_url'):
-                                custom_webhook = DiscordWebhook(config.get('discord', {}).get('custom_webhook_url'))
-                                custom_webhook.send_all_resources(
-                                    f"{resource_name}", 
-                                    code, 
-                                    level, 
-                                    loc, 
-                                    status, 
-                                    occupied_info.strip() if occupied_info else ""
-                                )
-                        except Exception as e:
-                            logger.error(f"Failed to send to Discord: {e}")
-
-                    # Log to code-specific file if we have a logger for this code
-                    if code in code_loggers:
-                        code_loggers[code].info(log_message)
-
-                    logger.info(f"Found {obj_type} - Code: {code}, Level: {level}, Location: {loc}, Status: {status}")
-                    
-                    # Share to chat channels if configured
-                    if share_to and share_to.get('chat_channels'):
-                        # Only share Crystal Mines (code 20100105) of level 1 and 2
-                        should_share = code == 20100105 and level in [1, 2]
-                        
-                        if should_share:
-                            for chat_channel in share_to.get('chat_channels'):
-                                text = f'Lv.{level}?fo_{code}'
-                                obj_hash = f'{text}_{loc[0]}_{loc[1]}_{loc[2]}'
-                                if obj_hash in self.shared_objects:
-                                    # already shared
-                                    continue
-
-                                self.shared_objects.add(obj_hash)
-                                self.api.chat_new(chat_channel, CHAT_TYPE_LOC, text, {'loc': loc})
-                                logger.info(f"Shared to chat channel {chat_channel}: {text} (Crystal Mine)")
-                        else:
-                            logger.info(f"Not sharing to chat - only Crystal Mines level 1 & 2 are shared")
+            if self.packets_to_record > 0:
+                # fixtures of `benchmarks.bench_field_decode`, they contain the xor key of the account
+                self.packets_to_record -= 1
+                project_root.joinpath(f'data/packets/field_objects_{time.time_ns()}.json').write_text(json.dumps({
+                    'xor_password': self.api.xor_password, 'packs': data.get('packs'), 'target_codes': target_codes
+                }))
+
+            # only the targets are parsed, so the index holds the targets only
+            objects = self.api.codec.decode_packs(data.get('packs'), target_matcher.codes).get('objects')
+
+            # Share to chat channels if configured
+            for each_obj, decision in process_field_objects(self, objects, target_matcher):
+                text = f'Lv.{decision.level}?fo_{decision.target.code}'
+                for chat_channel in share_to.get('chat_channels'):
+                    self.api.chat_new(chat_channel, CHAT_TYPE_LOC, text, {'loc': each_obj.get('loc')})
+                    logger.info(f"Shared to chat channel {chat_channel}: {text} ({decision.target.resource_name})")
 
             self.field_object_processed = True
 
@@ -947,7 +751,7 @@ Status - {status}{occupied_info}"""
             self.socf_entered = True
 
         sio.connect(f'{url}?token={self.token}', transports=["websocket"], headers=ws_headers)
-        logger.debug(f'entering field: {self.zones}')
+        logger.debug(f'entering field: {self.zone_scheduler.stats(target_codes)}')
         sio.emit('/field/enter/v3', self.api.b64xor_enc({'token': self.token}))
 
         while not self.socf_entered:
@@ -955,25 +759,7 @@ Status - {status}{occupied_info}"""
 
         step = 9
         grace = 7  # 9 times enter-leave action will cause ban
-        index = 0
-        while self.zones:
-            if index >= grace:
-                logger.info('socf_thread grace exceeded, break')
-                break
-
-            index += 1
-            zone_ids = []
-            for _ in range(step):
-                if not self.zones:
-                    break
-
-                zone_ids.append(self.zones.pop(0))
-
-            if len(zone_ids) < step:
-                logger.info(f'len(zone_ids) < {step}, break')
-                self.zones = []
-                break
-
+        for zone_ids in self.zone_scheduler.batches(target_codes, grace, step):
             if not sio.connected:
                 logger.warning('socf_thread disconnected, reconnecting')
                 raise tenacity.TryAgain()
@@ -981,16 +767,24 @@ Status - {status}{occupied_info}"""
             message = {'world': self.socf_world_id, 'zones': json.dumps(zone_ids, separators=(',', ':'))}
             encoded_message = self.api.b64xor_enc(message)
 
+            entered_at = time.time()
             sio.emit('/zone/enter/list/v4', encoded_message)
             self.field_object_processed = False
             logger.debug(f'entering zone: {zone_ids} and waiting for processing')
             while not self.field_object_processed:
                 time.sleep(1)
             sio.emit('/zone/leave/list/v2', message)
+            # gone since the last visit: gathered out, killed or moved
+            self.field_index.prune_zones(self.socf_world_id, zone_ids, entered_at)
+            self.zone_scheduler.mark_scanned(zone_ids)
+            self.zone_scheduler.save()
+            self.shared_objects.save()
+            self.notified_objects.save()
 
         logger.info('a loop is finished')
-        current_time = arrow.now().format('HH:mm:ss')
-        objects_logger.info(f"Finished object scanning session at {current_time}")
+        logger.info(f'discord webhooks: {lokbot.discord_webhook.get_dispatcher().stats()}')
+        logger.info(f'rate limiters: {self.api.rate_limiters.stats()}')
+        logger.info(f'dedup: shared {self.shared_objects.stats()}, notified {self.notified_objects.stats()}')
         sio.disconnect()
         sio.wait()
 
@@ -1005,7 +799,7 @@ Status - {status}{occupied_info}"""
         websocket connection of the chat
         :return:
         """
-        url = self.kingdom_enter.get('networks').get('chats')[0]
+        url = self.state.networks.get('chats')[0]
 
         sio = socketio.Client(reconnection=False, logger=socc_logger, engineio_logger=socc_logger)
 
@@ -1022,25 +816,13 @@ Status - {status}{occupied_info}"""
         收获资源
         :return:
         """
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-
-        random.shuffle(buildings)
-
-        harvested_code = set()
-        for building in buildings:
-            code = building.get('code')
-            position = building.get('position')
-
-            if code not in HARVESTABLE_CODE:
+        for code in random.sample(HARVESTABLE_CODE, len(HARVESTABLE_CODE)):
+            buildings = self.buildings.of_code(code)
+            if not buildings:
                 continue
 
             # 每个种类只需要收获一次, 就会自动收获整个种类下所有资源
-            if code in harvested_code:
-                continue
-
-            harvested_code.add(code)
-
-            self.api.kingdom_resource_harvest(position)
+            self.api.kingdom_resource_harvest(random.choice(buildings).get('position'))
 
     def quest_monitor_thread(self):
         """
@@ -1056,7 +838,7 @@ Status - {status}{occupied_info}"""
         if len([self.api.quest_claim(q) for q in quest_list.get('sideQuests') if
                 q.get('status') == STATUS_FINISHED]) >= 5:
             # 若五个均为已完成, 则翻页
-            threading.Thread(target=self.quest_monitor_thread).start()
+            self.schedule('quest_monitor_thread', 0, self.quest_monitor_thread)
             return
 
         quest_list_daily = self.api.quest_list_daily().get('dailyQuest')
@@ -1065,7 +847,7 @@ Status - {status}{occupied_info}"""
         if len([self.api.quest_claim_daily(q) for q in quest_list_daily.get('quests') if
                 q.get('status') == STATUS_FINISHED]) >= 5:
             # 若五个均为已完成, 则翻页
-            threading.Thread(target=self.quest_monitor_thread).start()
+            self.schedule('quest_monitor_thread', 0, self.quest_monitor_thread)
             return
 
         # daily quest reward
@@ -1090,42 +872,18 @@ Status - {status}{occupied_info}"""
             ) for each in event_info.get('event').get('events') if each.get('code') in finished_code]
 
         logger.info('quest_monitor: done, sleep for 1h')
-        threading.Timer(3600, self.quest_monitor_thread).start()
+        self.schedule('quest_monitor_thread', 3600, self.quest_monitor_thread)
         return
 
     def _building_farmer_worker(self, speedup=False):
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        buildings.sort(key=lambda x: x.get('level'))
-        kingdom_level = [b for b in buildings if b.get('code') == BUILDING_CODE_MAP['castle']][0].get('level')
-
-        # First check if there is any empty position available for building
-        for level_requirement, positions in BUILD_POSITION_UNLOCK_MAP.items():
-            if kingdom_level < level_requirement:
-                continue
-
-            for position in positions:
-                if position.get('position') in [building.get('position') for building in buildings]:
-                    continue
-
-                building = {
-                    'code': position.get('code'),
-                    'position': position.get('position'),
-                    'level': 0,
-                    'state': BUILDING_STATE_NORMAL,
-                }
-
-                res = self._upgrade_building(building, buildings, speedup)
-
-                if res == 'continue':
-                    continue
-                if res == 'break':
-                    break
-
-                return True
+        # 暂时忽略联盟中心
+        exclude_codes = {BUILDING_CODE_MAP['hall_of_alliance']}
+        if [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_CAMP]:
+            exclude_codes.add(BUILDING_CODE_MAP['barrack'])
 
-        # Then check if there is any upgradeable building
-        for building in buildings:
-            res = self._upgrade_building(building, buildings, speedup)
+        # empty positions first, then the lowest level buildings
+        for building in self.buildings.upgradeable(self.resources, exclude_codes):
+            res = self._upgrade_building(building, speedup)
 
             if res == 'continue':
                 continue
@@ -1142,20 +900,19 @@ Status - {status}{occupied_info}"""
         :param speedup:
         :return:
         """
-        self.kingdom_tasks = self.api.kingdom_task_all().get('kingdomTasks', [])
+        kingdom_tasks = self.state.on_kingdom_tasks(self.api.kingdom_task_all().get('kingdomTasks', []))
 
-        silver_in_use = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_SILVER_HAMMER]
-        gold_in_use = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_GOLD_HAMMER]
+        silver_in_use = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_SILVER_HAMMER]
+        gold_in_use = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_GOLD_HAMMER]
 
         if not silver_in_use or (self.has_additional_building_queue and not gold_in_use):
             if not self._building_farmer_worker(speedup):
                 logger.info(f'no building to upgrade, sleep for 2h')
-                threading.Timer(7200, self.building_farmer_thread).start()
+                self.schedule('building_farmer_thread', 7200, self.building_farmer_thread, speedup)
                 return
 
-        self.building_queue_available.wait()  # wait for building queue available from `sock_thread`
-        self.building_queue_available.clear()
-        threading.Thread(target=self.building_farmer_thread, args=[speedup]).start()
+        # wait for building queue available from `sock_thread`
+        self.building_queue_available.then(self.job_key('building_farmer_thread'), self.building_farmer_thread, speedup)
 
     def academy_farmer_thread(self, to_max_level=False, speedup=False):
         """
@@ -1164,62 +921,70 @@ Status - {status}{occupied_info}"""
         :param speedup:
         :return:
         """
-        self.kingdom_tasks = self.api.kingdom_task_all().get('kingdomTasks', [])
+        kingdom_tasks = self.state.on_kingdom_tasks(self.api.kingdom_task_all().get('kingdomTasks', []))
 
-        worker_used = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_ACADEMY]
+        worker_used = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_ACADEMY]
 
         if worker_used:
             if worker_used[0].get('status') != STATUS_CLAIMED:
-                self.research_queue_available.wait()  # wait for research queue available from `sock_thread`
-                self.research_queue_available.clear()
-                threading.Thread(target=self.academy_farmer_thread, args=[to_max_level, speedup]).start()
+                # wait for research queue available from `sock_thread`
+                self.research_queue_available.then(
+                    self.job_key('academy_farmer_thread'), self.academy_farmer_thread, to_max_level, speedup
+                )
                 return
 
             # 如果已完成, 则领取奖励并继续
             self.api.kingdom_task_claim(BUILDING_POSITION_MAP['academy'])
+            self.research_index.finish()
 
-        exist_researches = self.api.kingdom_academy_research_list().get('researches', [])
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        academy_level = [b for b in buildings if b.get('code') == BUILDING_CODE_MAP['academy']][0].get('level')
+        if not self.research_index.synced:
+            self.research_index.sync(self.api.kingdom_academy_research_list().get('researches', []))
 
-        for category_name, each_category in RESEARCH_CODE_MAP.items():
-            for research_name, research_code in each_category.items():
-                if not self._is_researchable(
-                        academy_level, category_name, research_name, exist_researches, to_max_level
-                ):
-                    continue
+        academy_level = self.buildings.max_level(BUILDING_CODE_MAP['academy'])
+
+        skipped_categories = set()
+        for research in self.research_index.researchable(academy_level, self.resources, to_max_level):
+            if research.category_name in skipped_categories:
+                continue
 
-                try:
-                    res = self.api.kingdom_academy_research({'code': research_code})
-                except OtherException as error_code:
-                    if str(error_code) == 'not_enough_condition':
-                        logger.warning(f'category {category_name} reached max level')
-                        break
+            try:
+                res = self.api.kingdom_academy_research({'code': research.code})
+            except OtherException as error_code:
+                # local levels may be off, read them again on the next run
+                self.research_index.synced = False
 
-                    logger.info(f'research failed, try next one, current: {research_name}({research_code})')
+                if str(error_code) == 'not_enough_condition':
+                    logger.warning(f'category {research.category_name} reached max level')
+                    skipped_categories.add(research.category_name)
                     continue
 
-                if speedup:
-                    self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'research')
+                logger.info(f'research failed, try next one, current: {research.name}({research.code})')
+                continue
 
-                self.research_queue_available.wait()  # wait for research queue available from `sock_thread`
-                self.research_queue_available.clear()
-                threading.Thread(target=self.academy_farmer_thread, args=[to_max_level, speedup]).start()
-                return
+            self.research_index.start(research.code)
+
+            if speedup:
+                self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'research')
+
+            # wait for research queue available from `sock_thread`
+            self.research_queue_available.then(
+                self.job_key('academy_farmer_thread'), self.academy_farmer_thread, to_max_level, speedup
+            )
+            return
 
         logger.info('academy_farmer: no research to do, sleep for 2h')
-        threading.Timer(2 * 3600, self.academy_farmer_thread, [to_max_level]).start()
+        # levels may have changed outside of the bot meanwhile
+        self.research_index.synced = False
+        self.schedule('academy_farmer_thread', 2 * 3600, self.academy_farmer_thread, to_max_level, speedup)
         return
 
     def _troop_training_capacity(self):
         """
         return total troop training capacity of all barracks
         """
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
         troop_training_capacity = 0
-        for building in buildings:
-            if building['code'] == BUILDING_CODE_MAP['barrack']:
-                troop_training_capacity += BARRACK_LEVEL_TROOP_TRAINING_RATE_MAP[int(building['level'])]
+        for building in self.buildings.of_code(BUILDING_CODE_MAP['barrack']):
+            troop_training_capacity += BARRACK_LEVEL_TROOP_TRAINING_RATE_MAP[int(building['level'])]
 
         return troop_training_capacity
 
@@ -1243,8 +1008,7 @@ Status - {status}{occupied_info}"""
         """
         return a random building object with the building_code
         """
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        return random.choice([building for building in buildings if building['code'] == building_code])
+        return random.choice(self.buildings.of_code(building_code))
 
     def train_troop_thread(self, troop_code, speedup=False, interval=3600):
         """
@@ -1259,9 +1023,9 @@ Status - {status}{occupied_info}"""
             logger.info(f'last requested at {arrow.get(self.api.last_requested_at).humanize()}, waiting...')
             time.sleep(4)
 
-        self.kingdom_tasks = self.api.kingdom_task_all().get('kingdomTasks', [])
+        kingdom_tasks = self.state.on_kingdom_tasks(self.api.kingdom_task_all().get('kingdomTasks', []))
 
-        worker_used = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_CAMP]
+        worker_used = [t for t in kingdom_tasks if t.get('code') == TASK_CODE_CAMP]
 
         troop_training_capacity = self._troop_training_capacity()
 
@@ -1269,13 +1033,14 @@ Status - {status}{occupied_info}"""
             if worker_used[0].get('status') == STATUS_CLAIMED:
                 self.api.kingdom_task_claim(self._random_choice_building(BUILDING_CODE_MAP['barrack'])['position'])
                 logger.info(f'train_troop: one loop completed, sleep for {interval} seconds')
-                threading.Timer(interval, self.train_troop_thread, [troop_code, speedup, interval]).start()
+                self.schedule('train_troop_thread', interval, self.train_troop_thread, troop_code, speedup, interval)
                 return
 
             if worker_used[0].get('status') == STATUS_PENDING:
-                self.train_queue_available.wait()  # wait for train queue available from `sock_thread`
-                self.train_queue_available.clear()
-                threading.Thread(target=self.train_troop_thread, args=[troop_code, speedup, interval]).start()
+                # wait for train queue available from `sock_thread`
+                self.train_queue_available.then(
+                    self.job_key('train_troop_thread'), self.train_troop_thread, troop_code, speedup, interval
+                )
                 return
 
         # if there are not enough resources, train how much possible
@@ -1285,22 +1050,23 @@ Status - {status}{occupied_info}"""
 
         if not troop_training_capacity:
             logger.info('train_troop: no resource, sleep for 1h')
-            threading.Timer(3600, self.train_troop_thread, [troop_code, speedup, interval]).start()
+            self.schedule('train_troop_thread', 3600, self.train_troop_thread, troop_code, speedup, interval)
             return
 
         try:
             res = self.api.train_troop(troop_code, troop_training_capacity)
         except OtherException as error_code:
             logger.info(f'train_troop: {error_code}, sleep for 1h')
-            threading.Timer(3600, self.train_troop_thread, [troop_code, speedup, interval]).start()
+            self.schedule('train_troop_thread', 3600, self.train_troop_thread, troop_code, speedup, interval)
             return
 
         if speedup:
             self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'train')
 
-        self.train_queue_available.wait()  # wait for train queue available from `sock_thread`
-        self.train_queue_available.clear()
-        threading.Thread(target=self.train_troop_thread, args=[troop_code, speedup, interval]).start()
+        # wait for train queue available from `sock_thread`
+        self.train_queue_available.then(
+            self.job_key('train_troop_thread'), self.train_troop_thread, troop_code, speedup, interval
+        )
 
     def free_chest_farmer_thread(self, _type=0):
         """
@@ -1312,7 +1078,7 @@ Status - {status}{occupied_info}"""
         except OtherException as error_code:
             if str(error_code) == 'free_chest_not_yet':
                 logger.info('free_chest_farmer: free_chest_not_yet, sleep for 2h')
-                threading.Timer(2 * 3600, self.free_chest_farmer_thread).start()
+                self.schedule('free_chest_farmer_thread', 2 * 3600, self.free_chest_farmer_thread)
                 return
 
             raise
@@ -1324,10 +1090,10 @@ Status - {status}{occupied_info}"""
         }
         next_type = min(next_dict, key=next_dict.get)
 
-        threading.Timer(
-            self.calc_time_diff_in_seconds(next_dict[next_type]),
-            self.free_chest_farmer_thread, [next_type]
-        ).start()
+        self.schedule(
+            'free_chest_farmer_thread', self.calc_time_diff_in_seconds(next_dict[next_type]),
+            self.free_chest_farmer_thread, next_type
+        )
 
     def use_resource_in_item_list(self):
         """
@@ -1449,6 +1215,19 @@ Status - {status}{occupied_info}"""
 
             self.api.kingdom_hospital_recover()
 
+    def resync_kingdom(self):
+        """
+        apply what changed in `kingdom/enter` since the last sync, e.g. missed socket events
+        :return:
+        """
+        kingdom_enter = self.api.kingdom_enter()
+
+        changed = self.state.on_kingdom_enter(kingdom_enter)
+        updated = self.buildings.sync(kingdom_enter.get('kingdom', {}).get('buildings', []))
+
+        logger.info(f'kingdom resync: {sorted(changed)} changed, {updated} buildings updated, '
+                    f'version {self.state.version}')
+
     def keepalive_request(self):
         try:
             lokbot.util.run_functions_in_random_order(
@@ -0,0 +1,247 @@
+import datetime
+import heapq
+import math
+import threading
+import time
+
+import lokbot.geo
+
+# objects without `expired` are dropped after this long without being seen again
+DEFAULT_TTL = 3600
+
+
+def pack_loc(world_id, x, y):
+    """
+    (world, x, y) as one int, x and y are below 2048 (11 bits each)
+    :param world_id:
+    :param x:
+    :param y:
+    :return:
+    """
+    return (world_id << 22) | (x << 11) | y
+
+
+def unpack_loc(key):
+    return [key >> 22, (key >> 11) & 0x7ff, key & 0x7ff]
+
+
+def parse_timestamp(value):
+    if value is None:
+        return None
+
+    if isinstance(value, (int, float)):
+        # milliseconds
+        return value / 1000 if value > 1e12 else value
+
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class FieldObject:
+    __slots__ = ('key', 'object_id', 'code', 'level', 'world_id', 'x', 'y', 'zone_id', 'occupied', 'expires_at',
+                 'seen_at')
+
+    def __init__(self, key, object_id, code, level, occupied, expires_at, seen_at):
+        self.key = key
+        self.object_id = object_id
+        self.code = code
+        self.level = level
+        self.world_id, self.x, self.y = unpack_loc(key)
+        self.zone_id = lokbot.geo.zone_id_by_coords(self.x, self.y)
+        self.occupied = occupied
+        self.expires_at = expires_at
+        self.seen_at = seen_at
+
+    @property
+    def loc(self):
+        return [self.world_id, self.x, self.y]
+
+    def distance(self, loc):
+        return math.hypot(self.x - loc[1], self.y - loc[2])
+
+    def __repr__(self):
+        return f'FieldObject(code={self.code}, level={self.level}, loc={self.loc}, occupied={bool(self.occupied)})'
+
+
+class FieldIndex:
+    """
+    Live field objects seen through `/field/objects/v4`
+
+    Keyed by packed (world, x, y), with secondary indexes by (code, level) and by (world, zone).
+    Seeing an object again updates it in place, objects leave on their `expired` time
+    or when their zone is scanned again without them.
+    """
+
+    def __init__(self, default_ttl=DEFAULT_TTL):
+        self.default_ttl = default_ttl
+
+        self._lock = threading.Lock()
+        self._objects = {}  # key: FieldObject
+        self._by_code_level = {}  # (code, level): {key, ...}
+        self._by_zone = {}  # (world_id, zone_id): {key, ...}
+        self._expiry = []  # heap of (expires_at, key), stale entries are skipped
+
+    def __len__(self):
+        return len(self._objects)
+
+    def get(self, world_id, x, y):
+        return self._objects.get(pack_loc(world_id, x, y))
+
+    def _remove(self, key):
+        obj = self._objects.pop(key, None)
+        if obj is None:
+            return None
+
+        self._by_code_level[(obj.code, obj.level)].discard(key)
+        self._by_zone[(obj.world_id, obj.zone_id)].discard(key)
+
+        return obj
+
+    def upsert(self, each_obj, now=None):
+        """
+        :param each_obj: decoded object of `/field/objects/v4`
+        :param now:
+        :return: the indexed `FieldObject`, or None without `loc`
+        """
+        loc = each_obj.get('loc')
+        if not loc or len(loc) != 3:
+            return None
+
+        now = now or time.time()
+        key = pack_loc(*loc)
+        expires_at = parse_timestamp(each_obj.get('expired')) or now + self.default_ttl
+
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is not None and (obj.code, obj.level) != (each_obj.get('code'), each_obj.get('level')):
+                # something else took the spot
+                self._remove(key)
+                obj = None
+
+            if obj is None:
+                obj = FieldObject(
+                    key, each_obj.get('_id'), each_obj.get('code'), each_obj.get('level'),
+                    each_obj.get('occupied'), expires_at, now
+                )
+                self._objects[key] = obj
+                self._by_code_level.setdefault((obj.code, obj.level), set()).add(key)
+                self._by_zone.setdefault((obj.world_id, obj.zone_id), set()).add(key)
+            else:
+                obj.object_id = each_obj.get('_id')
+                obj.occupied = each_obj.get('occupied')
+                obj.seen_at = now
+                if obj.expires_at == expires_at:
+                    return obj
+
+                obj.expires_at = expires_at
+
+            heapq.heappush(self._expiry, (expires_at, key))
+
+        return obj
+
+    def update(self, objects, now=None):
+        now = now or time.time()
+        for each_obj in objects:
+            self.upsert(each_obj, now)
+
+        self.evict_expired(now)
+
+    def evict_expired(self, now=None):
+        """
+        :param now:
+        :return: number of objects removed
+        """
+        now = now or time.time()
+        removed = 0
+
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, key = heapq.heappop(self._expiry)
+                obj = self._objects.get(key)
+                # re-seen with another expiry meanwhile
+                if obj is None or obj.expires_at != expires_at:
+                    continue
+
+                self._remove(key)
+                removed += 1
+
+        return removed
+
+    def prune_zones(self, world_id, zone_ids, seen_before):
+        """
+        drop the objects of zones just scanned that were not in the scan
+        :param world_id:
+        :param zone_ids:
+        :param seen_before: time the scan started
+        :return: number of objects removed
+        """
+        removed = 0
+        with self._lock:
+            for zone_id in zone_ids:
+                for key in list(self._by_zone.get((world_id, zone_id), ())):
+                    if self._objects[key].seen_at < seen_before:
+                        self._remove(key)
+                        removed += 1
+
+        return removed
+
+    def _candidates(self, code, levels, world_id, zone_ids):
+        if code is not None:
+            if levels is None:
+                levels = [level for (each_code, level) in self._by_code_level if each_code == code]
+
+            keys = set().union(*[self._by_code_level.get((code, level), ()) for level in levels])
+            if zone_ids is not None:
+                keys = {key for key in keys if self._objects[key].zone_id in zone_ids}
+
+            return keys
+
+        if zone_ids is not None:
+            return set().union(*[self._by_zone.get((world_id, zone_id), ()) for zone_id in zone_ids])
+
+        return set(self._objects)
+
+    def query(self, code=None, levels=None, world_id=None, zone_ids=None, occupied=None, now=None):
+        """
+        :param code:
+        :param levels: iterable of levels, None for all
+        :param world_id: required with `zone_ids`
+        :param zone_ids:
+        :param occupied: True / False to filter on it, None for both
+        :param now: objects expired at `now` are left out
+        :return: list of `FieldObject`
+        """
+        now = now or time.time()
+
+        with self._lock:
+            keys = self._candidates(code, levels, world_id, zone_ids)
+            objects = [self._objects[key] for key in keys]
+
+        return [
+            obj for obj in objects
+            if obj.expires_at > now and
+            (world_id is None or obj.world_id == world_id) and
+            (occupied is None or bool(obj.occupied) == occupied)
+        ]
+
+    def within(self, loc, radius, code=None, levels=None, occupied=None, now=None):
+        """
+        objects within `radius` coordinates of `loc`, nearest first
+        :param loc: [world_id, x, y], e.g. the kingdom `loc`
+        :param radius:
+        :return: list of `FieldObject`
+        """
+        zone_ids = lokbot.geo.nearest_zones(loc[1], loc[2], math.ceil(radius / lokbot.geo.ZONE_SIZE))
+        objects = self.query(code, levels, loc[0], set(zone_ids), occupied, now)
+
+        return sorted((obj for obj in objects if obj.distance(loc) <= radius), key=lambda obj: obj.distance(loc))
+
+    def nearest(self, loc, k=1, code=None, levels=None, occupied=None, now=None):
+        """
+        the `k` objects nearest to `loc`
+        :param loc: [world_id, x, y], e.g. the kingdom `loc`
+        :param k:
+        :return: list of `FieldObject`, nearest first
+        """
+        objects = self.query(code, levels, loc[0], None, occupied, now)
+
+        return heapq.nsmallest(k, objects, key=lambda obj: obj.distance(loc))
@@ -0,0 +1,122 @@
+"""
+World geometry: coordinates, lands and zones
+
+The world is 2048 * 2048 coordinates, split in 256 * 256 lands of 8 * 8 coordinates (ids from 100000)
+and in 64 * 64 zones of 32 * 32 coordinates (ids from 0), both numbered row by row.
+Every conversion works on scalars and on numpy arrays alike.
+"""
+import functools
+
+import numpy
+
+WORLD_SIZE = 2048
+LAND_SIZE = 8
+ZONE_SIZE = 32
+LAND_GRID_SIZE = WORLD_SIZE // LAND_SIZE
+ZONE_GRID_SIZE = WORLD_SIZE // ZONE_SIZE
+LAND_ID_OFFSET = 100000
+
+
+def land_rowcol(land_id):
+    return divmod(land_id - LAND_ID_OFFSET, LAND_GRID_SIZE)
+
+
+def zone_id_by_coords(x, y):
+    return (y // ZONE_SIZE) * ZONE_GRID_SIZE + x // ZONE_SIZE
+
+
+def zone_id_by_land_id(land_id):
+    row, col = land_rowcol(land_id)
+
+    return (row * LAND_SIZE // ZONE_SIZE) * ZONE_GRID_SIZE + col * LAND_SIZE // ZONE_SIZE
+
+
+@functools.lru_cache()
+def square_offsets(radius):
+    """
+    (row, col) offsets of the (2 * radius + 1) ** 2 square around a cell,
+    ring by ring from the center, then by euclidean distance, then row by row
+    :param radius:
+    :return: read-only int array of shape (n, 2)
+    """
+    rows, cols = numpy.mgrid[-radius:radius + 1, -radius:radius + 1]
+    rows, cols = rows.ravel(), cols.ravel()
+    ring = numpy.maximum(numpy.abs(rows), numpy.abs(cols))
+    order = numpy.lexsort((cols, rows, rows ** 2 + cols ** 2, ring))
+
+    offsets = numpy.stack((rows[order], cols[order]), axis=1)
+    offsets.setflags(write=False)
+
+    return offsets
+
+
+def nearest_zones_batch(xs, ys, radius):
+    """
+    zones around every point, nearest first
+    :param xs:
+    :param ys:
+    :param radius: in zones
+    :return: int array of shape (len(xs), (2 * radius + 1) ** 2), -1 outside of the world
+    """
+    xs, ys = numpy.asarray(xs), numpy.asarray(ys)
+    offsets = square_offsets(radius)
+
+    rows = (ys // ZONE_SIZE)[:, None] + offsets[:, 0]
+    cols = (xs // ZONE_SIZE)[:, None] + offsets[:, 1]
+    inside = (rows >= 0) & (rows < ZONE_GRID_SIZE) & (cols >= 0) & (cols < ZONE_GRID_SIZE)
+
+    return numpy.where(inside, rows * ZONE_GRID_SIZE + cols, -1)
+
+
+def nearest_zones(x, y, radius):
+    """
+    :param x:
+    :param y:
+    :param radius: in zones
+    :return: zone ids within the square of `radius` around (x, y), nearest first
+    """
+    zone_ids = nearest_zones_batch([x], [y], radius)[0]
+
+    return zone_ids[zone_ids >= 0].tolist()
+
+
+def sort_lands_by_level(rows, cols, levels):
+    """
+    :return: [(land_id, level), ...] by level desc, then land id asc
+    """
+    land_ids = LAND_ID_OFFSET + rows * LAND_GRID_SIZE + cols
+    order = numpy.lexsort((land_ids, -numpy.asarray(levels, dtype=numpy.int16)))
+
+    return list(zip(land_ids[order].tolist(), numpy.asarray(levels)[order].tolist()))
+
+
+def nearest_lands(devrank, x, y, radius):
+    """
+    known lands within the square of `radius` around (x, y)
+    :param devrank: 256 * 256 land levels, 0 when unknown
+    :param x:
+    :param y:
+    :param radius: in lands
+    :return: [(land_id, level), ...] by level desc, then land id asc
+    """
+    row, col = y // LAND_SIZE, x // LAND_SIZE
+
+    row_start, row_end = max(row - radius, 0), min(row + radius + 1, LAND_GRID_SIZE)
+    col_start, col_end = max(col - radius, 0), min(col + radius + 1, LAND_GRID_SIZE)
+    window = numpy.asarray(devrank[row_start:row_end, col_start:col_end])
+    rows, cols = numpy.nonzero(window)
+
+    return sort_lands_by_level(rows + row_start, cols + col_start, window[rows, cols])
+
+
+def top_lands(devrank, min_level=2, limit=1024):
+    """
+    :param devrank: 256 * 256 land levels, 0 when unknown
+    :param min_level:
+    :param limit:
+    :return: [(land_id, level), ...] by level desc, then land id asc
+    """
+    devrank = numpy.asarray(devrank)
+    rows, cols = numpy.nonzero(devrank >= min_level)
+
+    return sort_lands_by_level(rows, cols, devrank[rows, cols])[:limit]
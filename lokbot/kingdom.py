@@ -0,0 +1,247 @@
+import threading
+import types
+
+from lokbot.enum import *
+
+RESOURCE_COUNT = 4  # [food, lumber, stone, gold]
+
+EMPTY_MAPPING = types.MappingProxyType({})
+
+
+class KingdomSnapshot:
+    """
+    Immutable state of a kingdom at one `version`
+
+    Lists are tuples and dicts read-only mappings, the dicts inside them are shared between versions:
+    read them, never change them.
+    """
+    __slots__ = ('version', 'kingdom', 'networks', 'alliance_id', 'level', 'resources', 'kingdom_tasks',
+                 'troop_queue', 'march_limit', 'march_size', 'available_dragos', 'drago_action_point')
+
+    def __init__(self, version=0, kingdom=EMPTY_MAPPING, networks=EMPTY_MAPPING, alliance_id=None, level=0,
+                 resources=(0,) * RESOURCE_COUNT, kingdom_tasks=(), troop_queue=(), march_limit=2, march_size=10000,
+                 available_dragos=(), drago_action_point=0):
+        self.version = version
+        self.kingdom = kingdom
+        self.networks = networks
+        self.alliance_id = alliance_id
+        self.level = level
+        self.resources = resources
+        self.kingdom_tasks = kingdom_tasks
+        self.troop_queue = troop_queue
+        self.march_limit = march_limit
+        self.march_size = march_size
+        self.available_dragos = available_dragos
+        self.drago_action_point = drago_action_point
+
+    def replace(self, **changes):
+        """
+        :param changes: fields to change
+        :return: the next version with `changes`
+        """
+        fields = {slot: getattr(self, slot) for slot in self.__slots__}
+        fields.update(changes)
+        fields['version'] = self.version + 1
+
+        return KingdomSnapshot(**fields)
+
+    def __repr__(self):
+        return f'KingdomSnapshot(version={self.version}, level={self.level}, resources={self.resources})'
+
+
+class KingdomState:
+    """
+    Current `KingdomSnapshot` of a farmer, replaced as a whole on every change
+
+    Updates run under a lock and only create a version when a field actually changed,
+    reads are lock free: take `snapshot()` once to read several fields of the same version.
+    """
+    __slots__ = ('_lock', '_snapshot')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = KingdomSnapshot()
+
+    def snapshot(self) -> KingdomSnapshot:
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def kingdom(self):
+        return self._snapshot.kingdom
+
+    @property
+    def networks(self):
+        return self._snapshot.networks
+
+    @property
+    def alliance_id(self):
+        return self._snapshot.alliance_id
+
+    @property
+    def level(self):
+        return self._snapshot.level
+
+    @property
+    def resources(self):
+        return self._snapshot.resources
+
+    @property
+    def kingdom_tasks(self):
+        return self._snapshot.kingdom_tasks
+
+    @property
+    def troop_queue(self):
+        return self._snapshot.troop_queue
+
+    @property
+    def march_limit(self):
+        return self._snapshot.march_limit
+
+    @property
+    def march_size(self):
+        return self._snapshot.march_size
+
+    @property
+    def available_dragos(self):
+        return self._snapshot.available_dragos
+
+    @property
+    def drago_action_point(self):
+        return self._snapshot.drago_action_point
+
+    def _update(self, changes_of):
+        """
+        :param changes_of: function of the current snapshot returning the fields to change
+        :return: names of the fields that changed
+        """
+        with self._lock:
+            current = self._snapshot
+            changes = {
+                field: value for field, value in changes_of(current).items() if getattr(current, field) != value
+            }
+            if changes:
+                self._snapshot = current.replace(**changes)
+
+        return set(changes)
+
+    def on_kingdom_enter(self, kingdom_enter):
+        """
+        `kingdom/enter`, at startup and for the periodic resync
+        :param kingdom_enter:
+        :return: names of the fields that changed
+        """
+        kingdom = kingdom_enter.get('kingdom', {})
+
+        return self._update(lambda current: {
+            'kingdom': types.MappingProxyType(kingdom),
+            'networks': types.MappingProxyType(kingdom_enter.get('networks', {})),
+            'alliance_id': kingdom.get('allianceId'),
+            'level': kingdom.get('level'),
+            'resources': tuple(kingdom.get('resources', current.resources)),
+            'drago_action_point': kingdom.get('dragoActionPoint', {}).get('value', 0),
+        })
+
+    def on_response(self, json_response):
+        """
+        any api response, most of them carry the `resources` after the request
+        :param json_response:
+        :return:
+        """
+        resources = json_response.get('resources')
+        if not resources or len(resources) != RESOURCE_COUNT:
+            return set()
+
+        return self._update(lambda current: {'resources': tuple(resources)})
+
+    def on_resource_upgrade(self, data):
+        """
+        `/resource/upgrade` of `sock_thread`
+        :param data: {"resourceIdx", "value"}
+        :return:
+        """
+        index, value = data.get('resourceIdx'), data.get('value')
+
+        def changes_of(current):
+            resources = list(current.resources)
+            resources[index] = value
+
+            return {'resources': tuple(resources)}
+
+        return self._update(changes_of)
+
+    def on_building_update(self, building):
+        """
+        `/building/update` of `sock_thread` and the build/upgrade responses, the kingdom level is the castle one
+        :param building:
+        :return:
+        """
+        if building.get('code') != BUILDING_CODE_MAP['castle']:
+            return set()
+
+        return self._update(lambda current: {'level': building.get('level', current.level)})
+
+    def on_kingdom_tasks(self, kingdom_tasks):
+        """
+        `kingdom/task/all`
+        :param kingdom_tasks:
+        :return: them as a tuple
+        """
+        kingdom_tasks = tuple(kingdom_tasks)
+        self._update(lambda current: {'kingdom_tasks': kingdom_tasks})
+
+        return kingdom_tasks
+
+    def on_task_update(self, task):
+        """
+        `/task/update` of `sock_thread`, merged into the task with the same `_id`
+        :param task:
+        :return:
+        """
+        def changes_of(current):
+            kingdom_tasks = [each for each in current.kingdom_tasks if each.get('_id') != task.get('_id')]
+            kingdom_tasks.append({**next(
+                (each for each in current.kingdom_tasks if each.get('_id') == task.get('_id')), {}
+            ), **task})
+
+            return {'kingdom_tasks': tuple(kingdom_tasks)}
+
+        if not task.get('_id'):
+            return set()
+
+        return self._update(changes_of)
+
+    def on_troops(self, troops):
+        """
+        `kingdom/profile/troops`
+        :param troops:
+        :return:
+        """
+        return self._update(lambda current: {
+            'troop_queue': tuple(troops.get('field', ())),
+            'march_limit': troops.get('info', {}).get('marchLimit', current.march_limit),
+            'march_size': troops.get('info', {}).get('marchSize', current.march_size),
+        })
+
+    def on_march_start(self, new_task):
+        """
+        `field/march/start`
+        :param new_task:
+        :return:
+        """
+        return self._update(lambda current: {'troop_queue': current.troop_queue + (new_task,)})
+
+    def on_drago_lair_list(self, drago_lair_list):
+        """
+        `drago/lair/list`, only the dragos on standby are kept
+        :param drago_lair_list:
+        :return:
+        """
+        available_dragos = tuple(
+            each for each in drago_lair_list.get('dragos', []) if each['lair']['status'] == DRAGO_LAIR_STATUS_STANDBY
+        )
+
+        return self._update(lambda current: {'available_dragos': available_dragos})
@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy
+
+from lokbot import project_root
+from lokbot.geo import LAND_GRID_SIZE, ZONE_GRID_SIZE
+
+LANDS_PER_ZONE_SIDE = LAND_GRID_SIZE // ZONE_GRID_SIZE
+
+# name: (grid size, dtype)
+LAYERS = {
+    # land level 1~10, 0 when unknown
+    'devrank': (LAND_GRID_SIZE, numpy.uint8),
+    # highest land level of the zone
+    'devrank_zone_max': (ZONE_GRID_SIZE, numpy.uint8),
+    # sum of land levels of the zone
+    'devrank_zone_sum': (ZONE_GRID_SIZE, numpy.uint16),
+}
+
+
+def devrank_from_lands(lands):
+    """
+    `lands` of `field/worldmap/devrank` ("000000011122334455 ...", 0~9 for lvl 1-10)
+    to a 256 * 256 grid of land levels, indexed by [y // 8, x // 8]
+    :param lands:
+    :return:
+    """
+    raw = numpy.frombuffer(lands.encode(), dtype=numpy.uint8)[:LAND_GRID_SIZE * LAND_GRID_SIZE]
+    grid = numpy.zeros(LAND_GRID_SIZE * LAND_GRID_SIZE, dtype=numpy.uint8)
+    grid[:len(raw)] = raw - ord('0') + 1
+
+    return grid.reshape(LAND_GRID_SIZE, LAND_GRID_SIZE)
+
+
+def zone_blocks(land_grid):
+    """
+    view a land grid as [zone_row, zone_col, 4, 4]
+    :param land_grid:
+    :return:
+    """
+    return land_grid.reshape(
+        ZONE_GRID_SIZE, LANDS_PER_ZONE_SIDE, ZONE_GRID_SIZE, LANDS_PER_ZONE_SIDE
+    ).swapaxes(1, 2)
+
+
+def _temp_file(path):
+    """
+    :param path: final path, the temp file is next to it for `os.replace`
+    :return: binary file, kept on close
+    """
+    return tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, suffix='.tmp', delete=False)
+
+
+class WorldRasterStore:
+    """
+    Per-world grids of per-cell values under `data/`
+
+    Every layer is a `.npy` file opened memory-mapped and read-only,
+    the fetch time of each layer is kept in `raster_{world_id}.json`.
+    """
+
+    def __init__(self, world_id, directory=None):
+        self.world_id = world_id
+        self.directory = directory or project_root.joinpath('data')
+        self.meta_path = self.directory.joinpath(f'raster_{world_id}.json')
+
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._layers = {}
+        self._meta = {}
+        if self.meta_path.exists():
+            self._meta = json.loads(self.meta_path.read_text())
+
+    def _layer_path(self, layer):
+        return self.directory.joinpath(f'raster_{self.world_id}_{layer}.npy')
+
+    def fetched_at(self, layer):
+        return self._meta.get(layer, {}).get('fetched_at')
+
+    def get(self, layer, max_age=None):
+        """
+        :param layer:
+        :param max_age: seconds, older layers are treated as missing
+        :return: read-only grid or None
+        """
+        fetched_at = self.fetched_at(layer)
+        if fetched_at is None:
+            return None
+
+        if max_age is not None and fetched_at + max_age < time.time():
+            return None
+
+        grid = self._layers.get(layer)
+        if grid is not None:
+            return grid
+
+        path = self._layer_path(layer)
+        if not path.exists():
+            return None
+
+        size, dtype = LAYERS[layer]
+        grid = numpy.load(path, mmap_mode='r')
+        if grid.shape != (size, size) or grid.dtype != dtype:
+            return None
+
+        self._layers[layer] = grid
+
+        return grid
+
+    def put(self, layer, grid, fetched_at=None):
+        size, dtype = LAYERS[layer]
+        grid = numpy.ascontiguousarray(grid, dtype=dtype)
+        assert grid.shape == (size, size), f'invalid shape of {layer}: {grid.shape}'
+
+        with self._lock:
+            path = self._layer_path(layer)
+            # temp files of their own, the processes sharing `data/` may write the same world
+            with _temp_file(path) as tmp:
+                numpy.save(tmp, grid)
+            os.replace(tmp.name, path)
+
+            self._layers[layer] = numpy.load(path, mmap_mode='r')
+            self._meta[layer] = {'fetched_at': fetched_at or time.time()}
+
+            with _temp_file(self.meta_path) as tmp:
+                tmp.write(json.dumps(self._meta).encode())
+            os.replace(tmp.name, self.meta_path)
+
+        return self._layers[layer]
+
+    def put_devrank(self, lands, fetched_at=None):
+        """
+        store `devrank` and the zone layers derived from it
+        :param lands:
+        :param fetched_at:
+        :return:
+        """
+        devrank = devrank_from_lands(lands)
+        blocks = zone_blocks(devrank)
+
+        fetched_at = fetched_at or time.time()
+        self.put('devrank_zone_max', blocks.max(axis=(2, 3)), fetched_at)
+        self.put('devrank_zone_sum', blocks.sum(axis=(2, 3), dtype=numpy.uint16), fetched_at)
+
+        return self.put('devrank', devrank, fetched_at)
+
+    def get_or_fetch_devrank(self, fetch_lands, max_age=None):
+        devrank = self.get('devrank', max_age)
+        if devrank is not None:
+            return devrank
+
+        with self._fetch_lock:
+            # fetched by another thread in the meantime
+            devrank = self.get('devrank', max_age)
+            if devrank is not None:
+                return devrank
+
+            return self.put_devrank(fetch_lands())
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(world_id) -> WorldRasterStore:
+    """
+    one store per world for the whole process
+    :param world_id:
+    :return:
+    """
+    with _stores_lock:
+        if world_id not in _stores:
+            _stores[world_id] = WorldRasterStore(world_id)
+
+        return _stores[world_id]
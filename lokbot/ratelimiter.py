@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import functools
+import inspect
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    At most `calls` in any `period` seconds
+
+    Each caller reserves its own slot under the lock and then sleeps exactly until
+    that slot, so callers are served in arrival order and nobody polls.
+    """
+
+    def __init__(self, name, calls, period):
+        self.name = name
+        self.calls = calls
+        self.period = period
+
+        self._lock = threading.Lock()
+        # the last `calls` reserved slots, oldest first
+        self._slots = collections.deque(maxlen=calls)
+
+        self.waiting = 0
+        self.total_calls = 0
+        self.total_waited = 0.0
+        self.max_waited = 0.0
+
+    def reserve(self) -> float:
+        """
+        reserve the next free slot
+        :return: seconds to wait before the call is allowed
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = now
+            if len(self._slots) == self.calls:
+                slot = max(slot, self._slots[0] + self.period)
+            self._slots.append(slot)
+
+            delay = slot - now
+            self.total_calls += 1
+            self.total_waited += delay
+            self.max_waited = max(self.max_waited, delay)
+            if delay > 0:
+                self.waiting += 1
+
+            return delay
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay <= 0:
+            return
+
+        try:
+            time.sleep(delay)
+        finally:
+            self._done_waiting()
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay <= 0:
+            return
+
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._done_waiting()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.total_calls,
+                'waiting': self.waiting,
+                'total_waited': round(self.total_waited, 3),
+                'max_waited': round(self.max_waited, 3),
+                'avg_waited': round(self.total_waited / self.total_calls, 3) if self.total_calls else 0,
+            }
+
+
+class RateLimiterRegistry:
+    """
+    All client-side rate limiters of one account, keyed by endpoint name
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def get(self, name, calls, period) -> RateLimiter:
+        limiter = self._limiters.get(name)
+        if limiter:
+            return limiter
+
+        with self._lock:
+            return self._limiters.setdefault(name, RateLimiter(name, calls, period))
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in list(self._limiters.items())}
+
+
+def limits(name, calls=1, period=1):
+    """
+    limit a method of an object holding a `rate_limiters` registry
+    works for both plain and coroutine methods
+    :param name: endpoint name, also the registry key
+    :param calls:
+    :param period:
+    :return:
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                await self.rate_limiters.get(name, calls, period).acquire_async()
+
+                return await func(self, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            self.rate_limiters.get(name, calls, period).acquire()
+
+            return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
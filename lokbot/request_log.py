@@ -0,0 +1,112 @@
+import collections
+import json
+import random
+import threading
+import time
+
+from lokbot import logger, project_root
+
+
+class RequestLog:
+    """
+    Debug log of api exchanges
+
+    A record is serialized only when a sink accepts its level (loguru lazy evaluation),
+    large strings and lists are summarized and each endpoint can be sampled.
+    The last `ring_buffer_size` full exchanges are kept in memory for `dump`.
+    """
+
+    def __init__(self, name, max_body_length=1024, max_list_items=20, ring_buffer_size=50, sampling=None,
+                 max_dumps=10, min_dump_interval=60):
+        """
+        :param name: used in the file name of dumps
+        :param max_body_length: strings longer than this are summarized
+        :param max_list_items: lists longer than this are cut
+        :param ring_buffer_size: how many full exchanges to keep
+        :param sampling: {api_path: rate}, 0 disables the debug log of the endpoint, default 1
+        :param max_dumps: dump files kept per name, the oldest are deleted
+        :param min_dump_interval: seconds between two dumps of this log
+        """
+        self.name = name
+        self.max_body_length = max_body_length
+        self.max_list_items = max_list_items
+        self.sampling = sampling or {}
+        self.max_dumps = max_dumps
+        self.min_dump_interval = min_dump_interval
+
+        self._lock = threading.Lock()
+        self._dumped_at = 0
+        self.exchanges = collections.deque(maxlen=ring_buffer_size)
+
+    def _summarize(self, value):
+        if isinstance(value, str) and len(value) > self.max_body_length:
+            return f'{value[:self.max_body_length]}...<{len(value)} chars>'
+
+        if isinstance(value, dict):
+            return {k: self._summarize(v) for k, v in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            if len(value) > self.max_list_items:
+                return [self._summarize(v) for v in value[:self.max_list_items]] + [
+                    f'...<{len(value)} items>'
+                ]
+
+            return [self._summarize(v) for v in value]
+
+        return value
+
+    def serialize(self, log_data):
+        return json.dumps(self._summarize(log_data), default=str)
+
+    def record(self, api_path, log_data):
+        """
+        keep the exchange and log it at debug level
+        :param api_path:
+        :param log_data: {'url', 'data', 'elapsed', 'res'}
+        :return:
+        """
+        with self._lock:
+            self.exchanges.append((time.time(), log_data))
+
+        rate = self.sampling.get(api_path, 1)
+        if rate < 1 and random.random() >= rate:
+            return
+
+        logger.opt(lazy=True).debug('{}', lambda: self.serialize(log_data))
+
+    def error(self, log_data):
+        with self._lock:
+            self.exchanges.append((time.time(), log_data))
+
+        logger.error(self.serialize(log_data))
+
+    def dump(self, reason=''):
+        """
+        write the buffered exchanges to `data/requests_{name}_{timestamp}.json`,
+        at most once per `min_dump_interval` and keeping the last `max_dumps` files
+        :param reason:
+        :return: path of the dump, None when skipped
+        """
+        with self._lock:
+            if time.time() - self._dumped_at < self.min_dump_interval:
+                return None
+
+            self._dumped_at = time.time()
+            exchanges = list(self.exchanges)
+
+        path = project_root.joinpath(f'data/requests_{self.name}_{time.time_ns()}.json')
+        path.write_text(json.dumps({
+            'reason': reason,
+            'exchanges': [{'time': t, **log_data} for t, log_data in exchanges],
+        }, default=str, indent=2))
+
+        logger.warning(f'dumped {len(exchanges)} api exchanges to {path}: {reason}')
+        self._rotate()
+
+        return path
+
+    def _rotate(self):
+        # the timestamps in the names have the same length, name order is age order
+        dumps = sorted(project_root.joinpath('data').glob(f'requests_{self.name}_*.json'))
+        for each in dumps[:max(len(dumps) - self.max_dumps, 0)]:
+            each.unlink(missing_ok=True)
@@ -0,0 +1,135 @@
+import functools
+import threading
+
+from lokbot.enum import RESEARCH_CODE_MAP, RESEARCH_MINIMUM_LEVEL_MAP, RESOURCE_IDX_MAP, research_json
+
+
+class Research:
+    __slots__ = ('category_name', 'name', 'code', 'max_level', 'minimum_level', 'academy_levels', 'prerequisites',
+                 'costs')
+
+    def __init__(self, category_name, name, code, levels):
+        research_category = RESEARCH_CODE_MAP[category_name]
+
+        self.category_name = category_name
+        self.name = name
+        self.code = code
+        self.max_level = int(levels[-1].get('level'))
+        self.minimum_level = RESEARCH_MINIMUM_LEVEL_MAP.get(category_name, {}).get(name, 0)
+
+        # indexed by the current level, entry `i` is what it takes to reach level `i + 1`
+        self.academy_levels = []
+        self.prerequisites = []  # [((code, level), ...), ...]
+        self.costs = []  # [(food, lumber, stone, gold), ...]
+        for each_level in levels:
+            academy_level = 0
+            prerequisites = []
+            for requirement in each_level.get('requirements'):
+                if requirement.get('type') == 'academy':
+                    academy_level = int(requirement.get('level'))
+                    continue
+
+                prerequisites.append((research_category.get(requirement.get('type')), int(requirement.get('level'))))
+
+            cost = [0] * len(RESOURCE_IDX_MAP)
+            for res_requirement in each_level.get('resources'):
+                cost[RESOURCE_IDX_MAP[res_requirement.get('type')]] = int(res_requirement.get('value'))
+
+            self.academy_levels.append(academy_level)
+            self.prerequisites.append(tuple(prerequisites))
+            self.costs.append(tuple(cost))
+
+
+@functools.lru_cache()
+def all_researches():
+    """
+    static research tree from `research_json`, in the priority order of `RESEARCH_CODE_MAP`
+    :return:
+    """
+    return tuple(
+        Research(category_name, research_name, research_code, research_json[research_code])
+        for category_name, each_category in RESEARCH_CODE_MAP.items()
+        for research_name, research_code in each_category.items()
+    )
+
+
+class ResearchIndex:
+    """
+    Current research levels of a kingdom over the static research tree
+
+    Seeded from `kingdom/arcademy/research/list`, then kept up to date with `start` / `finish`
+    as researches go through the academy queue.
+    """
+
+    def __init__(self):
+        self.levels = {}
+        self.synced = False
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def sync(self, exist_researches):
+        """
+        replace the levels with the ones from the server
+        :param exist_researches: `researches` of `kingdom/arcademy/research/list`
+        :return:
+        """
+        with self._lock:
+            self.levels = {each.get('code'): each.get('level') for each in exist_researches}
+            self._pending = None
+            self.synced = True
+
+    def level(self, code):
+        return self.levels.get(code, 0)
+
+    def start(self, code):
+        """
+        a research has been started, applied by `finish`
+        :param code:
+        :return:
+        """
+        with self._lock:
+            self._pending = code
+
+    def finish(self):
+        """
+        the research in the academy queue is done, no-op when nothing is pending
+        :return: code of the finished research or None
+        """
+        with self._lock:
+            code, self._pending = self._pending, None
+            if code is not None:
+                self.levels[code] = self.levels.get(code, 0) + 1
+
+        return code
+
+    def researchable(self, academy_level, resources, to_max_level=False):
+        """
+        every research that can be started now, in priority order
+        :param academy_level:
+        :param resources: [food, lumber, stone, gold]
+        :param to_max_level: False to stop at `RESEARCH_MINIMUM_LEVEL_MAP`
+        :return: list of `Research`
+        """
+        levels = self.levels
+        result = []
+        for research in all_researches():
+            current_level = levels.get(research.code, 0)
+
+            if current_level >= research.max_level:
+                continue
+
+            if not to_max_level and current_level and current_level >= research.minimum_level:
+                continue
+
+            if research.academy_levels[current_level] > academy_level:
+                continue
+
+            if any(levels.get(code, 0) < level for code, level in research.prerequisites[current_level]):
+                continue
+
+            if any(have < need for have, need in zip(resources, research.costs[current_level])):
+                continue
+
+            result.append(research)
+
+        return result
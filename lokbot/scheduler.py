@@ -0,0 +1,219 @@
+import heapq
+import itertools
+import threading
+import time
+
+from lokbot import logger, config
+
+# workers for the short jobs, each account adds one per loop with `add_workers`
+DEFAULT_WORKERS = 4
+
+
+class Job:
+    __slots__ = ('key', 'func', 'args', 'kwargs', 'run_at', 'cancelled')
+
+    def __init__(self, key, func, args, kwargs, run_at):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.run_at = run_at
+        self.cancelled = False
+
+    def __repr__(self):
+        return f'Job(key={self.key!r}, in={self.run_at - time.time():.0f}s)'
+
+
+class Scheduler:
+    """
+    Runs delayed jobs on a fixed pool of worker threads
+
+    Jobs wait in a heap by run time, the workers pop them when they are due.
+    At most one job is pending per key: submitting a key already pending keeps a single job
+    at the earlier of both times, with the arguments of the last submit.
+    A job blocks its worker while it sleeps or retries (e.g. an hour on `ExceedLimitPacketException`),
+    the pool needs a worker per loop that can block on top of `workers`.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self._condition = threading.Condition()
+        self._heap = []  # (run_at, seq, Job), cancelled and rescheduled jobs are skipped
+        self._seq = itertools.count()
+        self._pending = {}  # key: Job
+        self._running = {}  # thread name: Job
+
+        self._threads = []
+        self.add_workers(workers)
+
+    def add_workers(self, count):
+        """
+        start `count` more worker threads
+        :param count: e.g. the enabled loops of an account
+        :return:
+        """
+        with self._condition:
+            threads = [
+                threading.Thread(target=self._work, name=f'scheduler_{i}', daemon=True)
+                for i in range(len(self._threads), len(self._threads) + count)
+            ]
+            self._threads += threads
+
+        [thread.start() for thread in threads]
+
+    @property
+    def workers(self):
+        return len(self._threads)
+
+    def submit(self, key, func, *args, delay=0, **kwargs):
+        """
+        :param key: identifies the job for coalescing and `cancel`, e.g. f'{farmer_id}:quest_monitor'
+        :param func:
+        :param args:
+        :param delay: seconds
+        :param kwargs:
+        :return: the pending `Job`
+        """
+        run_at = time.time() + delay
+
+        with self._condition:
+            job = self._pending.get(key)
+            if job is not None:
+                job.func, job.args, job.kwargs = func, args, kwargs
+                if job.run_at <= run_at:
+                    return job
+
+                # the heap entry at the later time is skipped
+                job.cancelled = True
+
+            job = self._pending[key] = Job(key, func, args, kwargs, run_at)
+            heapq.heappush(self._heap, (run_at, next(self._seq), job))
+            self._condition.notify()
+
+        return job
+
+    def cancel(self, key):
+        """
+        :param key:
+        :return: whether a pending job was cancelled
+        """
+        with self._condition:
+            job = self._pending.pop(key, None)
+            if job is None:
+                return False
+
+            job.cancelled = True
+
+        return True
+
+    def pending(self):
+        """
+        :return: pending jobs, soonest first
+        """
+        with self._condition:
+            return sorted(self._pending.values(), key=lambda job: job.run_at)
+
+    def running(self):
+        with self._condition:
+            return list(self._running.values())
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                wait = self._heap[0][0] - time.time()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                _, _, job = heapq.heappop(self._heap)
+                del self._pending[job.key]
+                self._running[threading.current_thread().name] = job
+
+                return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                logger.exception(f'job {job.key} failed: {e}')
+            finally:
+                with self._condition:
+                    self._running.pop(threading.current_thread().name, None)
+
+
+class Trigger:
+    """
+    `threading.Event` replacement that schedules the waiters instead of blocking a thread
+
+    `set` with nobody waiting is remembered, the next `then` runs right away and consumes it,
+    just like `wait()` followed by `clear()`.
+    """
+
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler or get_scheduler()
+        self._lock = threading.Lock()
+        self._flag = False
+        self._waiters = {}  # key: (func, args, kwargs)
+
+    def is_set(self):
+        return self._flag
+
+    def set(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, {}
+            self._flag = not waiters
+
+        for key, (func, args, kwargs) in waiters.items():
+            self.scheduler.submit(key, func, *args, **kwargs)
+
+    def clear(self):
+        with self._lock:
+            self._flag = False
+
+    def then(self, key, func, *args, **kwargs):
+        """
+        run `func` on the scheduler once set
+        :param key: job key, a key waits once
+        :param func:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        with self._lock:
+            if not self._flag:
+                self._waiters[key] = (func, args, kwargs)
+                return
+
+            self._flag = False
+
+        self.scheduler.submit(key, func, *args, **kwargs)
+
+    def cancel(self, key):
+        with self._lock:
+            return self._waiters.pop(key, None) is not None
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """
+    one scheduler for the whole process
+    :return:
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(config.get('scheduler', {}).get('workers', DEFAULT_WORKERS))
+
+        return _scheduler
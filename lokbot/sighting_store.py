@@ -0,0 +1,274 @@
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+
+import lokbot.geo
+from lokbot import logger, project_root
+
+# rows written per transaction, and the longest a sighting waits to be written
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 2
+
+DEFAULT_RETENTION = 30 * 24 * 3600
+# retention and compaction run this often from the writer
+MAINTENANCE_INTERVAL = 3600
+
+# `PRAGMA auto_vacuum` value, lets `incremental_vacuum` give the pages of pruned sightings back
+AUTO_VACUUM_INCREMENTAL = 2
+
+# radius queries over more zones than this do not filter on zones in sql
+MAX_QUERY_ZONES = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sightings (
+    id INTEGER PRIMARY KEY,
+    seen_at REAL NOT NULL,
+    world_id INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    zone_id INTEGER NOT NULL,
+    code INTEGER NOT NULL,
+    level INTEGER,
+    object_id TEXT,
+    occupied TEXT
+);
+CREATE INDEX IF NOT EXISTS sightings_code_level_time ON sightings (code, level, seen_at);
+CREATE INDEX IF NOT EXISTS sightings_location ON sightings (world_id, zone_id, seen_at);
+CREATE INDEX IF NOT EXISTS sightings_time ON sightings (seen_at);
+"""
+
+COLUMNS = ('seen_at', 'world_id', 'x', 'y', 'zone_id', 'code', 'level', 'object_id', 'occupied')
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+    return conn
+
+
+def _enable_auto_vacuum(path):
+    """
+    `auto_vacuum` only applies to a file without pages yet, and switching to wal writes the first page:
+    set it on a plain connection first, existing files without it are converted by one VACUUM
+    :param path:
+    :return:
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute(f'PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}')
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            logger.info(f'converting {path} to incremental auto_vacuum')
+            conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+
+def _to_dict(row):
+    result = dict(row)
+    result['loc'] = [result['world_id'], result['x'], result['y']]
+    result['occupied'] = json.loads(result['occupied']) if result['occupied'] else None
+
+    return result
+
+
+class SightingStore:
+    """
+    Append-only history of the field objects found, in `data/sightings.sqlite3`
+
+    `add` only queues, a background writer inserts the sightings in batches.
+    Indexed by (code, level, time) and by (world, zone, time), sightings older than `retention` seconds are deleted.
+    """
+
+    def __init__(self, path=None, retention=DEFAULT_RETENTION):
+        self.path = str(path or project_root.joinpath('data/sightings.sqlite3'))
+        self.retention = retention
+
+        _enable_auto_vacuum(self.path)
+        conn = _connect(self.path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name='sighting_store', daemon=True)
+        self._writer.start()
+
+    def add(self, each_obj, seen_at=None):
+        """
+        :param each_obj: decoded object of `/field/objects/v4`
+        :param seen_at:
+        :return:
+        """
+        loc = each_obj.get('loc')
+        if not loc or len(loc) != 3:
+            return
+
+        occupied = each_obj.get('occupied')
+        self._queue.put((
+            seen_at or time.time(), loc[0], loc[1], loc[2], lokbot.geo.zone_id_by_coords(loc[1], loc[2]),
+            each_obj.get('code'), each_obj.get('level'), each_obj.get('_id'),
+            json.dumps(occupied, separators=(',', ':')) if occupied else None
+        ))
+
+    def flush(self):
+        """
+        wait until everything added so far is written
+        :return:
+        """
+        self._queue.join()
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        maintained_at = 0
+
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(rows) < BATCH_SIZE:
+                try:
+                    rows.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                with conn:
+                    conn.executemany(
+                        f'INSERT INTO sightings ({",".join(COLUMNS)}) VALUES ({",".join("?" * len(COLUMNS))})', rows
+                    )
+
+                if time.monotonic() - maintained_at > MAINTENANCE_INTERVAL:
+                    maintained_at = time.monotonic()
+                    self._maintain(conn)
+            except sqlite3.Error as e:
+                logger.error(f'failed to write {len(rows)} sightings: {e}')
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def _maintain(self, conn):
+        removed = self.prune(conn=conn)
+        if removed:
+            # `execute` only steps the pragma once, freeing a single page
+            conn.executescript('PRAGMA incremental_vacuum;')
+
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def prune(self, now=None, conn=None):
+        """
+        delete the sightings older than `retention`
+        :param now:
+        :param conn:
+        :return: number of sightings deleted
+        """
+        conn = conn or self._reader()
+        with conn:
+            cursor = conn.execute('DELETE FROM sightings WHERE seen_at < ?', ((now or time.time()) - self.retention,))
+
+        return cursor.rowcount
+
+    def _reader(self):
+        # one connection per thread, wal readers do not block the writer
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+
+        return conn
+
+    def query(self, code=None, levels=None, since=None, until=None, world_id=None, zone_ids=None, limit=None):
+        """
+        :param code:
+        :param levels: iterable of levels, None for all
+        :param since: timestamp, None for all
+        :param until: timestamp, None for all
+        :param world_id:
+        :param zone_ids: iterable of zone ids, requires `world_id`
+        :param limit:
+        :return: list of dict, latest first
+        """
+        conditions = []
+        params = []
+        if code is not None:
+            conditions.append('code = ?')
+            params.append(code)
+        if levels is not None:
+            levels = list(levels)
+            conditions.append(f'level IN ({",".join("?" * len(levels))})')
+            params.extend(levels)
+        if since is not None:
+            conditions.append('seen_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('seen_at < ?')
+            params.append(until)
+        if world_id is not None:
+            conditions.append('world_id = ?')
+            params.append(world_id)
+        if zone_ids is not None:
+            zone_ids = list(zone_ids)
+            conditions.append(f'zone_id IN ({",".join("?" * len(zone_ids))})')
+            params.extend(zone_ids)
+
+        sql = 'SELECT * FROM sightings'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY seen_at DESC'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+
+        return [_to_dict(row) for row in self._reader().execute(sql, params)]
+
+    def within(self, loc, radius, since=None, code=None, levels=None):
+        """
+        sightings within `radius` coordinates of `loc`, e.g. code X in the last 6 hours around the kingdom
+        :param loc: [world_id, x, y]
+        :param radius:
+        :param since: timestamp, None for all
+        :param code:
+        :param levels:
+        :return: list of dict, nearest first
+        """
+        zone_ids = lokbot.geo.nearest_zones(loc[1], loc[2], math.ceil(radius / lokbot.geo.ZONE_SIZE))
+        if len(zone_ids) > MAX_QUERY_ZONES:
+            # most of the world, scanning by time is cheaper than that many bound parameters
+            zone_ids = None
+        rows = self.query(code, levels, since, world_id=loc[0], zone_ids=zone_ids)
+
+        for row in rows:
+            row['distance'] = math.hypot(row['x'] - loc[1], row['y'] - loc[2])
+
+        return sorted((row for row in rows if row['distance'] <= radius), key=lambda row: row['distance'])
+
+    def counts(self, since=None):
+        """
+        :param since: timestamp, None for all
+        :return: {(code, level): number of sightings}
+        """
+        rows = self._reader().execute(
+            'SELECT code, level, COUNT(*) FROM sightings WHERE seen_at >= ? GROUP BY code, level', (since or 0,)
+        )
+
+        return {(code, level): count for code, level, count in rows}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SightingStore:
+    """
+    one store for the whole process
+    :return:
+    """
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = SightingStore()
+
+        return _store
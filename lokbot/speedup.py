@@ -0,0 +1,129 @@
+"""
+Speedup item allocation
+
+Picks the items that cover a remaining duration as closely as possible:
+without going over it (`at_least=False`, time past the end of a task is wasted),
+or reaching it with the smallest overshoot (`at_least=True`, e.g. healing).
+Solved exactly as a bounded knapsack over multiples of the gcd of the item durations.
+"""
+import functools
+import math
+
+import numpy
+
+# upper bound of the dp table, 65536 units is ~45 days of 1 minute items
+MAX_UNITS = 1 << 16
+
+# item costs, preferred items are used before others of the same duration
+ITEM_COST = 2
+UNPREFERRED_ITEM_COST = 3
+
+INFINITY = numpy.iinfo(numpy.int64).max // 2
+
+
+def _pieces(amount):
+    """
+    split `amount` copies into 1, 2, 4, ..., rest, every count up to `amount` is a sum of a subset
+    :param amount:
+    :return:
+    """
+    piece = 1
+    while amount > 0:
+        yield min(piece, amount)
+        amount -= piece
+        piece <<= 1
+
+
+def _plan(counts, seconds):
+    counts = {code: count for code, count in counts.items() if count > 0}
+    if not counts:
+        return None
+
+    counts = dict(sorted(counts.items(), key=lambda x: seconds[x[0]], reverse=True))
+
+    return {
+        'counts': counts,
+        'used_seconds': sum(seconds[code] * count for code, count in counts.items()),
+    }
+
+
+def optimal_speedups(need_seconds, inventory, at_least=False, preferred=()):
+    """
+    :param need_seconds:
+    :param inventory: {code: (seconds, amount)}
+    :param at_least: True to cover `need_seconds` entirely, with the smallest overshoot
+    :param preferred: codes to use before the others of the same duration
+    :return: {'counts': {code: count}, 'used_seconds': int}, largest items first, or None
+    """
+    inventory = {code: (second, amount) for code, (second, amount) in inventory.items() if second > 0 and amount > 0}
+    if not inventory or need_seconds <= 0:
+        return None
+
+    seconds = {code: second for code, (second, amount) in inventory.items()}
+    total_seconds = sum(second * amount for second, amount in inventory.values())
+
+    # not enough for the whole duration, everything is used either way
+    if total_seconds <= need_seconds:
+        return _plan({code: amount for code, (second, amount) in inventory.items()}, seconds)
+
+    unit = functools.reduce(math.gcd, seconds.values())
+    if at_least:
+        need_units = -(-need_seconds // unit)
+    else:
+        need_units = need_seconds // unit
+
+    counts = {code: 0 for code in inventory}
+    remaining = {code: amount for code, (second, amount) in inventory.items()}
+
+    # bounded time: cover the part above `MAX_UNITS` with the largest items first
+    for code in sorted(inventory, key=lambda x: seconds[x], reverse=True):
+        value = seconds[code] // unit
+        if need_units <= MAX_UNITS:
+            break
+
+        count = min(remaining[code], (need_units - MAX_UNITS) // value + 1)
+        counts[code] += count
+        remaining[code] -= count
+        need_units -= count * value
+
+    if need_units <= 0:
+        return _plan(counts, seconds)
+
+    target = need_units
+    if at_least:
+        target += max(seconds[code] // unit for code in inventory if remaining[code])
+
+    dp = numpy.full(target + 1, INFINITY, dtype=numpy.int64)
+    dp[0] = 0
+
+    pieces = []
+    taken = []
+    for code, amount in remaining.items():
+        value = seconds[code] // unit
+        cost = ITEM_COST if code in preferred or not preferred else UNPREFERRED_ITEM_COST
+
+        for count in _pieces(amount):
+            size = value * count
+            if size > target:
+                continue
+
+            candidate = dp[:-size] + cost * count
+            improved = candidate < dp[size:]
+            dp[size:] = numpy.where(improved, candidate, dp[size:])
+
+            pieces.append((code, count, size))
+            taken.append(numpy.concatenate((numpy.zeros(size, dtype=bool), improved)))
+
+    reachable = numpy.flatnonzero(dp < INFINITY)
+    if at_least:
+        over = reachable[reachable >= need_units]
+        best = int(over[0]) if len(over) else int(reachable[-1])
+    else:
+        best = int(reachable[reachable <= need_units][-1])
+
+    for (code, count, size), each_taken in zip(reversed(pieces), reversed(taken)):
+        if best and each_taken[best]:
+            counts[code] += count
+            best -= size
+
+    return _plan(counts, seconds)
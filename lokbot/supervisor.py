@@ -0,0 +1,328 @@
+import asyncio
+import collections
+import signal
+import time
+
+import psutil
+
+from lokbot import logger
+
+# seconds before a child restarts, doubled after each quick exit up to the second
+RESTART_DELAY = (5, 600)
+# a child running this long is considered healthy again, its next restart waits `RESTART_DELAY[0]`
+STABLE_AFTER = 300
+# seconds between `terminate` and `kill` on stop
+STOP_TIMEOUT = 5
+# seconds between two psutil samples of the children
+SAMPLE_INTERVAL = 30
+# longer lines are cut, see `asyncio.StreamReader.readline`
+LINE_LIMIT = 1024 * 1024
+# last lines kept per child, e.g. to explain a failed start
+TAIL_SIZE = 10
+
+
+def exit_reason(returncode):
+    """
+    :param returncode: `asyncio.subprocess.Process.returncode`
+    :return: e.g. 'exit:0', 'exit:1', 'signal:SIGKILL'
+    """
+    if returncode is not None and returncode < 0:
+        try:
+            return f'signal:{signal.Signals(-returncode).name}'
+        except ValueError:
+            return f'signal:{-returncode}'
+
+    return f'exit:{returncode}'
+
+
+class Child:
+    """
+    One supervised process, restarted with backoff until stopped or given up
+
+    `on_line(child, stream, line)` is awaited for every line of stdout / stderr (`stream` is 'stdout' or 'stderr'),
+    `on_exit(child, reason, restart_delay)` after every exit, `restart_delay` is None when it will not restart.
+    """
+
+    def __init__(self, key, argv, on_line=None, on_exit=None, env=None):
+        self.key = key
+        self.argv = argv
+        self.on_line = on_line
+        self.on_exit = on_exit
+        self.env = env
+
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.exit_reasons = collections.Counter()
+        self.tail = collections.deque(maxlen=TAIL_SIZE)
+        self.stats = {}
+
+        self._ps = None
+        self._stopping = False
+        self._give_up_reason = None
+        self._stopped = None  # asyncio.Event, wakes the restart delay up
+        self._task = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def alive(self):
+        """
+        running, or waiting to restart
+        """
+        return self._task is not None and not self._task.done()
+
+    def give_up(self, reason):
+        """
+        stop the child for good, e.g. from `on_line` once its token is rejected
+        :param reason: counted as the exit reason
+        :return:
+        """
+        self._give_up_reason = reason
+        self._set_stopping()
+
+    def _set_stopping(self):
+        self._stopping = True
+        if self._stopped is not None:
+            self._stopped.set()
+        self._terminate()
+
+    def _terminate(self):
+        if self.running:
+            try:
+                self.process.terminate()
+            except ProcessLookupError:
+                pass
+
+    async def stop(self, timeout=STOP_TIMEOUT):
+        """
+        terminate, kill after `timeout` seconds, and wait for the supervision to end
+        :param timeout:
+        :return:
+        """
+        self._set_stopping()
+
+        if self.running:
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f'child {self.key} did not terminate in {timeout}s, killing')
+                self.process.kill()
+
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def start(self):
+        self._stopped = asyncio.Event()
+        self._task = asyncio.ensure_future(self._supervise())
+
+        return self._task
+
+    async def _read(self, stream_name, stream):
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # over `LINE_LIMIT`, the buffered part is dropped
+                logger.warning(f'child {self.key}: {stream_name} line over {LINE_LIMIT} bytes dropped')
+                continue
+
+            if not line:
+                return
+
+            line = line.decode(errors='replace').rstrip('\r\n')
+            self.tail.append(line)
+
+            if self.on_line is None:
+                continue
+
+            try:
+                await self.on_line(self, stream_name, line)
+            except Exception as e:
+                logger.exception(f'child {self.key}: on_line failed: {e}')
+
+    async def _run_once(self):
+        self.started_at = None
+        if self._stopping:
+            return None
+
+        self.process = await asyncio.create_subprocess_exec(
+            *self.argv,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=self.env,
+            limit=LINE_LIMIT,
+        )
+        self.started_at = time.time()
+        self._ps = None
+        logger.info(f'child {self.key} started, pid {self.process.pid}')
+
+        # stopped while spawning, `_terminate` had no process yet
+        if self._stopping:
+            self._terminate()
+
+        # both pipes until eof, then the exit code
+        await asyncio.gather(
+            self._read('stdout', self.process.stdout),
+            self._read('stderr', self.process.stderr),
+        )
+
+        return await self.process.wait()
+
+    async def _supervise(self):
+        restart_delay = RESTART_DELAY[0]
+
+        while True:
+            try:
+                returncode = await self._run_once()
+                reason = exit_reason(returncode)
+            except OSError as e:
+                # e.g. executable not found, retried like an exit
+                logger.error(f'child {self.key} could not start: {e}')
+                reason = f'spawn:{type(e).__name__}'
+
+            if self._give_up_reason is not None:
+                reason = self._give_up_reason
+            elif self._stopping:
+                reason = 'stopped'
+            self.exit_reasons[reason] += 1
+
+            if self.started_at is not None and time.time() - self.started_at >= STABLE_AFTER:
+                restart_delay = RESTART_DELAY[0]
+
+            will_restart = not self._stopping
+            if will_restart:
+                logger.info(f'child {self.key} exited ({reason}), restarting in {restart_delay}s')
+            else:
+                logger.info(f'child {self.key} exited ({reason})')
+
+            if self.on_exit is not None:
+                try:
+                    await self.on_exit(self, reason, restart_delay if will_restart else None)
+                except Exception as e:
+                    logger.exception(f'child {self.key}: on_exit failed: {e}')
+
+            if not will_restart:
+                return reason
+
+            try:
+                await asyncio.wait_for(self._stopped.wait(), restart_delay)
+                return reason
+            except asyncio.TimeoutError:
+                pass
+
+            restart_delay = min(restart_delay * 2, RESTART_DELAY[1])
+            self.restarts += 1
+
+    def sample(self):
+        """
+        update `stats` with psutil, the cpu percent is since the previous sample
+        :return:
+        """
+        if not self.running:
+            self.stats = {}
+            return self.stats
+
+        try:
+            if self._ps is None or self._ps.pid != self.process.pid:
+                self._ps = psutil.Process(self.process.pid)
+                # the first call only starts the measure
+                self._ps.cpu_percent(None)
+
+            with self._ps.oneshot():
+                self.stats = {
+                    'rss': self._ps.memory_info().rss,
+                    'cpu_percent': self._ps.cpu_percent(None),
+                    'uptime': time.time() - self.started_at,
+                }
+        except psutil.Error:
+            self.stats = {}
+
+        return self.stats
+
+
+class Supervisor:
+    """
+    Children by key, each read through asyncio stream readers instead of polling its pipes
+    """
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self.children = {}  # key: Child
+        self.exit_reasons = collections.Counter()
+
+        self._sampler = None
+
+    def get(self, key):
+        return self.children.get(key)
+
+    def start(self, key, argv, on_line=None, on_exit=None, env=None) -> Child:
+        """
+        :param key: e.g. the discord user id
+        :param argv:
+        :param on_line: see `Child`
+        :param on_exit: see `Child`
+        :param env:
+        :return:
+        """
+        child = self.children.get(key)
+        assert child is None or not child.alive, f'child {key} is already running'
+
+        async def count_exit(_child, reason, restart_delay):
+            self.exit_reasons[reason] += 1
+            if on_exit is not None:
+                await on_exit(_child, reason, restart_delay)
+
+        child = self.children[key] = Child(key, argv, on_line, count_exit, env)
+        child.start()
+
+        if self._sampler is None or self._sampler.done():
+            self._sampler = asyncio.ensure_future(self._sample_forever())
+
+        return child
+
+    async def stop(self, key, timeout=STOP_TIMEOUT):
+        """
+        :param key:
+        :param timeout:
+        :return: whether there was a child to stop
+        """
+        child = self.children.pop(key, None)
+        if child is None:
+            return False
+
+        await child.stop(timeout)
+
+        return True
+
+    async def stop_all(self, timeout=STOP_TIMEOUT):
+        await asyncio.gather(*[self.stop(key, timeout) for key in list(self.children)])
+
+    def sample(self):
+        """
+        :return: {key: stats} of the running children
+        """
+        return {key: child.sample() for key, child in list(self.children.items()) if child.running}
+
+    async def _sample_forever(self):
+        while self.children:
+            self.sample()
+            await asyncio.sleep(self.sample_interval)
+
+    def stats(self):
+        children = list(self.children.values())
+
+        return {
+            'children': len(children),
+            'running': sum(child.running for child in children),
+            'restarts': sum(child.restarts for child in children),
+            'rss': sum(child.stats.get('rss', 0) for child in children),
+            'cpu_percent': sum(child.stats.get('cpu_percent', 0) for child in children),
+            'exit_reasons': dict(self.exit_reasons),
+        }
@@ -0,0 +1,217 @@
+import math
+
+from lokbot.enum import *
+
+# bit `level` is set for every level allowed
+ALL_LEVELS = (1 << 64) - 1
+
+RESOURCE_NAMES = {
+    OBJECT_CODE_CRYSTAL_MINE: 'Crystal Mine',
+    OBJECT_CODE_DRAGON_SOUL_CAVERN: 'Dragon Soul Cavern',
+}
+
+# shared to chat when `share_to` has no `rules`
+DEFAULT_SHARE_RULES = [{'code': OBJECT_CODE_CRYSTAL_MINE, 'level': [1, 2]}]
+
+EMBEDS = ('object_log', 'all_resources')
+
+
+def level_mask(levels=None, min_level=None, max_level=None):
+    """
+    :param levels: list of levels, empty or None for all
+    :param min_level:
+    :param max_level:
+    :return: int with bit `level` set for every level allowed
+    """
+    mask = ALL_LEVELS
+    if levels:
+        mask = sum(1 << level for level in set(levels))
+    if min_level is not None:
+        mask &= ALL_LEVELS ^ ((1 << min_level) - 1)
+    if max_level is not None:
+        mask &= (1 << (max_level + 1)) - 1
+
+    return mask
+
+
+def default_routes(discord_config):
+    """
+    routes of the `*_webhook_url` keys of the `discord` config
+    :param discord_config:
+    :return:
+    """
+    routes = []
+    if discord_config.get('crystal_mine_level1_webhook_url'):
+        routes.append({
+            'webhook_url': discord_config['crystal_mine_level1_webhook_url'],
+            'codes': [OBJECT_CODE_CRYSTAL_MINE], 'level': [1],
+            'title': '{obj_type} (Level {level} {resource_name})',
+        })
+    if discord_config.get('level2plus_webhook_url'):
+        routes.append({
+            'webhook_url': discord_config['level2plus_webhook_url'],
+            'min_level': 2,
+            'title': '{obj_type} (Level {level} {resource_name})',
+        })
+    # all but level 1 crystal mines
+    routes.append({
+        'webhook_url': discord_config['webhook_url'],
+        'except': [{'code': OBJECT_CODE_CRYSTAL_MINE, 'level': [1]}],
+        'title': '{obj_type} ({resource_name})',
+    })
+    if discord_config.get('custom_webhook_url'):
+        routes.append({
+            'webhook_url': discord_config['custom_webhook_url'],
+            'embed': 'all_resources',
+            'title': '{resource_name}',
+        })
+
+    return routes
+
+
+class Route:
+    __slots__ = ('webhook_url', 'level_mask', 'embed', 'title')
+
+    def __init__(self, webhook_url, mask, embed, title):
+        self.webhook_url = webhook_url
+        self.level_mask = mask
+        self.embed = embed
+        self.title = title
+
+
+class Target:
+    """
+    Compiled rule of one object code
+    """
+    __slots__ = ('code', 'level_mask', 'obj_type', 'resource_name', 'occupied', 'max_distance', 'alliance_tags',
+                 'exclude_alliance_tags', 'share_mask', 'routes')
+
+    def __init__(self, target, origin=None):
+        self.code = target['code']
+        self.level_mask = level_mask(target.get('level'), target.get('min_level'), target.get('max_level'))
+
+        if self.code in OBJECT_MINE_CODE_LIST:
+            self.obj_type = 'Resource'
+        elif self.code in OBJECT_MONSTER_CODE_LIST:
+            self.obj_type = 'Monster'
+        else:
+            # only counted, neither logged nor shared
+            self.obj_type = None
+        self.resource_name = RESOURCE_NAMES.get(self.code, f'Resource {self.code}')
+
+        # None: both
+        self.occupied = target.get('occupied')
+        self.max_distance = target.get('max_distance') if origin else None
+        alliance_tags = target.get('alliance_tags')
+        self.alliance_tags = frozenset(alliance_tags) if alliance_tags else None
+        self.exclude_alliance_tags = frozenset(target.get('exclude_alliance_tags') or ())
+
+        self.share_mask = 0
+        self.routes = ()
+
+
+class Decision:
+    __slots__ = ('target', 'level', 'share', 'routes')
+
+    def __init__(self, target, level, share, routes):
+        self.target = target
+        self.level = level
+        self.share = share
+        self.routes = routes
+
+
+class TargetMatcher:
+    """
+    Targets, chat sharing and Discord routing of `socf_thread`, compiled once into a table by code
+
+    `targets` items: {"code", "level": [], "min_level", "max_level", "occupied": true/false,
+    "max_distance": coordinates from the kingdom, "alliance_tags": [], "exclude_alliance_tags": []}
+    `share_to.rules` and `discord.routes` items: {"code" or "codes", "level": [], "min_level", "max_level"},
+    routes also have "webhook_url", "embed" (object_log / all_resources), "title" and "except": [rule, ...].
+    Without them the former hard-coded rules apply.
+    """
+
+    def __init__(self, targets, share_to=None, discord_config=None, origin=None):
+        """
+        :param targets:
+        :param share_to:
+        :param discord_config:
+        :param origin: [world_id, x, y] distances are measured from
+        """
+        self.origin = origin
+        self.by_code = {target['code']: Target(target, origin) for target in targets}
+        self.codes = frozenset(self.by_code)
+
+        share_to = share_to or {}
+        if share_to.get('chat_channels'):
+            for rule in share_to.get('rules', DEFAULT_SHARE_RULES):
+                for target in self._targets_of(rule):
+                    target.share_mask |= self._rule_mask(rule)
+
+        discord_config = discord_config or {}
+        if discord_config.get('enabled', False) and (discord_config.get('routes') or discord_config.get('webhook_url')):
+            routes = discord_config.get('routes') or default_routes(discord_config)
+            for target in self.by_code.values():
+                target.routes = tuple(self._compile_route(route, target.code) for route in routes)
+                target.routes = tuple(route for route in target.routes if route.level_mask)
+
+    def _targets_of(self, rule):
+        codes = rule.get('codes') or ([rule['code']] if 'code' in rule else list(self.by_code))
+
+        return [self.by_code[code] for code in codes if code in self.by_code]
+
+    @staticmethod
+    def _rule_mask(rule):
+        return level_mask(rule.get('level'), rule.get('min_level'), rule.get('max_level'))
+
+    def _compile_route(self, route, code):
+        embed = route.get('embed', 'object_log')
+        assert embed in EMBEDS, f'unknown embed {embed}'
+
+        mask = 0
+        if self.by_code[code] in self._targets_of(route):
+            mask = self._rule_mask(route)
+            for exception in route.get('except', []):
+                if self.by_code[code] in self._targets_of(exception):
+                    mask &= ALL_LEVELS ^ self._rule_mask(exception)
+
+        return Route(route['webhook_url'], mask, embed, route.get('title', '{obj_type} ({resource_name})'))
+
+    def _accepts(self, target, each_obj):
+        occupied = each_obj.get('occupied')
+        if target.occupied is not None and bool(occupied) != target.occupied:
+            return False
+
+        if target.alliance_tags is not None or target.exclude_alliance_tags:
+            alliance_tag = (occupied or {}).get('allianceTag')
+            if target.alliance_tags is not None and alliance_tag not in target.alliance_tags:
+                return False
+            if alliance_tag in target.exclude_alliance_tags:
+                return False
+
+        if target.max_distance is not None:
+            loc = each_obj.get('loc')
+            if loc[0] != self.origin[0] or \
+                    math.hypot(loc[1] - self.origin[1], loc[2] - self.origin[2]) > target.max_distance:
+                return False
+
+        return True
+
+    def match(self, each_obj):
+        """
+        :param each_obj: decoded object of `/field/objects/v4`
+        :return: `Decision`, or None when it is not a target
+        """
+        target = self.by_code.get(each_obj.get('code'))
+        if target is None:
+            return None
+
+        level = each_obj.get('level') or 0
+        if not (target.level_mask >> level) & 1 or not self._accepts(target, each_obj):
+            return None
+
+        return Decision(
+            target, level,
+            bool((target.share_mask >> level) & 1),
+            [route for route in target.routes if (route.level_mask >> level) & 1]
+        )
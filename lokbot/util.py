@@ -33,9 +33,5 @@ def run_functions_in_random_order(*funcs):
         func()
 
 
-def get_zone_id_by_coords(x, y):
-    return (x // 32) + 64 * (y // 32)
-
-
 def decode_jwt(token):
     return jwt.decode(token, options={'verify_signature': False})
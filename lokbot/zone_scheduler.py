@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+
+import numpy
+
+from lokbot import project_root
+
+# score = level + staleness + hit rate, each within 0~1 before weighting
+LEVEL_WEIGHT = 1.0
+STALENESS_WEIGHT = 1.5
+HIT_RATE_WEIGHT = 2.0
+
+# a zone is fully stale this long after its last scan
+STALE_AFTER = 6 * 3600
+
+# sum of the levels of the 16 lands of a zone, all at level 10
+MAX_ZONE_LEVEL_SUM = 160
+
+# hit rate of zones never scanned, smoothed over this many scans
+PRIOR_HIT_RATE = 0.5
+PRIOR_SCANS = 2
+
+
+class ZoneScheduler:
+    """
+    Orders the zones around a kingdom by how worth scanning they are
+
+    Zones with high leveled lands, not scanned for a while and where targets were found before come first.
+    The scan history is kept in `data/zones_{world_id}_{name}.json` across runs.
+    """
+
+    def __init__(self, world_id, name, zone_ids, zone_level_sums=None):
+        """
+        :param world_id:
+        :param name: distinguishes the history of several kingdoms on the same world
+        :param zone_ids: candidate zones
+        :param zone_level_sums: 64 * 64 sum of land levels per zone (`devrank_zone_sum`), or None
+        """
+        self.world_id = world_id
+        self.zone_ids = numpy.asarray(zone_ids, dtype=numpy.int64)
+        self.state_path = project_root.joinpath(f'data/zones_{world_id}_{name}.json')
+
+        if zone_level_sums is not None:
+            level_sums = numpy.asarray(zone_level_sums).ravel()[self.zone_ids]
+            self.level_scores = numpy.minimum(level_sums / MAX_ZONE_LEVEL_SUM, 1.0)
+        else:
+            self.level_scores = numpy.zeros(len(self.zone_ids))
+
+        self._lock = threading.Lock()
+        # zone_id: {'scanned_at': float, 'scans': int, 'hits': {code: int}}
+        self.history = {}
+        if self.state_path.exists():
+            try:
+                self.history = {int(k): v for k, v in json.loads(self.state_path.read_text()).items()}
+            except (ValueError, OSError):
+                self.history = {}
+
+    def scores(self, target_codes, now=None):
+        """
+        :param target_codes: only the hits of these codes count
+        :param now:
+        :return: score of every candidate zone, in `zone_ids` order
+        """
+        now = now or time.time()
+
+        staleness = numpy.ones(len(self.zone_ids))
+        hit_rates = numpy.full(len(self.zone_ids), PRIOR_HIT_RATE)
+        with self._lock:
+            for i, zone_id in enumerate(self.zone_ids.tolist()):
+                zone = self.history.get(zone_id)
+                if not zone:
+                    continue
+
+                staleness[i] = min((now - zone.get('scanned_at', 0)) / STALE_AFTER, 1.0)
+                hits = sum(zone.get('hits', {}).get(str(code), 0) for code in target_codes)
+                hit_rates[i] = (hits + PRIOR_HIT_RATE * PRIOR_SCANS) / (zone.get('scans', 0) + PRIOR_SCANS)
+
+        # hits per scan are unbounded, map them to 0~1
+        hit_scores = 1 - numpy.exp(-hit_rates)
+
+        return LEVEL_WEIGHT * self.level_scores + STALENESS_WEIGHT * staleness + HIT_RATE_WEIGHT * hit_scores
+
+    def batches(self, target_codes, budget, step):
+        """
+        the `budget` most valuable batches of `step` zones, best first
+        :param target_codes:
+        :param budget: number of zone enter/leave rounds allowed
+        :param step: zones entered at once
+        :return: [[zone_id, ...], ...]
+        """
+        order = numpy.argsort(-self.scores(target_codes), kind='stable')
+        zone_ids = self.zone_ids[order][:budget * step].tolist()
+
+        return [zone_ids[i:i + step] for i in range(0, len(zone_ids) - step + 1, step)]
+
+    def mark_scanned(self, zone_ids, now=None):
+        now = now or time.time()
+
+        with self._lock:
+            for zone_id in zone_ids:
+                zone = self.history.setdefault(int(zone_id), {'scanned_at': now, 'scans': 0, 'hits': {}})
+                zone['scanned_at'] = now
+                zone['scans'] += 1
+
+    def record_hit(self, zone_id, code):
+        with self._lock:
+            zone = self.history.setdefault(int(zone_id), {'scanned_at': 0, 'scans': 0, 'hits': {}})
+            zone['hits'][str(code)] = zone['hits'].get(str(code), 0) + 1
+
+    def save(self):
+        with self._lock:
+            content = json.dumps(self.history, separators=(',', ':'))
+
+        tmp_path = self.state_path.with_suffix('.tmp')
+        tmp_path.write_text(content)
+        os.replace(tmp_path, self.state_path)
+
+    def stats(self, target_codes):
+        with self._lock:
+            scans = sum(zone.get('scans', 0) for zone in self.history.values())
+            hits = sum(
+                zone.get('hits', {}).get(str(code), 0) for zone in self.history.values() for code in target_codes
+            )
+
+        return {'zones': len(self.history), 'scans': scans, 'hits': hits, 'hits_per_scan': hits / max(scans, 1)}